@@ -1,2 +1,4 @@
-from .wrapper import model_ihc, model_synapse, seed_rng, get_matlab
-from .cache import get_spiketrain
+from .wrapper import model_ihc, model_synapse, model_synapse_trials, seed_rng, get_matlab, set_matlab_workers, MatlabPool
+from .cache import get_spiketrain, get_spiketrains, prewarm, write_prewarm_manifest
+from .pool import SpikeTrainPool, SpikeTrains
+from .prefetch import SpikeTrainPrefetcher
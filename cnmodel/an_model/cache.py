@@ -3,10 +3,16 @@ Utilities for generating and caching spike trains from AN model.
 """
 
 import logging
-import os, sys, pickle
+import os, sys, time, atexit, pickle, hashlib, threading, json, ast
+from collections import OrderedDict
 import numpy as np
-from .wrapper import get_matlab, model_ihc, model_synapse, seed_rng
-from ..util.filelock import FileLock
+from .wrapper import (get_matlab, get_matlab_pool, model_ihc, model_synapse, 
+                      model_synapse_trials, seed_rng)
+from .store import SpikeTrainArchive, SpikeTrains, round_to_grid
+from . import fast
+from ..util.atomic import atomic_write
+from ..util.inflight import InFlight
+from ..util import fingerprint
 
 try:
     import cochlea
@@ -14,10 +20,77 @@ try:
 except ImportError:
     HAVE_COCHLEA = False
 
-_cache_version = 2
+try:
+    # Internal stages of cochlea.run_zilany2014(); these allow the IHC stage
+    # to be cached and shared between fibers with the same CF. Without them,
+    # each fiber is simulated by cochlea.run_zilany2014() (see 
+    # _run_zilany2014()).
+    from cochlea.zilany2014 import _zilany2014 as _cochlea_zilany
+except ImportError:
+    _cochlea_zilany = None
+
+_cache_version = 5
 _cache_path = os.path.join(os.path.dirname(__file__), 'cache')
-_index_file = os.path.join(_cache_path, 'index.pk')
-_index = None
+_archives = {}  # path: SpikeTrainArchive
+
+# Each stimulus directory is named by a fixed-length key (see get_stim_key()) 
+# and holds a human-readable manifest describing the stimulus. Alias files 
+# redirect the key of one stimulus to the directory of an equivalent stimulus
+# (see alias_stimulus()).
+_manifest_file = 'manifest.json'
+_alias_dir = '_alias'
+_aliases = {}  # (cache path, stimulus fingerprint): target key or None
+
+# If True, stimuli are identified by a hash of their generated waveform rather 
+# than their parameters (see set_hash_waveforms()).
+_hash_waveforms = False
+
+# Maximum total size of all spike train archives in bytes (None for no limit).
+# When exceeded, the least-recently used stimuli are evicted; see set_max_size().
+_cache_max_size = None
+
+# Usage statistics are accumulated in memory and periodically merged into 
+# this file in the cache directory (see flush_stats()).
+_index_file = 'index.pk'
+_stats = {}  # {stim_dir: {'hits': n, 'misses': n, ...}} not yet flushed
+_stats_flush_interval = 30.0
+_stats_last_flush = time.time()
+
+# IHC potentials are cached separately from spike trains (see get_ihc()), as 
+# are the firing rates used to resample spike trains (see get_rate()). These
+# waveforms are much larger than spike trains, so the IHC cache has its own 
+# size limit (in bytes); least-recently used waveforms are evicted first.
+_ihc_cache_dir = '_ihc'
+_ihc_cache_max_size = 2 * 1024**3
+# Size in bytes of each IHC cache directory as measured by the last call to 
+# evict_ihc_cache(), plus the waveforms this process has saved since. The 
+# directory is only scanned again when this total exceeds the limit.
+_ihc_cache_sizes = {}
+
+# Recently used spike trains are kept in memory in front of the disk cache. 
+# The memo maps (stimulus key, cf, sr, seed, opts) tuples to read-only 
+# arrays, in least- to most-recently used order. 
+_memo = OrderedDict()
+_memo_max_bytes = 256 * 1024**2
+_memo_stats = {'bytes': 0, 'hits': 0, 'misses': 0}
+_memo_lock = threading.Lock()
+
+# When a train is missing from the cache, a marker file is created while it is
+# generated so that other processes needing the same train wait for it rather
+# than generating it again (see set_in_flight_dedup()). Markers older than the
+# timeout (in seconds) are assumed to be left by processes that were killed.
+_in_flight_dedup = True
+_in_flight_timeout = 600.
+
+# Optionally, trains missing for a stimulus that differs from a cached one 
+# only in its leading and trailing silence are made by time-shifting the 
+# cached trains (see set_shift_reuse()). Stimuli with cached trains are 
+# listed under this directory by their onset fingerprint (see 
+# Sound.onset_fingerprint()).
+_shift_reuse = False
+_shift_recovery = 0.02
+_shift_dir = '_shift'
+_shift_stats = {'hits': 0, 'misses': 0}
 
 
 def get_spiketrain(cf, sr, stim, seed, **kwds):
@@ -26,6 +99,11 @@ def get_spiketrain(cf, sr, stim, seed, **kwds):
     Arrays are automatically cached and may be returned from disk if 
     available. See generate_spiketrain() for a description of arguments.
     
+    Spike trains are stored in a SpikeTrainArchive, with one archive per 
+    stimulus (see get_archive()). Trains stored in the older one-file-per-train
+    layout (see get_cache_filename()) are still read, and may be moved into the 
+    archives with migrate_legacy_cache().
+    
     If the flag --ignore-an-cache was given on the command line, then spike 
     times will be regenerated and cached, regardless of the current cache 
     state.
@@ -34,41 +112,315 @@ def get_spiketrain(cf, sr, stim, seed, **kwds):
     will not be read or written. This can improve overall performance if there
     is little chance the cache would be re-used.
     
+    Recently used trains are also kept in memory (see memo_info()); these are
+    returned without accessing the disk. Returned arrays are read-only.
+    
+    Reading the cache requires no locks. If the requested train is being 
+    generated by another process, this waits for it rather than generating
+    it again (see set_in_flight_dedup()).
+    
+    Optionally, missing trains may be made by time-shifting the trains of a 
+    cached stimulus that differs only in its onset (see set_shift_reuse()).
+    
+    If *ntrials* is given, a SpikeTrains instance holding that many trials
+    of the fiber is returned instead (see get_spiketrains()).
+    """
+    return get_spiketrains([cf], [sr], [seed], stim, **kwds)[0]
+
+
+def get_archive(stim):
+    """ Return the SpikeTrainArchive that holds all cached spike trains for 
+    *stim*.
+    """
+    return _get_archive(get_stim_key(stim))
+
+
+def _get_archive(stim_key):
+    path = os.path.join(_cache_path, stim_key)
+    if path not in _archives:
+        _archives[path] = SpikeTrainArchive(path)
+    return _archives[path]
+
+
+def get_stim_key(stim):
+    """ Return the fixed-length key that names the cache directory for *stim*.
+    
+    This is the fingerprint of the stimulus parameters (see 
+    Sound.fingerprint()), redirected by any alias registered with 
+    alias_stimulus(). If waveform hashing is enabled (see 
+    set_hash_waveforms()), the fingerprint of the generated waveform is used
+    instead, and an alias from the parameter fingerprint is recorded so that
+    the waveform need not be generated again to find the cached trains.
+    
+    Aliases are remembered for the life of the process, so aliases created by
+    other processes may not be seen until the next run.
     """
-    filename = get_cache_filename(cf=cf, sr=sr, seed=seed, stim=stim, **kwds)
-    subdir = os.path.dirname(filename)
+    fp = stim.fingerprint()
+    target = _resolve_alias(fp)
+    if target is not None:
+        return target
+    if _hash_waveforms:
+        target = stim.fingerprint(waveform=True)
+        if '--no-an-cache' not in sys.argv:
+            _write_alias(fp, target)
+        return target
+    return fp
+
+
+def set_hash_waveforms(enabled):
+    """ Set whether stimuli are identified by their generated waveform rather 
+    than their parameters.
     
-    if not os.path.exists(subdir):
+    With waveform hashing, stimuli that are specified differently but produce
+    identical waveforms share the same cached spike trains. Each distinct 
+    stimulus must be generated once to compute its fingerprint.
+    """
+    global _hash_waveforms
+    _hash_waveforms = enabled
+
+
+def alias_stimulus(stim, target):
+    """ Declare that *stim* is equivalent to *target*, so that spike trains 
+    requested for *stim* are read from (and written to) the cache directory 
+    of *target*.
+    
+    The alias is stored in the cache and is also listed in the manifest of 
+    *target*. Trains already cached for *stim* itself are no longer used, and
+    will eventually be evicted.
+    """
+    src = stim.fingerprint()
+    dst = get_stim_key(target)
+    if src == dst:
+        return
+    _write_alias(src, dst)
+    _write_manifest(os.path.join(_cache_path, dst), target, aliases=[src])
+
+
+def _resolve_alias(fp):
+    """ Return the key that stimulus fingerprint *fp* is aliased to, or None.
+    """
+    cache_key = (_cache_path, fp)
+    if cache_key not in _aliases:
+        target = None
+        filename = os.path.join(_cache_path, _alias_dir, fp)
+        if os.path.exists(filename):
+            try:
+                target = open(filename).read().strip() or None
+            except IOError:
+                pass
+        _aliases[cache_key] = target
+    return _aliases[cache_key]
+
+
+def _write_alias(src, dst):
+    """ Record that stimulus fingerprint *src* refers to cache key *dst*.
+    """
+    _aliases[(_cache_path, src)] = dst
+    if src == dst:
+        return
+    path = os.path.join(_cache_path, _alias_dir)
+    with atomic_write(os.path.join(path, src), 'w') as fh:
+        fh.write(dst)
+
+
+def _write_manifest(path, stim, aliases=()):
+    """ Create or update the manifest describing the stimulus whose trains are
+    stored in directory *path*.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        manifest = {
+            'key': os.path.basename(path),
+            'fingerprint_version': fingerprint.fingerprint_version,
+            'cache_version': _cache_version,
+            'stimulus': stim.key(),
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'aliases': [],
+        }
+    new = [a for a in aliases if a not in manifest['aliases']]
+    if os.path.exists(os.path.join(path, _manifest_file)) and len(new) == 0:
+        return
+    manifest['aliases'].extend(new)
+    with atomic_write(os.path.join(path, _manifest_file), 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True, default=_json_default)
+
+
+def read_manifest(path):
+    """ Return the manifest for the stimulus directory *path* as a dict, or 
+    None if it has no manifest.
+    
+    The manifest contains the keys 'key' (the directory name), 'stimulus' 
+    (the stimulus parameters; see Sound.key()), 'aliases' (fingerprints of 
+    stimuli aliased to this directory), 'fingerprint_version', 
+    'cache_version' and 'created'.
+    """
+    filename = os.path.join(path, _manifest_file)
+    if not os.path.exists(filename):
+        return None
+    try:
+        return json.load(open(filename))
+    except Exception:
+        logging.error("Error reading AN cache manifest %s", filename)
+        return None
+
+
+def _json_default(obj):
+    # convert numpy values in stimulus keys
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def _append(stim, archive, keys, trains):
+    """ Add trains for *stim* to *archive*, writing the manifest for new 
+    archives. Spike times on the sample grid of *stim* are stored in compact
+    integer form.
+    """
+    archive.append(keys, trains, tick=stim.dt)
+    if not os.path.exists(os.path.join(archive.path, _manifest_file)):
+        _write_manifest(archive.path, stim)
+    if _shift_reuse:
+        _register_onset(stim, os.path.basename(archive.path))
+
+
+def make_opts_key(**kwds):
+    """ Return a short, fixed-length string identifying the extra options used
+    to generate a spike train, used as the *opts* part of SpikeTrainArchive 
+    keys. Numeric options are normalized so that equivalent values give the
+    same key.
+    """
+    kwds = fingerprint.normalize(kwds)
+    key = make_key(**kwds).encode('utf8')
+    return hashlib.md5(key).hexdigest()[:16]
+
+
+def _load_cached(archive, stim, keys, kwds):
+    """ Return a list of cached spike trains for the given archive keys, 
+    falling back to the legacy cache files for *stim* (see 
+    get_cache_filename()). Trains that are not cached are returned as None.
+    """
+    trains = archive.get_many(keys)
+    if all([t is not None for t in trains]):
+        return trains
+    legacy_dir = os.path.join(_cache_path, make_key(**stim.key()))
+    if not os.path.isdir(legacy_dir):
+        return trains
+    for i, (cf, sr, seed, opts) in enumerate(keys):
+        filename = get_cache_filename(cf=cf, sr=sr, seed=seed, stim=stim, **kwds)
+        if trains[i] is not None or not os.path.exists(filename):
+            continue
         try:
-            os.mkdir(subdir)
-        except OSError as err:
-            # probably another process already created this directory
-            # since we last checked
-            pass
+            trains[i] = np.load(open(filename, 'rb'))['data']
+            logging.info("Loaded AN spike train from legacy cache: %s", filename)
+        except Exception:
+            sys.excepthook(*sys.exc_info())
+            logging.error("Error reading AN spike train cache file; will "
+                "re-generate. File: %s", filename)
+    return trains
+
+
+def migrate_legacy_cache(remove=False):
+    """ Move all spike trains stored in legacy stimulus directories (named by 
+    make_key() rather than get_stim_key()) into the current per-stimulus 
+    archives. 
     
-    with FileLock(filename):
+    Trains stored in the one-file-per-train layout are written as a single 
+    chunk, and archive chunks are moved as they are. If *remove* is True, the
+    legacy files (and any stale lock files) are deleted afterward.
+    
+    Return the number of trains migrated.
+    """
+    from ..util import sound
+    count = 0
+    for path in _stim_dirs():
+        stim_dir = os.path.basename(path)
+        if '=' not in stim_dir:
+            continue
+        try:
+            stim = sound.create(**_parse_key(stim_dir))
+        except Exception:
+            sys.excepthook(*sys.exc_info())
+            logging.error("Could not determine stimulus for legacy AN cache "
+                          "directory %s", path)
+            continue
+        archive = get_archive(stim)
+        old_archive = SpikeTrainArchive(path)
+        chunks = old_archive.chunk_files()
+        if len(chunks) > 0:
+            count += len(old_archive.keys())
+            if not os.path.isdir(archive.path):
+                os.makedirs(archive.path)
+            for chunk in chunks:
+                os.rename(chunk, os.path.join(archive.path, os.path.basename(chunk)))
+            _write_manifest(archive.path, stim)
+            logging.info("Moved %d AN spike train chunks from %s to %s", 
+                         len(chunks), path, archive.path)
+
+        files = sorted([f for f in os.listdir(path) if f.endswith('.npz')])
+        existing = set(archive.keys())
         
-        if '--ignore-an-cache' in sys.argv or '--no-an-cache' in sys.argv or not os.path.exists(filename):
-            create = True
-        else:
-            create = False
-            # try loading cached data
+        keys = []
+        trains = []
+        migrated = []
+        for fname in files:
             try:
-                data = np.load(open(filename, 'rb'))['data']
-                logging.info("Loaded AN spike train from cache: %s", filename)
+                opts = _parse_key(fname[:-4])
+                key = (opts.pop('cf'), opts.pop('sr'), opts.pop('seed'), make_opts_key(**opts))
+                data = np.load(open(os.path.join(path, fname), 'rb'))['data']
             except Exception:
-                create = True
                 sys.excepthook(*sys.exc_info())
-                logging.error("Error reading AN spike train cache file; will "
-                    "re-generate. File: %s", filename)
-
-        if create:
-            logging.info("Generate new AN spike train: %s", filename)
-            data = generate_spiketrain(cf, sr, stim, seed, **kwds)
-            if '--no-an-cache' not in sys.argv:
-                np.savez_compressed(filename, data=data)
-            
-    return data
+                logging.error("Could not migrate legacy AN cache file %s", fname)
+                continue
+            migrated.append(fname)
+            if archive.make_key(*key) in existing:
+                continue
+            keys.append(key)
+            trains.append(data)
+        if len(keys) > 0:
+            _append(stim, archive, keys, trains)
+            count += len(keys)
+            logging.info("Migrated %d AN spike trains to archive %s", len(keys), 
+                         archive.path)
+        
+        if remove:
+            for fname in migrated:
+                os.remove(os.path.join(path, fname))
+                lock = os.path.join(path, fname[:-4] + '.npz.lock')
+                if os.path.exists(lock):
+                    os.remove(lock)
+        try:
+            os.rmdir(path)
+            _archives.pop(path, None)
+        except OSError:
+            # directory still contains files that were not migrated
+            pass
+    return count
+
+
+def _parse_key(key):
+    """ Return a dictionary of options parsed from a string generated by 
+    make_key(). Values may not contain underscores.
+    """
+    opts = {}
+    name = ''
+    for item in key.split('_'):
+        if '=' not in item:
+            # part of an option name that contains underscores
+            name += item + '_'
+            continue
+        item_name, _, val = item.partition('=')
+        name += item_name
+        for typ in (int, float, ast.literal_eval):
+            try:
+                val = typ(val)
+                break
+            except (ValueError, SyntaxError):
+                pass
+        opts[name] = val
+        name = ''
+    return opts
 
 
 def make_key(**kwds):
@@ -87,6 +439,9 @@ def make_key(**kwds):
 
 
 def get_cache_filename(cf, sr, seed, stim, **kwds):
+    """ Return the name of the file that held the requested spike train in the
+    legacy one-file-per-train cache layout.
+    """
     global _cache_path
     subdir = os.path.join(_cache_path, make_key(**stim.key()))
     filename = make_key(cf=cf, sr=sr, seed=seed, **kwds)
@@ -94,6 +449,1031 @@ def get_cache_filename(cf, sr, seed, stim, **kwds):
     return filename
 
 
+def get_spiketrains(cfs, srs, seeds, stim, ntrials=None, **kwds):
+    """ Return a list of spike time arrays, one for each (cf, sr, seed) triple
+    in *cfs*, *srs* and *seeds*.
+    
+    This is the batch equivalent of get_spiketrain(): cached trains are loaded
+    from disk, and all missing trains are generated with a single call to 
+    generate_spiketrains() so that the IHC stage is computed only once per
+    unique CF. The command-line flags described in get_spiketrain() are 
+    honored, and trains kept in memory are returned without accessing the 
+    disk.
+    
+    If *ntrials* is given, a SpikeTrains instance holding *ntrials* 
+    repetitions of each fiber is returned in place of each array (see 
+    generate_spiketrains()). All trials of a fiber are stored as a single 
+    record in the cache, so they are loaded with one lookup.
+    """
+    records = _get_spiketrains(cfs, srs, seeds, stim, ntrials, kwds)
+    if ntrials is None:
+        return records
+    return [SpikeTrains.from_record(record, ntrials) for record in records]
+
+
+def _get_spiketrains(cfs, srs, seeds, stim, ntrials, kwds):
+    """ Implements get_spiketrains(), returning the cached records (single 
+    trains, or the packed trials of each fiber if *ntrials* is given).
+    """
+    cfs, srs, seeds = _broadcast_fibers(cfs, srs, seeds)
+    stim_key = get_stim_key(stim)
+    # trials are cached under their own options key, which includes the
+    # record layout so that records of an older layout are not read
+    if ntrials is None:
+        opts_kwds = kwds
+    else:
+        opts_kwds = dict(kwds, ntrials=ntrials, record_version=SpikeTrains.record_version)
+    opts = make_opts_key(**opts_kwds)
+    keys = [(cf, sr, seed, opts) for cf, sr, seed in zip(cfs, srs, seeds)]
+    memo_keys = [(stim_key,) + SpikeTrainArchive.make_key(*key) for key in keys]
+    use_cache = '--no-an-cache' not in sys.argv
+    read_cache = use_cache and '--ignore-an-cache' not in sys.argv
+    if read_cache:
+        trains = [_memo_get(key) for key in memo_keys]
+    else:
+        trains = [None] * len(keys)
+    unloaded = [i for i, train in enumerate(trains) if train is None]
+    if len(unloaded) == 0:
+        return trains
+    
+    archive = _get_archive(stim_key)
+    if read_cache:
+        loaded = _load_cached(archive, stim, [keys[i] for i in unloaded], opts_kwds)
+        hits = 0
+        nbytes = 0
+        for i, data in zip(unloaded, loaded):
+            if data is not None:
+                trains[i] = _memo_put(memo_keys[i], data)
+                hits += 1
+                nbytes += data.nbytes
+        if hits > 0:
+            _record_access(stim, archive, hits=hits, nbytes=nbytes)
+    
+    missing = [i for i, train in enumerate(trains) if train is None]
+    if read_cache and _shift_reuse and len(missing) > 0:
+        shifted = _load_shifted(stim, stim_key, [keys[i] for i in missing], ntrials)
+        found = [(i, data) for i, data in zip(missing, shifted) if data is not None]
+        _shift_stats['hits'] += len(found)
+        _shift_stats['misses'] += len(missing) - len(found)
+        if len(found) > 0:
+            # store the shifted trains so that later requests give the same
+            # trains even if the source stimulus is evicted
+            _append(stim, archive, [keys[i] for i, data in found], 
+                    [data for i, data in found])
+            _record_access(stim, archive, shifted=len(found), 
+                           nbytes=sum([data.nbytes for i, data in found]))
+            for i, data in found:
+                trains[i] = _memo_put(memo_keys[i], data)
+            missing = [i for i, train in enumerate(trains) if train is None]
+    if len(missing) == 0:
+        logging.info("Loaded %d AN spike trains from cache", len(trains))
+        return trains
+    
+    def generate(indices):
+        logging.info("Generate %d new AN spike trains (%d loaded from cache)", 
+                     len(indices), len(trains) - len(missing))
+        new_trains = generate_spiketrains([cfs[i] for i in indices], 
+                                          [srs[i] for i in indices], 
+                                          [seeds[i] for i in indices], stim, 
+                                          ntrials=ntrials, **kwds)
+        if ntrials is not None:
+            new_trains = [t.to_record() for t in new_trains]
+        if not use_cache:
+            for i, data in zip(indices, new_trains):
+                trains[i] = data
+            return
+        _append(stim, archive, [keys[i] for i in indices], new_trains)
+        _record_access(stim, archive, misses=len(indices), 
+                       nbytes=sum([t.nbytes for t in new_trains]))
+        enforce_max_size()
+        for i, data in zip(indices, new_trains):
+            trains[i] = _memo_put(memo_keys[i], data)
+    
+    # Claim the missing trains so that other processes requesting them wait 
+    # for this one rather than generating them again.
+    claimed = []
+    pending = []
+    if use_cache and _in_flight_dedup:
+        for i in missing:
+            marker = _in_flight_marker(archive, memo_keys[i])
+            if marker.claim():
+                claimed.append((i, marker))
+            else:
+                pending.append((i, marker))
+    else:
+        claimed = [(i, None) for i in missing]
+    
+    try:
+        if read_cache and _in_flight_dedup and len(claimed) > 0:
+            # another process may have finished some of these trains before
+            # they were claimed
+            loaded = archive.get_many([keys[i] for i, marker in claimed])
+            for (i, marker), data in zip(claimed, loaded):
+                if data is not None:
+                    trains[i] = _memo_put(memo_keys[i], data)
+        claimed_missing = [i for i, marker in claimed if trains[i] is None]
+        if len(claimed_missing) > 0:
+            generate(claimed_missing)
+    finally:
+        for i, marker in claimed:
+            if marker is not None:
+                marker.release()
+    if len(pending) == 0:
+        return trains
+    
+    logging.info("Waiting for %d AN spike trains generated by another process",
+                 len(pending))
+    for i, marker in pending:
+        marker.wait()
+    loaded = archive.get_many([keys[i] for i, marker in pending])
+    failed = []
+    nbytes = 0
+    for (i, marker), data in zip(pending, loaded):
+        if data is None:
+            failed.append(i)
+        else:
+            trains[i] = _memo_put(memo_keys[i], data)
+            nbytes += data.nbytes
+    _record_access(stim, archive, hits=len(pending) - len(failed), nbytes=nbytes)
+    if len(failed) > 0:
+        # the other process died or timed out
+        generate(failed)
+    return trains
+
+
+def set_in_flight_dedup(enabled, timeout=None):
+    """ Set whether processes sharing the cache avoid generating the same
+    spike train at the same time.
+    
+    When enabled, a process that needs a train which another process is 
+    already generating waits for it to be written to the cache. *timeout* 
+    sets the maximum time in seconds to wait before generating the train 
+    anyway.
+    """
+    global _in_flight_dedup, _in_flight_timeout
+    _in_flight_dedup = enabled
+    if timeout is not None:
+        _in_flight_timeout = timeout
+
+
+def set_shift_reuse(enabled, recovery=None):
+    """ Set whether spike trains may be reused for stimuli that differ only
+    in their onset time.
+    
+    When enabled, trains that are not cached for a stimulus are looked for 
+    among cached stimuli with the same duration and the same waveform apart 
+    from its position in time (see Sound.onset_fingerprint()), such as 
+    TonePip stimuli whose pips are all delayed by the same amount. If one is
+    found, its trains are shifted by the difference in onsets (a whole number
+    of samples) and stored in the cache for the requested stimulus. Only 
+    stimuli whose trains were written while reuse was enabled are found.
+    
+    The shift is circular: spikes moved past one end of the stimulus reappear
+    at the other end. This defines the spontaneous activity at the edges:
+    
+    * When the onset is earlier than in the cached stimulus, the activity at
+      the end of the requested stimulus is the cached activity during the 
+      leading silence before its onset.
+    * When the onset is later, the activity during the extra leading silence
+      is the cached activity at the end of the stimulus.
+    
+    Cached trains are only used if the activity that wraps around is 
+    spontaneous in both stimuli, ie. if the waveform ends at least 
+    *recovery* seconds (default 20 ms, allowing for offset responses and 
+    recovery from adaptation) before the end of the stimulus plus the shift.
+    
+    The shifted trains are statistically equivalent to newly generated ones,
+    but are not identical to the trains that would be generated for the 
+    same seed; which trains are used depends on the contents of the cache.
+    Reuse is counted by shift_info() and in the 'shifted' statistic of 
+    read_stats().
+    """
+    global _shift_reuse, _shift_recovery
+    _shift_reuse = enabled
+    if recovery is not None:
+        _shift_recovery = recovery
+
+
+def shift_info():
+    """ Return a dictionary with keys 'hits' and 'misses' giving the number 
+    of missing spike trains that were and were not served by shifting 
+    cached trains in this process (see set_shift_reuse()).
+    """
+    return dict(_shift_stats)
+
+
+def _register_onset(stim, stim_key):
+    """ List the cache directory *stim_key* under the onset fingerprint of 
+    *stim*, so that its trains can be shifted to serve delayed copies of the
+    stimulus.
+    """
+    fp, onset = stim.onset_fingerprint()
+    if fp is None:
+        return
+    filename = os.path.join(_cache_path, _shift_dir, fp, stim_key)
+    if os.path.exists(filename):
+        return
+    length = np.flatnonzero(stim.sound)[-1] + 1 - onset
+    with atomic_write(filename, 'w') as fh:
+        fh.write('%d %d %d' % (onset, length, stim.num_samples))
+
+
+def _load_shifted(stim, stim_key, keys, ntrials):
+    """ Return a list of spike trains (or records, if *ntrials* is given) for
+    *stim* made by shifting the cached trains of stimuli with the same onset
+    fingerprint (see set_shift_reuse()). Trains that are not available are
+    returned as None.
+    """
+    trains = [None] * len(keys)
+    fp, onset = stim.onset_fingerprint()
+    if fp is None:
+        return trains
+    path = os.path.join(_cache_path, _shift_dir, fp)
+    if not os.path.isdir(path):
+        return trains
+    nrecovery = int(_shift_recovery * stim.opts['rate'])
+    duration = stim.num_samples * stim.dt
+    for name in sorted(os.listdir(path)):
+        if name == stim_key or name.endswith('.tmp') or \
+                not os.path.isdir(os.path.join(_cache_path, name)):
+            continue
+        try:
+            src_onset, length, nsamples = [int(x) for x in open(os.path.join(path, name)).read().split()]
+        except (IOError, ValueError):
+            continue
+        shift = src_onset - onset
+        if nsamples != stim.num_samples or \
+                nsamples - abs(shift) < max(onset, src_onset) + length + nrecovery:
+            continue
+        todo = [i for i, train in enumerate(trains) if train is None]
+        loaded = _get_archive(name).get_many([keys[i] for i in todo])
+        for i, data in zip(todo, loaded):
+            if data is None:
+                continue
+            if ntrials is None:
+                train = _shift_train(data, shift * stim.dt, duration)
+            else:
+                trials = SpikeTrains.from_record(data, ntrials)
+                trials = [_shift_train(t, shift * stim.dt, duration) for t in trials]
+                train = SpikeTrains.from_list(trials).to_record()
+            trains[i] = round_to_grid(train, stim.dt)
+        if all([train is not None for train in trains]):
+            break
+    return trains
+
+
+def _shift_train(train, shift, duration):
+    """ Return the spike times in *train* moved earlier by *shift* seconds, 
+    wrapping around a stimulus of length *duration*.
+    """
+    return np.sort(np.mod(np.asarray(train) - shift, duration))
+
+
+def _in_flight_marker(archive, memo_key):
+    """ Return the InFlight marker announcing that the train identified by 
+    *memo_key* is being generated.
+    """
+    name = fingerprint.fingerprint(memo_key) + '.pending'
+    return InFlight(os.path.join(archive.path, name), timeout=_in_flight_timeout)
+
+
+def memo_info():
+    """ Return a dictionary describing the in-memory spike train cache, with 
+    keys 'entries', 'bytes', 'max_bytes', 'hits', and 'misses'.
+    """
+    with _memo_lock:
+        return {'entries': len(_memo), 'bytes': _memo_stats['bytes'], 
+                'max_bytes': _memo_max_bytes, 'hits': _memo_stats['hits'], 
+                'misses': _memo_stats['misses']}
+
+
+def clear_memo():
+    """ Remove all spike trains from the in-memory cache and reset its 
+    statistics.
+    """
+    with _memo_lock:
+        _memo.clear()
+        _memo_stats.update({'bytes': 0, 'hits': 0, 'misses': 0})
+
+
+def set_memo_size(max_bytes):
+    """ Set the maximum total size in bytes of spike trains kept in memory. 
+    Use 0 to disable the in-memory cache.
+    """
+    global _memo_max_bytes
+    with _memo_lock:
+        _memo_max_bytes = max_bytes
+    _memo_evict()
+
+
+def _memo_get(key):
+    """ Return the spike train stored in memory for *key*, or None.
+    """
+    with _memo_lock:
+        data = _memo.pop(key, None)
+        if data is None:
+            _memo_stats['misses'] += 1
+            return None
+        # move to the most-recently used end
+        _memo[key] = data
+        _memo_stats['hits'] += 1
+        return data
+
+
+def _memo_put(key, data):
+    """ Store a copy of *data* in memory for *key* and return it as a 
+    read-only array.
+    """
+    data = np.array(data)
+    data.flags.writeable = False
+    with _memo_lock:
+        old = _memo.pop(key, None)
+        if old is not None:
+            _memo_stats['bytes'] -= old.nbytes
+        _memo[key] = data
+        _memo_stats['bytes'] += data.nbytes
+    _memo_evict()
+    return data
+
+
+def _memo_evict():
+    """ Remove least-recently used trains from memory until the total size is 
+    within the limit set by set_memo_size().
+    """
+    with _memo_lock:
+        while len(_memo) > 0 and _memo_stats['bytes'] > _memo_max_bytes:
+            key, data = _memo.popitem(last=False)
+            _memo_stats['bytes'] -= data.nbytes
+
+
+def set_max_size(max_size, ihc_max_size=None):
+    """ Set the maximum size in bytes of the spike train cache. When a new
+    spike train is written and the total size of all archives exceeds this
+    limit, the least-recently used stimuli are evicted (see prune_cache()).
+    
+    Use None for no limit. If *ihc_max_size* is given, it sets the size limit
+    of the IHC cache (see get_ihc()).
+    """
+    global _cache_max_size, _ihc_cache_max_size
+    _cache_max_size = max_size
+    if ihc_max_size is not None:
+        _ihc_cache_max_size = ihc_max_size
+
+
+def enforce_max_size():
+    """ Evict least-recently used stimuli if the cache is larger than the
+    limit set by set_max_size().
+    """
+    if _cache_max_size is not None:
+        prune_cache(_cache_max_size)
+
+
+def _stim_dirs():
+    """ Return a list of paths to all stimulus directories in the cache.
+    """
+    if not os.path.isdir(_cache_path):
+        return []
+    dirs = []
+    for name in sorted(os.listdir(_cache_path)):
+        path = os.path.join(_cache_path, name)
+        # names beginning with '_' are reserved for the IHC cache and aliases
+        if not name.startswith('_') and os.path.isdir(path):
+            dirs.append(path)
+    return dirs
+
+
+def _dir_size(path):
+    """ Return the total size in bytes of all files below *path*.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for fname in files:
+            try:
+                total += os.stat(os.path.join(root, fname)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _touch(path):
+    """ Mark a cache directory as recently used.
+    """
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _record_access(stim, archive, hits=0, misses=0, nbytes=0, shifted=0):
+    """ Record cache usage statistics for a stimulus, and mark its archive as
+    recently used.
+    """
+    global _stats_last_flush
+    _touch(archive.path)
+    name = os.path.basename(archive.path)
+    if name not in _stats:
+        _stats[name] = {'key': stim.key(), 'hits': 0, 'misses': 0, 'bytes': 0, 
+                        'shifted': 0}
+    st = _stats[name]
+    st['hits'] += hits
+    st['misses'] += misses
+    st['shifted'] += shifted
+    st['bytes'] += nbytes
+    st['last_access'] = time.time()
+    if time.time() - _stats_last_flush > _stats_flush_interval:
+        flush_stats()
+
+
+def read_stats():
+    """ Return a dictionary of usage statistics for each stimulus directory in
+    the cache, including statistics not yet written to the index file.
+    
+    Each value is a dictionary with keys 'key' (the stimulus key), 'hits', 
+    'misses', 'shifted' (the number of trains made by shifting the trains of
+    another stimulus; see set_shift_reuse()), 'bytes' (the number of bytes of
+    spike data loaded or generated), and 'last_access'.
+    """
+    filename = os.path.join(_cache_path, _index_file)
+    stats = {}
+    if os.path.exists(filename):
+        try:
+            stats = pickle.load(open(filename, 'rb'))['stimuli']
+        except Exception:
+            sys.excepthook(*sys.exc_info())
+            logging.error("Error reading AN cache index; statistics will be "
+                          "reset. File: %s", filename)
+    for name, st in _stats.items():
+        if name not in stats:
+            stats[name] = {'key': st['key'], 'hits': 0, 'misses': 0, 'bytes': 0, 
+                           'shifted': 0, 'last_access': 0}
+        merged = stats[name]
+        for k in ('hits', 'misses', 'bytes', 'shifted'):
+            merged[k] = merged.get(k, 0) + st[k]
+        merged['last_access'] = max(merged['last_access'], st['last_access'])
+    return stats
+
+
+def flush_stats(wait=0):
+    """ Merge usage statistics accumulated by this process into the index file
+    in the cache directory. 
+    
+    This is called periodically while the cache is in use, and when the 
+    process exits. If another process is updating the index, the statistics
+    are kept until the next call; *wait* gives the maximum time in seconds 
+    to wait for the other process instead.
+    """
+    global _stats, _stats_last_flush
+    _stats_last_flush = time.time()
+    if len(_stats) == 0 or not os.path.isdir(_cache_path):
+        return
+    filename = os.path.join(_cache_path, _index_file)
+    marker = InFlight(filename + '.pending', timeout=60.)
+    if not marker.claim():
+        if wait <= 0 or not marker.wait(timeout=wait) or not marker.claim():
+            return
+    try:
+        stats = read_stats()
+        # forget about stimuli that have been evicted
+        for name in list(stats.keys()):
+            if not os.path.isdir(os.path.join(_cache_path, name)):
+                del stats[name]
+        _stats = {}
+        with atomic_write(filename) as fh:
+            pickle.dump({'version': 1, 'stimuli': stats}, fh, protocol=2)
+    finally:
+        marker.release()
+
+atexit.register(flush_stats, wait=5.)
+
+
+def cache_report():
+    """ Return a list of dictionaries describing each stimulus in the cache, 
+    sorted from most- to least-recently used. 
+    
+    Each dictionary contains the keys 'path', 'key' (the stimulus 
+    parameters, if known), 'size' (bytes on disk), 
+    'n_trains', 'n_chunks', 'last_access' and the usage statistics 'hits', 
+    'misses', 'shifted' and 'bytes' (see read_stats()).
+    """
+    stats = read_stats()
+    report = []
+    for path in _stim_dirs():
+        name = os.path.basename(path)
+        archive = SpikeTrainArchive(path)
+        st = stats.get(name, {})
+        manifest = read_manifest(path) or {}
+        report.append({
+            'path': path,
+            'key': st.get('key', manifest.get('stimulus', name)),
+            'size': _dir_size(path),
+            'n_trains': len(archive.keys()),
+            'n_chunks': len(archive.chunk_files()),
+            'n_legacy': len([f for f in os.listdir(path) if f.endswith('.npz')]),
+            'last_access': os.stat(path).st_mtime,
+            'hits': st.get('hits', 0),
+            'misses': st.get('misses', 0),
+            'shifted': st.get('shifted', 0),
+            'bytes': st.get('bytes', 0),
+        })
+    report.sort(key=lambda r: r['last_access'], reverse=True)
+    return report
+
+
+def prune_cache(max_size=0, stale_age=3600.):
+    """ Remove the least-recently used stimuli from the spike train cache 
+    until its total size is no larger than *max_size* bytes. 
+    
+    Temporary files and in-flight markers older than *stale_age* seconds 
+    (left behind by processes that were killed while writing) are also 
+    removed.
+    
+    Return the number of bytes removed.
+    """
+    import shutil
+    dirs = []
+    now = time.time()
+    for path in _stim_dirs():
+        for fname in os.listdir(path):
+            fname = os.path.join(path, fname)
+            try:
+                if (fname.endswith('.tmp') or fname.endswith('.pending')) and \
+                        now - os.stat(fname).st_mtime > stale_age:
+                    os.remove(fname)
+            except OSError:
+                pass
+        try:
+            dirs.append((os.stat(path).st_mtime, _dir_size(path), path))
+        except OSError:
+            continue
+    total = sum([d[1] for d in dirs])
+    removed = 0
+    dirs.sort()
+    for mtime, size, path in dirs:
+        if total - removed <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        _archives.pop(path, None)
+        removed += size
+        logging.info("Evicted AN spike trains from cache: %s", path)
+    return removed
+
+
+def verify_cache(fix=False):
+    """ Check that all files in the cache can be read and contain valid spike
+    trains. Return a list of (filename, problem) tuples.
+    
+    If *fix* is True, then unreadable or invalid files are removed.
+    """
+    from .store import read_chunk, decode_trains, is_record
+    problems = []
+    for path in _stim_dirs():
+        for fname in sorted(os.listdir(path)):
+            fname = os.path.join(path, fname)
+            try:
+                if fname.endswith(SpikeTrainArchive.chunk_suffix):
+                    index, arrays = read_chunk(fname)
+                    end = index['offset'] + index['length']
+                    used = np.array(SpikeTrainArchive.encoding_arrays)[index['encoding']]
+                    sizes = np.array([len(a) for a in arrays])[used]
+                    if np.any(index['length'] < 0) or np.any(end > sizes):
+                        raise ValueError("index refers to data outside of chunk")
+                    trains = decode_trains([arrays[a] for a in used],
+                                           index['offset'], index['length'], 
+                                           index['encoding'], index['tick'])
+                elif fname.endswith('.npz'):
+                    trains = [np.load(open(fname, 'rb'))['data']]
+                else:
+                    continue
+                for train in trains:
+                    if is_record(train):
+                        # validate each of the packed trials
+                        trials = SpikeTrains.from_record(train)
+                        if np.any(np.diff(trials.offsets) < 0):
+                            raise ValueError("invalid record offsets")
+                    else:
+                        trials = [train]
+                    for spikes in trials:
+                        if not np.all(np.isfinite(spikes)) or np.any(np.diff(spikes) < 0):
+                            raise ValueError("invalid spike times")
+            except Exception as exc:
+                problems.append((fname, str(exc)))
+                if fix:
+                    os.remove(fname)
+    ihc_root = os.path.join(_cache_path, _ihc_cache_dir)
+    for root, dirs, files in os.walk(ihc_root):
+        for fname in files:
+            fname = os.path.join(root, fname)
+            if not fname.endswith('.npy'):
+                continue
+            try:
+                vihc = np.load(fname, mmap_mode='r')
+                if vihc.dtype != np.float32 or not np.all(np.isfinite(vihc)):
+                    raise ValueError("invalid IHC waveform")
+            except Exception as exc:
+                problems.append((fname, str(exc)))
+                if fix:
+                    os.remove(fname)
+    return problems
+
+
+def prewarm(stims, cfs, srs, seeds, seed_offsets=None, parallel=False, 
+            chunk_size=None, batch_size=None, progress=None, **kwds):
+    """ Generate and cache any missing spike trains for every combination of
+    the stimuli in *stims*, the fibers described by *cfs* and *srs*, and the 
+    values in *seeds*. 
+    
+    *cfs* and *srs* are sequences of equal length describing each fiber. If
+    *seed_offsets* is given, it is added to each seed to give the seed of 
+    each fiber; for example, an SGC population assigns seeds ``seed + i`` to
+    its cells (see populations.SGC.write_prewarm_manifest()). Keyword 
+    arguments are passed to get_spiketrains().
+    
+    The missing trains are found before any are generated, and are generated
+    in batches of at most *batch_size* trains for each stimulus and seed. 
+    Trains are written to the cache as each batch (or each task, if 
+    *parallel* is used) completes, so an interrupted pre-warm can be resumed
+    by running it again. After each batch, *progress* is called with the 
+    number of trains generated so far and the total number missing; by 
+    default, progress is logged.
+    
+    If *parallel* is True, trains are generated by a pool of worker 
+    processes (see SpikeTrainPool) with one worker per CPU. *parallel* may 
+    also be the number of workers or an existing SpikeTrainPool; 
+    *chunk_size* is passed to the pool.
+    
+    Return the number of trains that were missing.
+    """
+    from .pool import SpikeTrainPool
+    cfs = list(cfs)
+    srs = list(srs)
+    if seed_offsets is None:
+        seed_offsets = np.zeros(len(cfs), dtype=int)
+    seed_offsets = np.asarray(seed_offsets)
+    if len(srs) != len(cfs) or len(seed_offsets) != len(cfs):
+        raise ValueError("cfs, srs and seed_offsets must have the same length.")
+    
+    # find all missing trains before generating any
+    opts = make_opts_key(**kwds)
+    todo = []
+    for stim in stims:
+        archive = get_archive(stim)
+        cached = set(archive.keys())
+        for seed in seeds:
+            fiber_seeds = [int(seed + off) for off in seed_offsets]
+            missing = [i for i in range(len(cfs)) if archive.make_key(
+                cfs[i], srs[i], fiber_seeds[i], opts) not in cached]
+            if batch_size is None:
+                batches = [missing]
+            else:
+                batches = [missing[j:j+batch_size] for j in range(0, len(missing), batch_size)]
+            for batch in batches:
+                if len(batch) > 0:
+                    todo.append((stim, [cfs[i] for i in batch], [srs[i] for i in batch],
+                                 [fiber_seeds[i] for i in batch]))
+    total = sum([len(batch[1]) for batch in todo])
+    logging.info("Pre-warming AN cache: %d of %d spike trains are missing", total,
+                 len(stims) * len(seeds) * len(cfs))
+    if total == 0:
+        return 0
+    
+    if progress is None:
+        start = time.time()
+        def progress(done, total):
+            elapsed = time.time() - start
+            logging.info("Pre-warmed %d/%d AN spike trains (%0.1f%%); %0.0f s "
+                         "elapsed, %0.0f s remaining", done, total, 100. * done / total,
+                         elapsed, elapsed * (total - done) / done)
+    if parallel is False:
+        pool = None
+    elif isinstance(parallel, SpikeTrainPool):
+        pool = parallel
+    else:
+        pool = SpikeTrainPool(workers=None if parallel is True else parallel, 
+                              chunk_size=chunk_size)
+    done = 0
+    try:
+        for stim, batch_cfs, batch_srs, batch_seeds in todo:
+            if pool is None:
+                get_spiketrains(batch_cfs, batch_srs, batch_seeds, stim, **kwds)
+            else:
+                pool.get_spiketrains(batch_cfs, batch_srs, batch_seeds, stim, **kwds)
+            done += len(batch_cfs)
+            progress(done, total)
+    finally:
+        if pool is not None and pool is not parallel:
+            pool.close()
+    return total
+
+
+def write_prewarm_manifest(filename, stims, cfs, srs, seeds, seed_offsets=None, 
+                           **kwds):
+    """ Write a JSON file describing the spike trains to be generated by 
+    prewarm(), so that the cache can be filled by a separate job (for 
+    example, ``python -m cnmodel.an_model.cache prewarm manifest.json``).
+    
+    Arguments are the same as for prewarm(); keyword arguments are the 
+    options passed to get_spiketrains(), such as *simulator*.
+    """
+    if seed_offsets is None:
+        seed_offsets = np.zeros(len(cfs), dtype=int)
+    manifest = {
+        'stimuli': [stim.key() for stim in stims],
+        'cfs': list(cfs),
+        'srs': list(srs),
+        'seeds': list(seeds),
+        'seed_offsets': list(seed_offsets),
+        'options': kwds,
+    }
+    with atomic_write(filename, 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True, default=_json_default)
+
+
+def read_prewarm_manifest(filename):
+    """ Read a manifest written by write_prewarm_manifest() and return a 
+    dictionary of keyword arguments for prewarm().
+    """
+    from ..util import sound
+    manifest = json.load(open(filename))
+    args = dict(manifest.get('options', {}))
+    args.update({
+        'stims': [sound.create(**key) for key in manifest['stimuli']],
+        'cfs': manifest['cfs'],
+        'srs': manifest['srs'],
+        'seeds': manifest['seeds'],
+        'seed_offsets': manifest.get('seed_offsets'),
+    })
+    return args
+
+
+def get_ihc(cf, stim, simulator, matlab=None, **kwds):
+    """ Return the IHC potential (in volts) for a single CF in response to 
+    *stim*, as a read-only float32 array.
+    
+    IHC potentials depend only on the stimulus, CF and model options (not on 
+    the SR group or random seed), so they are cached on disk in a separate 
+    tier from the spike trains and returned as memory-mapped arrays. 
+    Generating spike trains for new seeds or SR groups then starts from the 
+    cached IHC output.
+    
+    Keyword arguments are given to model_ihc(); see generate_spiketrain(). The
+    command-line flags described in get_spiketrain() are honored. *matlab* is
+    the MATLAB process used to run the model, if needed (see model_ihc()).
+    
+    The total size of the IHC cache is limited to _ihc_cache_max_size bytes;
+    the least-recently used waveforms are removed when this limit is exceeded.
+    """
+    ihc_kwds, syn_kwds = _split_model_kwds(cf, 0, stim, kwds)
+    if simulator == 'cochlea':
+        _check_cochlea_stages()
+        # check the options even if the waveform is cached
+        cochlea_kwds = _cochlea_ihc_kwds(ihc_kwds, kwds)
+    filename = get_ihc_cache_filename(cf, stim, simulator, **kwds)
+    vihc = _load_waveform(filename)
+    if vihc is not None:
+        return vihc
+
+    if simulator == 'matlab':
+        vihc = model_ihc(matlab=matlab, **ihc_kwds)
+    else:
+        fs = int(0.5+1./stim.dt)  # need to avoid roundoff error
+        vihc = _cochlea_zilany.run_ihc(signal=stim.sound, cf=float(cf), fs=fs, 
+                                       **cochlea_kwds)
+    return _save_waveform(filename, vihc)
+
+
+def _check_cochlea_stages():
+    """ Raise an exception if the stages of the cochlea model cannot be run
+    separately.
+    """
+    if not HAVE_COCHLEA:
+        raise ValueError("The cochlea simulator requires the cochlea package, "
+                         "which could not be imported.")
+    if _cochlea_zilany is None:
+        raise ValueError("This version of the cochlea package does not "
+                         "provide cochlea.zilany2014._zilany2014, which is "
+                         "needed to run the IHC and synapse stages separately.")
+
+
+# cochlea names of the species numbers used by model_ihc()
+_cochlea_species = {1: 'cat', 2: 'human', 3: 'human_glasberg1990'}
+
+
+def _cochlea_ihc_kwds(ihc_kwds, kwds):
+    """ Return the keyword arguments for cochlea's run_ihc(), given the 
+    model_ihc() arguments *ihc_kwds* made from the options *kwds* (see 
+    _split_model_kwds()). The cochlea simulator supports only the 'cohc', 
+    'cihc' and 'species' options.
+    """
+    unsupported = [k for k in kwds if k not in ('cohc', 'cihc', 'species')]
+    if len(unsupported) > 0:
+        raise TypeError("Arguments not supported by the cochlea simulator: %s" 
+                        % unsupported)
+    if ihc_kwds['species'] not in _cochlea_species:
+        raise ValueError("Unknown species for the cochlea simulator: %r" 
+                         % ihc_kwds['species'])
+    return dict(species=_cochlea_species[ihc_kwds['species']],
+                cohc=float(ihc_kwds['cohc']), cihc=float(ihc_kwds['cihc']))
+
+
+def get_ihc_cache_filename(cf, stim, simulator, **kwds):
+    """ Return the name of the file used to cache the IHC potential for *cf*
+    and *stim*.
+    """
+    subdir = os.path.join(_cache_path, _ihc_cache_dir, get_stim_key(stim))
+    ihc_kwds, syn_kwds = _split_model_kwds(cf, 0, stim, kwds)
+    # only options that affect the IHC stage are included in the key
+    opts = dict([(k, v) for k, v in ihc_kwds.items() 
+                 if k in kwds and k not in ('pin', 'tdres')])
+    filename = 'cf=%.12g_%s.npy' % (cf, make_opts_key(simulator=simulator, **opts))
+    return os.path.join(subdir, filename)
+
+
+def get_rate(cf, sr, stim, simulator, matlab=None, **kwds):
+    """ Return the instantaneous firing rate (spikes/s) of a fiber in 
+    response to *stim*, before the effect of refractoriness, as a read-only
+    float32 array sampled at stim.dt.
+    
+    This is the rate driving the spike generator of the model, so any number 
+    of trains can be drawn from it cheaply (see generate_spiketrains() with
+    resample=True). Rates are cached on disk alongside the IHC potentials 
+    and share their size limit (see get_ihc()). Arguments are as for 
+    get_ihc().
+    
+    With MATLAB, the rate is computed from the mean rate returned by 
+    model_synapse() with the random generator seeded to 0, so the slow rate 
+    fluctuations added by fractional Gaussian noise are shared by all trains 
+    drawn from it. The 'fast' simulator is already rate-based and has no 
+    separate rate function.
+    """
+    if simulator not in ('matlab', 'cochlea'):
+        raise ValueError("Rate functions are only available for the MATLAB "
+                         "and cochlea simulators; found %s" % simulator)
+    if simulator == 'cochlea':
+        _check_cochlea_stages()
+    filename = get_rate_cache_filename(cf, sr, stim, simulator, **kwds)
+    rate = _load_waveform(filename)
+    if rate is not None:
+        return rate
+
+    vihc = np.asarray(get_ihc(cf, stim, simulator, matlab=matlab, **kwds), dtype=np.float64)
+    if simulator == 'matlab':
+        ihc_kwds, syn_kwds = _split_model_kwds(cf, sr, stim, kwds)
+        seed_rng(0, matlab=matlab)
+        meanrate, varrate, psth = model_synapse(vihc, matlab=matlab, **syn_kwds)
+        # model_synapse() gives the rate including the dead time of the 
+        # spike generator; undo this to get the driving rate.
+        meanrate = meanrate.ravel()
+        rate = meanrate / np.maximum(1. - fast._refractory * meanrate, 1e-3)
+    else:
+        fs = int(0.5+1./stim.dt)  # need to avoid roundoff error
+        anf_type = ['hsr', 'msr', 'lsr'][2-sr]  # input is 0=L, 1=M, 2=H
+        # Same settings as used by _run_cochlea()
+        rate = _cochlea_zilany.run_synapse(fs=fs, vihc=vihc, cf=float(cf), 
+            anf_type=anf_type, powerlaw='approximate', ffGn=False)
+    return _save_waveform(filename, rate)
+
+
+def get_rate_cache_filename(cf, sr, stim, simulator, **kwds):
+    """ Return the name of the file used to cache the firing rate for *cf*, 
+    *sr* and *stim* (see get_rate()).
+    """
+    subdir = os.path.join(_cache_path, _ihc_cache_dir, get_stim_key(stim))
+    filename = 'rate_cf=%.12g_sr=%d_%s.npy' % (cf, sr, make_opts_key(simulator=simulator, **kwds))
+    return os.path.join(subdir, filename)
+
+
+def _load_waveform(filename):
+    """ Return the cached waveform (IHC potential or rate) in *filename* as a
+    memory-mapped array, or None if it is not available.
+    """
+    if ('--ignore-an-cache' in sys.argv or '--no-an-cache' in sys.argv 
+            or not os.path.exists(filename)):
+        return None
+    try:
+        data = np.load(filename, mmap_mode='r')
+        # record access time for LRU eviction
+        os.utime(filename, None)
+        return data
+    except Exception:
+        sys.excepthook(*sys.exc_info())
+        logging.error("Error reading IHC cache file; will re-generate. "
+                      "File: %s", filename)
+        return None
+
+
+def _save_waveform(filename, data):
+    """ Cache a newly computed waveform in *filename*, and return it as a 
+    read-only float32 array.
+    """
+    # Always return the float32 waveform, even when it is not cached, so that
+    # spike trains do not depend on the state of the cache.
+    data = np.ascontiguousarray(data, dtype=np.float32).ravel()
+    
+    if '--no-an-cache' not in sys.argv:
+        # other processes never see a partially written waveform
+        with atomic_write(filename) as fh:
+            np.save(fh, data)
+        root = os.path.join(_cache_path, _ihc_cache_dir)
+        if root in _ihc_cache_sizes:
+            _ihc_cache_sizes[root] += os.path.getsize(filename)
+        if _ihc_cache_sizes.get(root, np.inf) > _ihc_cache_max_size:
+            evict_ihc_cache()
+        
+    data.flags.writeable = False
+    return data
+
+
+def evict_ihc_cache(max_size=None):
+    """ Remove the least-recently used IHC waveforms until the total size of
+    the IHC cache is no larger than *max_size* bytes (default is 
+    _ihc_cache_max_size). 
+    
+    Return the number of bytes removed.
+    
+    Newly cached waveforms only trigger this scan of the IHC cache when the
+    size of the cache, as known to this process, exceeds the limit. Files 
+    written by other processes are counted at the next scan.
+    """
+    if max_size is None:
+        max_size = _ihc_cache_max_size
+    root = os.path.join(_cache_path, _ihc_cache_dir)
+    files = []
+    for path, dirs, fnames in os.walk(root):
+        for fname in fnames:
+            if not fname.endswith('.npy'):
+                continue
+            fname = os.path.join(path, fname)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, fname))
+    total = sum([f[1] for f in files])
+    removed = 0
+    files.sort()
+    for mtime, size, fname in files:
+        if total - removed <= max_size:
+            break
+        try:
+            os.remove(fname)
+        except OSError:
+            # already removed by another process
+            continue
+        removed += size
+        logging.info("Evicted IHC waveform from cache: %s", fname)
+        try:
+            os.rmdir(os.path.dirname(fname))
+        except OSError:
+            # directory is not empty
+            pass
+    _ihc_cache_sizes[root] = total - removed
+    return removed
+
+
+def _broadcast_fibers(cfs, srs, seeds):
+    """ Return *cfs*, *srs* and *seeds* as lists of equal length. Scalar 
+    values are repeated to match the length of the other arguments.
+    """
+    args = [cfs, srs, seeds]
+    n = max([1] + [len(a) for a in args if not np.isscalar(a)])
+    for i, a in enumerate(args):
+        if np.isscalar(a):
+            args[i] = [a] * n
+        else:
+            args[i] = list(a)
+            if len(args[i]) != n:
+                raise ValueError("cfs, srs, and seeds must have the same length.")
+    return args
+
+
+def _split_model_kwds(cf, sr, stim, kwds):
+    """ Return the (ihc_kwds, syn_kwds) dictionaries used to run the periphery
+    model for a single fiber. Any keyword arguments in *kwds* are copied to the 
+    correct model function based on their names.
+    """
+    for k in ['pin', 'CF', 'fiberType', 'noiseType']:
+        if k in kwds:
+            raise TypeError("Argument '%s' is not allowed here." % k)
+    
+    ihc_kwds = dict(pin=stim.sound, CF=cf, nrep=1, tdres=stim.dt, 
+                    reptime=stim.duration*2, cohc=1, cihc=1, species=1)
+    syn_kwds = dict(CF=cf, nrep=1, tdres=stim.dt, fiberType=sr, noiseType=1, implnt=0)
+    # copy any given keyword args to the correct model function
+    kwds = kwds.copy()
+    for kwd in list(kwds.keys()):
+        if kwd in ihc_kwds:
+            ihc_kwds[kwd] = kwds[kwd]
+        if kwd in syn_kwds:
+            syn_kwds[kwd] = kwds[kwd]
+        if kwd in ihc_kwds or kwd in syn_kwds:
+            kwds.pop(kwd)
+
+    if len(kwds) > 0:
+        raise TypeError("Invalid keyword arguments: %s" % list(kwds.keys()))
+    
+    return ihc_kwds, syn_kwds
+
+
 def generate_spiketrain(cf, sr, stim, seed, simulator=None, **kwds):
     """ Generate a new spike train from the auditory nerve model. Returns an 
     array of spike times in seconds.
@@ -109,56 +1489,261 @@ def generate_spiketrain(cf, sr, stim, seed, simulator=None, **kwds):
         Stimulus sound to be presented on each repetition
     seed : int >= 0
         Random seed
-    simulator : 'cochlea' | 'matlab' | None
+    simulator : 'cochlea' | 'matlab' | 'fast' | None
         Specifies the auditory periphery simulator to use. If None, then a
         simulator will be automatically chosen based on availability.
+        'fast' selects an approximate model that is much faster than the 
+        Zilany model, for tests where fidelity is not critical (see 
+        fast.py).
         
     All other keyword arguments are given to model_ihc() and model_synapse()
     based on their names. These include 'species', 'nrep', 'reptime', 'cohc', 
-    'cihc', and 'implnt'. 
-    'simulator' is used to set the simulator ('matlab' or 'cochlea')
-    """
-    for k in ['pin', 'CF', 'fiberType', 'noiseType']:
-        if k in kwds:
-            raise TypeError("Argument '%s' is not allowed here." % k)
+    'cihc', and 'implnt'. The cochlea simulator only supports 'species', 
+    'cohc' and 'cihc'.
+    'simulator' is used to set the simulator ('matlab', 'cochlea' or 'fast')
     
-    ihc_kwds = dict(pin=stim.sound, CF=cf, nrep=1, tdres=stim.dt, 
-                    reptime=stim.duration*2, cohc=1, cihc=1, species=1)
-    syn_kwds = dict(CF=cf, nrep=1, tdres=stim.dt, fiberType=sr, noiseType=1, implnt=0)
-    # copy any given keyword args to the correct model function
-    for kwd in kwds:
-        if kwd in ihc_kwds:
-            ihc_kwds[kwd] = kwds.pop(kwd)
-        if kwd in syn_kwds:
-            syn_kwds[kwd] = kwds.pop(kwd)
+    If *ntrials* is given, a SpikeTrains instance holding that many trials is
+    returned instead (see generate_spiketrains()).
+    """
+    return generate_spiketrains([cf], [sr], [seed], stim, simulator=simulator, **kwds)[0]
+
 
+def generate_spiketrains(cfs, srs, seeds, stim, simulator=None, ntrials=None, 
+                         resample=False, **kwds):
+    """ Generate new spike trains from the auditory nerve model for many fibers
+    at once. Returns a list of arrays of spike times in seconds, one for each
+    (cf, sr, seed) triple.
+    
+    The IHC potential depends only on the stimulus and CF, so it is computed 
+    once for each unique value in *cfs* and then reused to generate the 
+    spike trains for every SR group and seed at that CF. Each train is 
+    identical to the one returned by generate_spiketrain() for the same 
+    arguments.
+    
+    Parameters
+    ----------
+    cfs : array-like
+        Center frequencies of the fibers to simulate
+    srs : array-like or int
+        Spontaneous rate group of each fiber (see generate_spiketrain())
+    seeds : array-like or int
+        Random seed for each fiber
+    stim : Sound instance
+        Stimulus sound to be presented to all fibers
+    simulator : 'cochlea' | 'matlab' | 'fast' | None
+        Specifies the auditory periphery simulator to use. If None, then a
+        simulator will be automatically chosen based on availability.
+        'fast' selects an approximate model that is much faster than the 
+        Zilany model, for tests where fidelity is not critical (see 
+        fast.py).
+    ntrials : int or None
+        If given, generate this many trials of each fiber and return a 
+        SpikeTrains instance for each fiber instead of an array. The random
+        generator is seeded once per fiber and the trials are generated 
+        in sequence, so the first trial is identical to the train generated
+        without *ntrials*. With MATLAB, all trials of a fiber are generated 
+        in a single call (see wrapper.model_synapse_trials()); with cochlea, 
+        the synapse stage is run once and only the spike generator is 
+        repeated.
+    resample : bool
+        If True, the firing rate of each fiber is computed once by the 
+        model (and cached; see get_rate()), and all trains for that fiber 
+        are drawn from it by a Poisson spike generator with the same 
+        absolute refractory period as the model (see fast.spike_generator()).
+        Drawing many trains then costs little more than drawing one. 
+        Trains are not identical to trains generated with resample=False, 
+        and they are biased: the relative refractory period of the model is
+        not included, so resampled trains fire faster than model trains,
+        by more than half for strongly driven high-SR fibers. Use resampled
+        trains where the timing of the rate matters more than the absolute
+        spike count. This is implied by the 'fast' simulator.
+    
+    All other keyword arguments are handled as in generate_spiketrain().
+    
+    If a pool of MATLAB workers has been started (see 
+    wrapper.set_matlab_workers()), the MATLAB simulator runs the fibers
+    concurrently on all workers.
+    """
+    cfs, srs, seeds = _broadcast_fibers(cfs, srs, seeds)
+    if ntrials is not None and ntrials < 1:
+        raise ValueError("ntrials must be at least 1.")
+    
     if simulator is None:
         simulator = detect_simulator()
+    if simulator not in ('matlab', 'cochlea', 'fast'):
+        # it remains possible to have a typo.... 
+        raise ValueError("anmodel/cache.py: Simulator must be specified as MATLAB, cochlea or fast; found %s" % simulator)
+    if simulator == 'cochlea' and _cochlea_zilany is None:
+        if not HAVE_COCHLEA or ntrials is not None or resample:
+            _check_cochlea_stages()
+        # simulate each fiber separately; the IHC stage is not cached
+        trains = [_run_zilany2014(cf, sr, seed, stim, kwds) 
+                  for cf, sr, seed in zip(cfs, srs, seeds)]
+        return _round_to_grid(trains, stim.dt)
+    if simulator == 'fast':
+        # vectorized over all fibers; no IHC caching needed
+        trains = fast.generate_spiketrains(cfs, srs, seeds, stim, ntrials=ntrials, **kwds)
+        return _round_to_grid(trains, stim.dt)
+    if resample:
+        def rate_fn(cfs, srs):
+            rates = [get_rate(cf, sr, stim, simulator, **kwds) for cf, sr in zip(cfs, srs)]
+            return np.array(rates), stim.dt
+        trains = fast.sample_spiketrains(cfs, srs, seeds, rate_fn, ntrials=ntrials)
+        return _round_to_grid(trains, stim.dt)
+    
+    # group fibers by CF so that the IHC stage runs once per CF
+    groups = OrderedDict()
+    for i, cf in enumerate(cfs):
+        groups.setdefault(cf, []).append(i)
+    
+    if simulator == 'matlab' and get_matlab_pool() is not None:
+        return _run_matlab_pool(get_matlab_pool(), groups, srs, seeds, stim, kwds, ntrials)
+    
+    trains = [None] * len(cfs)
+    for cf, inds in groups.items():
+        vihc = get_ihc(cf, stim, simulator, **kwds)
+        if simulator == 'matlab':
+            cf_trains = _run_matlab(cf, [srs[i] for i in inds], 
+                                    [seeds[i] for i in inds], stim, vihc, kwds,
+                                    ntrials=ntrials)
+            for i, train in zip(inds, cf_trains):
+                trains[i] = train
+        else:
+            cf_trains = _run_cochlea(cf, [srs[i] for i in inds], 
+                                     [seeds[i] for i in inds], stim, vihc, 
+                                     ntrials=ntrials)
+            for i, train in zip(inds, cf_trains):
+                trains[i] = train
+    return _round_to_grid(trains, stim.dt)
 
-    if len(kwds) > 0:
-        raise TypeError("Invalid keyword arguments: %s" % list(kwds.keys()))
+
+def _round_to_grid(trains, tick):
+    """ Return *trains* (arrays or SpikeTrains instances) with the spike 
+    times rounded to the sample grid exactly as they are when read back from 
+    the archive (see store.round_to_grid()), so that new and cached trains 
+    are identical.
     
-    if simulator == 'matlab':
-        seed_rng(seed)
-        vihc = model_ihc(_transfer=False, **ihc_kwds) 
-        m, v, psth = model_synapse(vihc, _transfer=False, **syn_kwds)
+    The spike generators of cochlea and the fast simulator give times on the
+    grid only to within rounding error.
+    """
+    rounded = []
+    for train in trains:
+        if isinstance(train, SpikeTrains):
+            record = round_to_grid(train.to_record(), tick)
+            rounded.append(SpikeTrains.from_record(record))
+        else:
+            rounded.append(round_to_grid(train, tick))
+    return rounded
+
+
+def _run_matlab(cf, srs, seeds, stim, vihc, kwds, matlab=None, ntrials=None):
+    """ Return a list of spike trains for all (sr, seed) pairs at a single CF,
+    generated from the IHC potential *vihc* using the MATLAB model.
+    
+    *matlab* is the MATLAB process to use (default is wrapper.get_matlab()).
+    If *ntrials* is given, a SpikeTrains instance is returned for each pair.
+    """
+    ihc_kwds, syn_kwds = _split_model_kwds(cf, srs[0], stim, kwds)
+    # model_Synapse requires double precision input
+    vihc = np.asarray(vihc, dtype=np.float64)
+    trains = []
+    for sr, seed in zip(srs, seeds):
+        syn_kwds['fiberType'] = sr
+        seed_rng(seed, matlab=matlab)
+        if ntrials is not None:
+            spikes, counts = model_synapse_trials(vihc, ntrials=ntrials, 
+                                                  matlab=matlab, **syn_kwds)
+            offsets = np.zeros(ntrials + 1, dtype=np.int64)
+            np.cumsum(counts.ravel(), out=offsets[1:])
+            trains.append(SpikeTrains(spikes.ravel() * stim.dt, offsets))
+            continue
+        m, v, psth = model_synapse(vihc, _transfer=False, matlab=matlab, **syn_kwds)
         psth = psth.get().ravel()
         times = np.argwhere(psth).ravel()
-        return times * stim.dt
-    elif simulator == 'cochlea' and HAVE_COCHLEA:
-        fs = int(0.5+1./stim.dt)  # need to avoid roundoff error
-        srgrp = [0,0,0] # H, M, L (but input is 1=L, 2=M, H = 3)
-        srgrp[2-sr] = 1
-        sp = cochlea.run_zilany2014(
-                stim.sound,
-                fs=fs,
-                anf_num=srgrp,
-                cf=cf,
-                seed=seed,
-                species='cat')
-        return np.array(sp.spikes.values[0])
-    else:  # it remains possible to have a typo.... 
-        raise ValueError("anmodel/cache.py: Simulator must be specified as either MATLAB or cochlea; found %s" % simulator)
+        trains.append(times * stim.dt)
+    return trains
+
+
+def _run_matlab_pool(pool, groups, srs, seeds, stim, kwds, ntrials=None):
+    """ Generate spike trains using the MATLAB model, distributing the work 
+    across the workers of a wrapper.MatlabPool.
+    
+    *groups* maps each CF to the indices of the fibers with that CF. The IHC 
+    stage is run once per CF, then the fibers at each CF are divided into 
+    requests so that all workers are kept busy. Each fiber seeds the random
+    number generator of its worker, so the results do not depend on which 
+    worker runs it.
+    """
+    n = sum([len(inds) for inds in groups.values()])
+    chunk = max(1, int(np.ceil(n / (2. * pool.workers))))
+    ihc_reqs = [(cf, pool.submit(_matlab_ihc, cf, stim, kwds)) for cf in groups]
+    syn_reqs = []
+    for cf, req in ihc_reqs:
+        vihc = req.result()
+        inds = groups[cf]
+        for start in range(0, len(inds), chunk):
+            sub = inds[start:start+chunk]
+            syn_reqs.append((sub, pool.submit(_matlab_synapse, cf, 
+                [srs[i] for i in sub], [seeds[i] for i in sub], stim, vihc, kwds,
+                ntrials)))
+    trains = [None] * n
+    for sub, req in syn_reqs:
+        for i, train in zip(sub, req.result()):
+            trains[i] = train
+    return trains
+
+
+def _matlab_ihc(proc, cf, stim, kwds):
+    return get_ihc(cf, stim, 'matlab', matlab=proc, **kwds)
+
+
+def _matlab_synapse(proc, cf, srs, seeds, stim, vihc, kwds, ntrials):
+    return _run_matlab(cf, srs, seeds, stim, vihc, kwds, matlab=proc, ntrials=ntrials)
+
+
+def _run_cochlea(cf, srs, seeds, stim, vihc, ntrials=None):
+    """ Return a list of spike trains for all (sr, seed) pairs at a single CF,
+    generated from the IHC potential *vihc* using the cochlea package.
+    
+    Because cochlea does not add fractional Gaussian noise by default, the 
+    synapse stage is run only once for each SR group; only the spike 
+    generator is run for each seed (and each trial, if *ntrials* is given, 
+    in which case a SpikeTrains instance is returned for each pair).
+    """
+    fs = int(0.5+1./stim.dt)  # need to avoid roundoff error
+    vihc = np.asarray(vihc, dtype=np.float64)
+    trains = []
+    synout = {}
+    for sr, seed in zip(srs, seeds):
+        anf_type = ['hsr', 'msr', 'lsr'][2-sr]  # input is 0=L, 1=M, 2=H
+        if anf_type not in synout:
+            # Same settings as used internally by cochlea.run_zilany2014()
+            synout[anf_type] = _cochlea_zilany.run_synapse(
+                fs=fs, vihc=vihc, cf=float(cf), anf_type=anf_type, 
+                powerlaw='approximate', ffGn=False)
+        np.random.seed(seed)
+        if ntrials is not None:
+            trials = [np.array(_cochlea_zilany.run_spike_generator(
+                          synout=synout[anf_type], fs=fs)) for k in range(ntrials)]
+            trains.append(SpikeTrains.from_list(trials))
+            continue
+        spikes = _cochlea_zilany.run_spike_generator(synout=synout[anf_type], fs=fs)
+        trains.append(np.array(spikes))
+    return trains
+
+
+def _run_zilany2014(cf, sr, seed, stim, kwds):
+    """ Return a spike train for a single fiber generated by 
+    cochlea.run_zilany2014(). This is used if the stages of the model cannot
+    be run separately (see _check_cochlea_stages()).
+    """
+    ihc_kwds, syn_kwds = _split_model_kwds(cf, sr, stim, kwds)
+    fs = int(0.5+1./stim.dt)  # need to avoid roundoff error
+    anf_num = [0, 0, 0]  # H, M, L (but input is 0=L, 1=M, 2=H)
+    anf_num[2-sr] = 1
+    sp = cochlea.run_zilany2014(stim.sound, fs=fs, anf_num=anf_num, cf=cf, 
+                                seed=seed, **_cochlea_ihc_kwds(ihc_kwds, kwds))
+    return np.array(sp.spikes.values[0])
 
 
 def detect_simulator():
@@ -175,3 +1760,159 @@ def detect_simulator():
         get_matlab()
         simulator = 'matlab'
     return simulator
+
+
+def _parse_size(size):
+    """ Parse a size string like '500M' or '10G' into a number of bytes.
+    """
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    size = size.strip().upper().rstrip('B')
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def _format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return '%0.1f %s' % (size, unit)
+        size /= 1024.
+    return '%0.1f TB' % size
+
+
+def _parse_list(values, typ):
+    """ Parse a comma-separated list of values, where int values may also be
+    given as ranges like 'start:stop'.
+    """
+    out = []
+    for val in values.split(','):
+        if typ is int and ':' in val:
+            start, stop = val.split(':')
+            out.extend(range(int(start), int(stop)))
+        else:
+            out.append(typ(val))
+    return out
+
+
+def main(argv=None):
+    """ Command-line interface for managing the AN spike train cache.
+    """
+    import argparse, json
+    global _cache_path
+    parser = argparse.ArgumentParser(prog='python -m cnmodel.an_model.cache',
+        description="Manage the auditory nerve spike train cache.")
+    parser.add_argument('--cache-path', default=None, 
+        help="Location of the cache (default: %s)" % _cache_path)
+    sub = parser.add_subparsers(dest='command')
+    report = sub.add_parser('report', help="Report cache size and usage "
+        "statistics for each stimulus.")
+    report.add_argument('--top', type=int, default=20, 
+        help="Number of stimuli to list (default: 20).")
+    prune = sub.add_parser('prune', help="Evict least-recently used stimuli "
+        "until the cache is smaller than the given size.")
+    prune.add_argument('max_size', help="Maximum cache size, e.g. 500M or 10G.")
+    prune.add_argument('--ihc-max-size', default=None, 
+        help="Maximum size of the IHC cache.")
+    verify = sub.add_parser('verify', help="Check that all cache files are "
+        "readable and valid.")
+    verify.add_argument('--fix', action='store_true', 
+        help="Remove invalid files.")
+    prewarm_cmd = sub.add_parser('prewarm', help="Generate missing spike "
+        "trains for a set of stimuli and fibers.")
+    prewarm_cmd.add_argument('stims', help="JSON file containing a list of "
+        "stimulus keys (see Sound.key()), or a manifest written by "
+        "write_prewarm_manifest() describing the stimuli, fibers and seeds.")
+    prewarm_cmd.add_argument('--cfs', default=None, 
+        help="Comma-separated list of fiber CFs (required unless a manifest "
+        "is given).")
+    prewarm_cmd.add_argument('--srs', default='0,1,2', 
+        help="Comma-separated list of SR groups; every CF is combined with "
+        "every SR group (default: 0,1,2).")
+    prewarm_cmd.add_argument('--seeds', default='0', 
+        help="Comma-separated list or range (start:stop) of seeds.")
+    prewarm_cmd.add_argument('--simulator', default=None)
+    prewarm_cmd.add_argument('--workers', type=int, default=1, 
+        help="Number of worker processes (default: 1; 0 for one per CPU).")
+    prewarm_cmd.add_argument('--batch-size', type=int, default=None, 
+        help="Maximum number of trains generated between progress reports.")
+    migrate = sub.add_parser('migrate', help="Move trains from the legacy "
+        "one-file-per-train layout into per-stimulus archives.")
+    migrate.add_argument('--remove', action='store_true', 
+        help="Remove legacy files after migrating them.")
+    args = parser.parse_args(argv)
+    
+    if args.cache_path is not None:
+        _cache_path = args.cache_path
+    
+    if args.command == 'report':
+        rep = cache_report()
+        total = sum([r['size'] for r in rep])
+        ihc = _dir_size(os.path.join(_cache_path, _ihc_cache_dir))
+        print("Cache path: %s" % _cache_path)
+        print("Spike trains: %s in %d stimuli (limit: %s)" % (_format_size(total), 
+              len(rep), 'none' if _cache_max_size is None else _format_size(_cache_max_size)))
+        print("IHC waveforms: %s (limit: %s)" % (_format_size(ihc), 
+              _format_size(_ihc_cache_max_size)))
+        hits = sum([r['hits'] for r in rep])
+        misses = sum([r['misses'] for r in rep])
+        shifted = sum([r['shifted'] for r in rep])
+        print("Hits: %d  Misses: %d  Shifted: %d" % (hits, misses, shifted))
+        print("")
+        print("%-20s %10s %8s %8s %8s  %s" % ('last access', 'size', 'trains', 
+                                             'hits', 'misses', 'stimulus'))
+        for r in rep[:args.top]:
+            key = r['key']
+            if isinstance(key, dict):
+                key = make_key(**key)
+            print("%-20s %10s %8d %8d %8d  %s" % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['last_access'])),
+                _format_size(r['size']), r['n_trains'] + r['n_legacy'], 
+                r['hits'], r['misses'], key[:80]))
+    elif args.command == 'prune':
+        removed = prune_cache(_parse_size(args.max_size))
+        if args.ihc_max_size is not None:
+            removed += evict_ihc_cache(_parse_size(args.ihc_max_size))
+        print("Removed %s." % _format_size(removed))
+    elif args.command == 'verify':
+        problems = verify_cache(fix=args.fix)
+        for fname, problem in problems:
+            print("%s: %s" % (fname, problem))
+        print("Found %d problems%s." % (len(problems), 
+              ' (removed)' if args.fix and len(problems) > 0 else ''))
+    elif args.command == 'prewarm':
+        from ..util import sound
+        if isinstance(json.load(open(args.stims)), dict):
+            prewarm_args = read_prewarm_manifest(args.stims)
+        else:
+            if args.cfs is None:
+                parser.error("--cfs is required unless a manifest is given")
+            cfs = _parse_list(args.cfs, float)
+            srs = _parse_list(args.srs, int)
+            fibers = [(cf, sr) for cf in cfs for sr in srs]
+            prewarm_args = {
+                'stims': [sound.create(**key) for key in json.load(open(args.stims))],
+                'cfs': [f[0] for f in fibers], 
+                'srs': [f[1] for f in fibers],
+                'seeds': _parse_list(args.seeds, int),
+                'simulator': args.simulator,
+            }
+        def progress(done, total):
+            print("%d/%d spike trains generated" % (done, total))
+            sys.stdout.flush()
+        parallel = False if args.workers == 1 else (args.workers or True)
+        total = prewarm(parallel=parallel, batch_size=args.batch_size, 
+                        progress=progress, **prewarm_args)
+        flush_stats()
+        print("Generated %d missing spike trains." % total)
+    elif args.command == 'migrate':
+        n = migrate_legacy_cache(remove=args.remove)
+        print("Migrated %d spike trains." % n)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    # run from the package module so that only one copy of the cache state 
+    # exists
+    from cnmodel.an_model import cache
+    cache.main()
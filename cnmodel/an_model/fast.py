@@ -0,0 +1,301 @@
+"""
+Fast, approximate auditory periphery simulator.
+
+This is a phenomenological stand-in for the Zilany et al. (2014) model, meant
+for large-scale circuit tests where throughput matters more than fidelity.
+All stages are vectorized with NumPy and process many CFs at once as a 2D
+(CF x time) array:
+
+1. Basilar membrane: 4th-order gammatone filterbank with ERB bandwidths and
+   unit gain at CF, applied by FFT convolution.
+2. Inner hair cell: half-wave rectification followed by a low-pass filter
+   (loss of phase locking above a few kHz).
+3. Synapse: sigmoidal rate-level function for each spontaneous rate group,
+   followed by rapid and short-term adaptation.
+4. Spike generator: inhomogeneous Poisson process with an absolute
+   refractory period.
+
+Use it through the AN cache with ``simulator='fast'``, for example::
+
+    an_model.get_spiketrains(cfs, srs, seeds, stim, simulator='fast')
+
+Trains generated by this simulator are cached separately from Zilany trains.
+See fidelity_report() to compare the two.
+"""
+from __future__ import division
+import numpy as np
+import scipy.signal
+from .store import SpikeTrains
+
+# Rate parameters for each spontaneous rate group (0=low, 1=mid, 2=high):
+# spontaneous rate and saturated rate (spikes/s), threshold (dB SPL) and
+# dynamic range (dB) of the steady-state rate-level function.
+_sr_params = {
+    0: dict(spont=0.1, rmax=200., threshold=35., dynamic_range=40.),
+    1: dict(spont=4., rmax=250., threshold=20., dynamic_range=30.),
+    2: dict(spont=100., rmax=300., threshold=5., dynamic_range=25.),
+}
+
+_ihc_cutoff = 3000.     # Hz; IHC low-pass filter
+_env_tau = 1e-3         # s; smoothing of the rate driving adaptation
+_adapt_taus = (2e-3, 60e-3)  # s; rapid and short-term adaptation
+_adapt_gains = (2.0, 1.0)
+_refractory = 0.75e-3   # s; absolute refractory period
+
+# The synapse and spike generator run at (about) this sample rate, which is 
+# ample after the IHC low-pass filter. Spike times are multiples of its 
+# sample interval.
+_synapse_rate = 25e3
+
+# Maximum number of CFs processed together; limits memory use for long stimuli.
+_block_size = 128
+
+
+def generate_spiketrains(cfs, srs, seeds, stim, ntrials=None, **kwds):
+    """ Generate spike trains for many fibers at once. Returns a list of
+    arrays of spike times in seconds, one for each (cf, sr, seed) triple, or a
+    list of SpikeTrains instances if *ntrials* is given.
+
+    Arguments are as for cache.generate_spiketrains(); scalar *cfs*, *srs*
+    or *seeds* are repeated to match the others. The firing rate is
+    computed once for each unique (cf, sr) pair. Each fiber (and trial) draws
+    from its own random generator, so a train depends only on its own
+    arguments and not on the other fibers in the batch.
+    """
+    if len(kwds) > 0:
+        raise TypeError("Invalid keyword arguments for the fast simulator: %s"
+                        % list(kwds.keys()))
+    rate_fn = lambda cfs, srs: firing_rates(stim, cfs, srs)
+    return sample_spiketrains(cfs, srs, seeds, rate_fn, ntrials=ntrials)
+
+
+def sample_spiketrains(cfs, srs, seeds, rate_fn, ntrials=None):
+    """ Draw spike trains for many fibers from their firing rates. Returns a
+    list of arrays of spike times in seconds, one for each (cf, sr, seed)
+    triple, or a list of SpikeTrains instances if *ntrials* is given.
+
+    *rate_fn(cfs, srs)* must return (rates, dt) for lists of unique CFs and SR
+    groups, where *rates* is a 2D array with one row of rates (spikes/s,
+    before refractoriness) per fiber, sampled at intervals of *dt* seconds.
+    It is called once for each block of up to _block_size unique fibers.
+    """
+    from . import cache
+    cfs, srs, seeds = cache._broadcast_fibers(cfs, srs, seeds)
+    n = len(cfs)
+    reps = 1 if ntrials is None else ntrials
+    pairs = {}
+    rows = []
+    for cf, sr in zip(cfs, srs):
+        rows.append(pairs.setdefault((float(cf), int(sr)), len(pairs)))
+    rows = np.array(rows, dtype=int)
+    pair_list = sorted(pairs.items(), key=lambda item: item[1])
+
+    spikes = [None] * (n * reps)
+    for start in range(0, len(pair_list), _block_size):
+        block = [p[0] for p in pair_list[start:start+_block_size]]
+        rates, dt = rate_fn([p[0] for p in block], [p[1] for p in block])
+        fibers = np.argwhere((rows >= start) & (rows < start + len(block))).ravel()
+        # one row per (fiber, trial), in fiber-major order
+        gen_rows = np.repeat(rows[fibers] - start, reps)
+        rngs = [_fiber_rng(seeds[i], k) for i in fibers for k in range(reps)]
+        trains = spike_generator(rates, dt, gen_rows, rngs)
+        for j, i in enumerate(fibers):
+            spikes[i*reps:(i+1)*reps] = trains[j*reps:(j+1)*reps]
+
+    if ntrials is None:
+        return spikes
+    return [SpikeTrains.from_list(spikes[i*reps:(i+1)*reps]) for i in range(n)]
+
+
+def firing_rates(stim, cfs, srs):
+    """ Return the instantaneous firing rate (spikes/s, before refractoriness)
+    of fibers with the given CFs and SR groups in response to *stim*.
+    
+    Returns (rates, dt), where *rates* is a 2D array with one row per fiber 
+    and *dt* is its sample interval: the IHC output is decimated to about 
+    _synapse_rate before the synapse stage.
+    """
+    fs = 1. / stim.dt
+    ihc = ihc_response(bm_response(stim.sound, cfs, fs), fs)
+    step = max(1, int(fs // _synapse_rate))
+    return synapse_rate(ihc[:, ::step], srs, fs / step), stim.dt * step
+
+
+def bm_response(signal, cfs, fs):
+    """ Return the output of a gammatone filterbank (in Pa) for each CF in
+    *cfs* as a 2D array.
+
+    Each filter is a 4th-order gammatone with a bandwidth of 1.019 ERB
+    (Glasberg & Moore, 1990), normalized to unit gain at its CF.
+    """
+    cfs = np.asarray(cfs, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    n = len(signal)
+    bw = 2 * np.pi * 1.019 * (24.7 * (4.37 * cfs / 1000. + 1))
+    # truncate impulse responses where the envelope has decayed by ~140 dB
+    nir = min(n, int(np.ceil(25. / bw.min() * fs)))
+    t = np.arange(nir) / fs
+    ir = (t[None, :]**3 * np.exp(-bw[:, None] * t[None, :]) *
+          np.cos(2 * np.pi * cfs[:, None] * t[None, :]))
+    gain = np.abs(np.sum(ir * np.exp(-2j * np.pi * cfs[:, None] * t[None, :]), axis=1))
+    ir /= gain[:, None]
+    nfft = 2**int(np.ceil(np.log2(n + nir - 1)))
+    spec = np.fft.rfft(ir, nfft, axis=1) * np.fft.rfft(signal, nfft)[None, :]
+    return np.fft.irfft(spec, nfft, axis=1)[:, :n]
+
+
+def ihc_response(bm, fs):
+    """ Return the IHC drive (in Pa) for the basilar membrane output *bm*: the
+    half-wave rectified input, low-pass filtered at _ihc_cutoff.
+    """
+    b, a = scipy.signal.butter(2, min(0.99, _ihc_cutoff / (fs / 2.)))
+    return scipy.signal.lfilter(b, a, np.maximum(bm, 0), axis=1)
+
+
+def synapse_rate(ihc, srs, fs):
+    """ Return the synaptic release rate (spikes/s) driven by the IHC output
+    *ihc*, for fibers in the given SR groups.
+
+    The IHC drive is converted to an equivalent level in dB SPL (so that a
+    tone at CF gives its own level at high CFs) and passed through a
+    sigmoidal rate-level function. Adaptation adds the high-passed, smoothed
+    rate with rapid and short-term time constants, giving an onset peak and
+    an offset dip.
+    """
+    srs = np.asarray(srs, dtype=int)
+    params = dict([(k, np.array([_sr_params[sr][k] for sr in srs])[:, None])
+                   for k in ('spont', 'rmax', 'threshold', 'dynamic_range')])
+    level = 20 * np.log10(np.maximum(ihc * (np.pi / np.sqrt(2.)) / 20e-6, 1e-6))
+    # 10%-90% of the driven range spans the dynamic range
+    slope = params['dynamic_range'] / (2 * np.log(9.))
+    mid = params['threshold'] + params['dynamic_range'] / 2.
+    drive = 1. / (1. + np.exp(-(level - mid) / slope))
+    rate = params['spont'] + (params['rmax'] - params['spont']) * drive
+
+    env = _lowpass(rate, _env_tau, fs)
+    adapted = rate.copy()
+    for tau, gain in zip(_adapt_taus, _adapt_gains):
+        adapted += gain * (env - _lowpass(env, tau, fs))
+    return np.maximum(adapted, 0)
+
+
+def spike_generator(rates, dt, rows, rngs):
+    """ Generate spike trains from the firing rates in the 2D array *rates*.
+
+    Parameters
+    ----------
+    rates : array
+        Firing rate (spikes/s) of each fiber, one row per fiber
+    dt : float
+        Sample interval of *rates* in seconds
+    rows : array
+        Row of *rates* used for each train to generate
+    rngs : list
+        A numpy RandomState for each train to generate
+
+    Returns a list of arrays of spike times in seconds. Spikes are generated by
+    time rescaling, one spike of every train per iteration, with no spikes
+    allowed within _refractory seconds of the previous spike.
+    """
+    nrows, n = rates.shape
+    ntrains = len(rows)
+    if ntrains == 0:
+        return []
+    rates = np.asarray(rates, dtype=np.float64)
+    cum = np.cumsum(rates * dt, axis=1)
+    # Offset each row so that the rows can be searched as one sorted array
+    spacing = cum[:, -1].max() + 1.
+    offset = np.arange(nrows) * spacing
+    flat = (cum + offset[:, None]).ravel()
+    dead = max(1, int(round(_refractory / dt)))
+
+    draws = np.array([rng.exponential(size=16) for rng in rngs])
+    live = np.zeros(ntrains, dtype=int)  # first sample each train may spike
+    active = np.arange(ntrains)
+    times = []
+    trains = []
+    k = 0
+    while len(active) > 0:
+        if k == draws.shape[1]:
+            more = np.zeros((ntrains, draws.shape[1]))
+            for i in active:
+                more[i] = rngs[i].exponential(size=draws.shape[1])
+            draws = np.concatenate([draws, more], axis=1)
+        r = rows[active]
+        start = live[active]
+        base = cum[r, start] - rates[r, start] * dt
+        target = base + draws[active, k]
+        # trains whose next spike would fall after the end are finished
+        keep = target <= cum[r, -1]
+        active, r, start, target = active[keep], r[keep], start[keep], target[keep]
+        idx = np.searchsorted(flat, target + offset[r])
+        sample = np.maximum(idx - r * n, start)
+        times.append(sample)
+        trains.append(active)
+        live[active] = sample + dead
+        active = active[live[active] < n]
+        k += 1
+
+    if len(times) == 0:
+        return [np.zeros(0) for i in range(ntrains)]
+    times = np.concatenate(times)
+    trains = np.concatenate(trains)
+    # spikes were generated in time order for each train
+    order = np.argsort(trains, kind='mergesort')
+    counts = np.bincount(trains, minlength=ntrains)
+    return np.split(times[order] * dt, np.cumsum(counts)[:-1])
+
+
+def fidelity_report(stim, cfs, srs, seeds, reference=None, bin_width=1e-3):
+    """ Compare spike trains from the fast simulator to trains from the
+    Zilany model, and return a list of dicts (one per (cf, sr) pair) with keys:
+
+    * cf, sr: the fiber parameters
+    * ntrains: the number of trains compared (one per seed)
+    * rate, ref_rate: mean firing rates (spikes/s)
+    * psth_corr: correlation coefficient of the PSTHs
+    * psth_rms: RMS difference of the PSTHs (spikes/s)
+
+    Trains for every combination of *cfs*/*srs* pairs and *seeds* are loaded
+    through the AN cache, so reference trains that were generated previously
+    are not generated again. *reference* is the simulator for the reference
+    trains (default is cache.detect_simulator()).
+    """
+    from . import cache
+    if reference is None:
+        reference = cache.detect_simulator()
+    cfs = list(cfs)
+    srs = list(srs)
+    bins = np.arange(0, stim.duration + bin_width, bin_width)
+    report = []
+    for cf, sr in zip(cfs, srs):
+        psths = []
+        for simulator in ('fast', reference):
+            trains = cache.get_spiketrains(cf, sr, list(seeds), stim, simulator=simulator)
+            hist = np.histogram(np.concatenate(trains), bins)[0]
+            psths.append(hist / (len(trains) * bin_width))
+        fast, ref = psths
+        if fast.std() > 0 and ref.std() > 0:
+            corr = np.corrcoef(fast, ref)[0, 1]
+        else:
+            corr = np.nan
+        report.append(dict(cf=cf, sr=sr, ntrains=len(seeds),
+                           rate=fast.mean(), ref_rate=ref.mean(), psth_corr=corr,
+                           psth_rms=np.sqrt(np.mean((fast - ref)**2))))
+    return report
+
+
+def _fiber_rng(seed, trial=0):
+    """ Return the random generator for one trial of a fiber.
+    """
+    seed = int(seed)
+    return np.random.RandomState([seed & 0xffffffff, seed >> 32, trial])
+
+
+def _lowpass(data, tau, fs):
+    """ First-order low-pass filter along the time axis of *data*, starting
+    from a steady state at the first sample.
+    """
+    a = np.exp(-1. / (tau * fs))
+    zi = a * data[:, :1]
+    return scipy.signal.lfilter([1. - a], [1., -a], data, axis=1, zi=zi)[0]
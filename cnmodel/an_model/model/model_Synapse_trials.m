@@ -0,0 +1,16 @@
+function [spikes, counts] = model_Synapse_trials(vihc, CF, nrep, tdres, fiberType, noiseType, implnt, ntrials)
+% Run model_Synapse ntrials times on the same IHC output and return the spike
+% times of every trial in a single call.
+%
+% spikes is a row vector of the (zero-based) PSTH bins of all spikes, in trial
+% order, and counts gives the number of spikes in each trial. The random
+% stream is not reset between trials, so seeding it once before calling this
+% function gives a reproducible set of independent trials.
+counts = zeros(1, ntrials);
+trials = cell(1, ntrials);
+for k = 1:ntrials
+    [meanrate, varrate, psth] = model_Synapse(vihc, CF, nrep, tdres, fiberType, noiseType, implnt);
+    trials{k} = find(psth) - 1;
+    counts(k) = numel(trials{k});
+end
+spikes = [zeros(1, 0), trials{:}];
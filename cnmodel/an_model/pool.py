@@ -0,0 +1,169 @@
+"""
+Parallel generation of AN spike trains using a pool of worker processes.
+
+The pool is headless (no GUI or progress dialog is required) and is built on
+the standard library multiprocessing module. Workers load and generate trains
+through the AN spike train cache (see cache.get_spiketrains()), so every train
+they generate is written to the shared disk cache.
+
+Example::
+
+    with SpikeTrainPool(workers=8) as pool:
+        trains = pool.get_spiketrains(cfs, srs, seeds, stim)
+    for train in trains:
+        ...
+
+The random seed of each train is given explicitly by the caller, so results
+do not depend on the number of workers or on how the work is divided.
+"""
+from __future__ import division
+import sys, logging, multiprocessing
+import numpy as np
+from . import cache
+from .store import SpikeTrains
+
+
+class SpikeTrainPool(object):
+    """ Pool of worker processes that generate AN spike trains.
+
+    Parameters
+    ----------
+    workers : int or None
+        Number of worker processes. The default is the number of CPUs. With
+        one worker, trains are generated in the calling process.
+    chunk_size : int or None
+        Number of trains sent to a worker in each task. Fibers are sorted by
+        CF before being divided into tasks, so that fibers sharing a CF are
+        usually handled together and share the IHC stage. The default
+        divides the fibers into about four tasks per worker.
+    """
+    def __init__(self, workers=None, chunk_size=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers < 1:
+            raise ValueError("Number of workers must be at least 1.")
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                              initargs=(_cache_config(),))
+        return self._pool
+
+    def get_spiketrains(self, cfs, srs, seeds, stim, **kwds):
+        """ Return a SpikeTrains instance containing one spike train for each
+        (cf, sr, seed) triple in *cfs*, *srs* and *seeds*.
+
+        Scalar arguments are repeated to match the others, as in
+        cache.get_spiketrains(). Extra keyword arguments (for example
+        *simulator*) are passed to cache.get_spiketrains() in the workers.
+        """
+        if 'ntrials' in kwds:
+            raise TypeError("Argument 'ntrials' is not supported by SpikeTrainPool.")
+        cfs, srs, seeds = cache._broadcast_fibers(cfs, srs, seeds)
+        n = len(cfs)
+        if n == 0:
+            return SpikeTrains.from_list([])
+        if self.workers == 1:
+            return SpikeTrains.from_list(cache.get_spiketrains(cfs, srs, seeds, stim, **kwds))
+
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = max(1, int(np.ceil(n / (self.workers * 4))))
+        order = np.argsort(np.asarray(cfs, dtype=float), kind='mergesort')
+        stim_key = stim.key()
+        tasks = []
+        for start in range(0, n, chunk_size):
+            inds = order[start:start+chunk_size]
+            tasks.append((stim_key, [cfs[i] for i in inds], [srs[i] for i in inds],
+                          [seeds[i] for i in inds], kwds))
+        logging.info("Generating %d AN spike trains in %d tasks on %d workers",
+                     n, len(tasks), self.workers)
+
+        lengths = np.zeros(n, dtype=np.int64)
+        chunks = []
+        for i, (chunk_lengths, chunk_spikes) in enumerate(
+                self._get_pool().imap(_run_task, tasks)):
+            inds = order[i*chunk_size:(i+1)*chunk_size]
+            lengths[inds] = chunk_lengths
+            chunks.append((inds, chunk_lengths, chunk_spikes))
+
+        # reassemble trains in the order requested
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        spikes = np.empty(offsets[-1], dtype=np.float64)
+        for inds, chunk_lengths, chunk_spikes in chunks:
+            src = 0
+            for ind, length in zip(inds, chunk_lengths):
+                spikes[offsets[ind]:offsets[ind]+length] = chunk_spikes[src:src+length]
+                src += length
+        return SpikeTrains(spikes, offsets)
+
+    def close(self):
+        """ Stop all worker processes.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_spiketrains(cfs, srs, seeds, stim, workers=None, chunk_size=None, **kwds):
+    """ Generate spike trains using a temporary SpikeTrainPool and return them
+    as a SpikeTrains instance. See SpikeTrainPool for a description of
+    arguments.
+    """
+    pool = SpikeTrainPool(workers=workers, chunk_size=chunk_size)
+    try:
+        return pool.get_spiketrains(cfs, srs, seeds, stim, **kwds)
+    finally:
+        pool.close()
+
+
+def _cache_config():
+    """ Return the cache settings of this process, to be copied to workers.
+    """
+    flags = [f for f in ('--ignore-an-cache', '--no-an-cache') if f in sys.argv]
+    return {
+        'cache_path': cache._cache_path,
+        'cache_max_size': cache._cache_max_size,
+        'ihc_cache_max_size': cache._ihc_cache_max_size,
+        'hash_waveforms': cache._hash_waveforms,
+        'in_flight_dedup': cache._in_flight_dedup,
+        'in_flight_timeout': cache._in_flight_timeout,
+        'flags': flags,
+    }
+
+
+def _init_worker(config):
+    cache._cache_path = config['cache_path']
+    cache.set_max_size(config['cache_max_size'], config['ihc_cache_max_size'])
+    cache.set_hash_waveforms(config['hash_waveforms'])
+    cache.set_in_flight_dedup(config['in_flight_dedup'], config['in_flight_timeout'])
+    for flag in config['flags']:
+        if flag not in sys.argv:
+            sys.argv.append(flag)
+
+
+def _run_task(task):
+    """ Generate the trains for one task in a worker process and return
+    (lengths, spikes) arrays.
+    """
+    from ..util import sound
+    stim_key, cfs, srs, seeds, kwds = task
+    stim = sound.create(**stim_key)
+    trains = cache.get_spiketrains(cfs, srs, seeds, stim, **kwds)
+    # worker processes do not run atexit handlers
+    cache.flush_stats()
+    lengths = np.array([len(t) for t in trains], dtype=np.int64)
+    if len(trains) == 0:
+        return lengths, np.zeros(0)
+    return lengths, np.concatenate(trains)
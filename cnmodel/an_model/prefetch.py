@@ -0,0 +1,165 @@
+"""
+Background loading of AN spike trains for upcoming trials.
+
+In a trial loop, the spike trains for each trial are normally loaded or
+generated just before the NEURON simulation of that trial starts. A
+SpikeTrainPrefetcher instead prepares the trains for the following trials in
+a background thread while the current trial is simulated::
+
+    requests = [(cfs, srs, seeds_for_trial(k), stim_for_trial(k), {})
+                for k in range(ntrials)]
+    with SpikeTrainPrefetcher(requests, depth=1) as prefetcher:
+        for request, trains in prefetcher:
+            ...  # simulate one trial using trains
+
+The work done in the background (MATLAB, worker processes, or numpy) mostly
+runs without holding the GIL, so it overlaps with the simulation. Trials are
+returned in the order requested, and the seed of every train is given in the
+request, so the trains do not depend on timing.
+
+See populations.SGC.prefetch() to prefetch trains for an SGC population.
+"""
+import sys, threading
+from . import cache
+from .pool import SpikeTrainPool
+from .wrapper import _reraise
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class SpikeTrainPrefetcher(object):
+    """ Load or generate the spike trains for a sequence of requests in a
+    background thread.
+
+    Parameters
+    ----------
+    requests : iterable
+        (cfs, srs, seeds, stim, kwds) tuples, one for each trial. The
+        arguments are passed to cache.get_spiketrains() (or to
+        SpikeTrainPool.get_spiketrains() if *parallel* is given). The 
+        iterable is consumed by the background thread.
+    depth : int
+        Maximum number of trials prepared ahead of those already taken by
+        the caller, including the trial being prepared.
+    parallel : bool, int or SpikeTrainPool
+        If True, missing trains are generated by a pool of worker processes
+        (see SpikeTrainPool) with one worker per CPU, rather than in the
+        background thread. This may also be the number of workers, or an
+        existing pool. A pool created by the prefetcher is closed by close().
+    chunk_size : int or None
+        Passed to the SpikeTrainPool created if *parallel* is given.
+
+    While the prefetcher is running, its thread uses the default MATLAB
+    process (see wrapper.get_matlab()) to generate trains, so spike trains
+    should not be generated in other threads at the same time.
+    """
+    def __init__(self, requests, depth=1, parallel=False, chunk_size=None):
+        if depth < 1:
+            raise ValueError("Prefetch depth must be at least 1.")
+        self.depth = depth
+        if parallel is False:
+            self.pool = None
+        elif isinstance(parallel, SpikeTrainPool):
+            self.pool = parallel
+        else:
+            workers = None if parallel is True else parallel
+            self.pool = SpikeTrainPool(workers=workers, chunk_size=chunk_size)
+        self._own_pool = self.pool is not None and self.pool is not parallel
+        self._requests = iter(requests)
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(depth)
+        self._stop = False
+        self._done = False
+        self._pending = None  # item taken from the queue by peek()
+        self._thread = threading.Thread(target=self._run, name='SpikeTrainPrefetcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                self._slots.acquire()
+                if self._stop:
+                    return
+                try:
+                    request = next(self._requests)
+                except StopIteration:
+                    self._queue.put(None)
+                    return
+                cfs, srs, seeds, stim, kwds = request
+                if self.pool is None:
+                    trains = cache.get_spiketrains(cfs, srs, seeds, stim, **kwds)
+                else:
+                    trains = self.pool.get_spiketrains(cfs, srs, seeds, stim, **kwds)
+                self._queue.put((request, trains))
+        except Exception:
+            # re-raised in the calling thread by next()
+            self._queue.put(sys.exc_info())
+
+    def next(self):
+        """ Return (request, trains) for the next trial, waiting for its
+        trains to be ready if necessary.
+
+        Raises StopIteration when all requests have been returned. If the
+        background thread failed, its exception is raised here.
+        """
+        item = self._get()
+        self._pending = None
+        if item is None:
+            raise StopIteration()
+        self._slots.release()
+        return item
+
+    __next__ = next
+
+    def peek(self):
+        """ Return (request, trains) for the next trial like next(), but
+        without taking it: the same trial is returned again by the following
+        call to next() or peek().
+        """
+        item = self._get()
+        if item is None:
+            raise StopIteration()
+        return item
+
+    def _get(self):
+        """ Return the next item from the queue (or the one already taken by
+        peek()), or None at the end of the requests.
+        """
+        if self._done:
+            return None
+        if self._pending is None:
+            self._pending = self._queue.get()
+        item = self._pending
+        if item is None:
+            self._done = True
+        elif len(item) == 3:
+            self._pending = None
+            self._done = True
+            # keep the traceback of the background thread
+            _reraise(*item)
+        return item
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        """ Stop preparing trials and wait for the background thread to exit.
+
+        A trial that is being prepared is finished first.
+        """
+        self._stop = True
+        self._done = True
+        self._slots.release()
+        self._thread.join()
+        if self._own_pool:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
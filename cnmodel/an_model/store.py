@@ -0,0 +1,519 @@
+"""
+Consolidated on-disk storage for AN spike trains.
+
+All cached spike trains for a single stimulus are kept in one archive
+directory. Trains are appended to the archive in immutable *chunks*; each chunk
+is a single file containing an index of the trains it holds followed by the
+concatenated spike times of all trains. Loading a population of spike trains
+requires opening one memory-mapped chunk file and slicing it at the offsets
+given in the index.
+
+Chunks are written to a temporary file and renamed into place, so readers
+never see a partially written chunk and no locking is required. When an
+archive accumulates many chunks, they are merged into a single chunk by
+`SpikeTrainArchive.compact()`.
+
+Spike times that lie on the sample grid of the stimulus (to within rounding
+error) are stored as the number of samples between successive spikes 
+(uint16, or uint32 for long intervals), which is four times smaller than 
+float64 seconds for most trains. The trials of a packed trial record are 
+encoded the same way. Other trains are stored as float64 seconds. Trains 
+are converted back to seconds when read, with one vectorized operation for 
+all single trains requested together (see `decode_trains()`).
+"""
+
+import os, time, uuid, logging
+from collections import OrderedDict
+import numpy as np
+from ..util.atomic import atomic_write
+
+# Spike times within this many samples of the sample grid are encoded as
+# sample counts. Trains generated on the grid are off by rounding error only.
+_grid_tolerance = 1e-6
+
+
+class SpikeTrainArchive(object):
+    """ Append-only archive of spike trains for a single stimulus.
+
+    Each train is identified by its (cf, sr, seed, opts) key, where *opts* is
+    a short ASCII string identifying any extra options used to generate the
+    train (see cache.make_opts_key()).
+
+    Parameters
+    ----------
+    path : str
+        Directory holding the archive chunks. It is created when the first
+        chunk is written.
+    max_chunks : int
+        The archive is automatically compacted after a write if it contains
+        more than this number of chunks.
+    """
+    # Layout of each chunk file: an index array followed by one data array 
+    # for each encoding, all stored in .npy format. Chunks written before 
+    # spike encoding was introduced have an index without the 'encoding' and
+    # 'tick' fields, and a single float64 data array.
+    index_dtype = np.dtype([
+        ('cf', '<f8'),
+        ('sr', '<i4'),
+        ('seed', '<i8'),
+        ('opts', 'S16'),
+        ('offset', '<i8'),   # index of first spike in data array
+        ('length', '<i8'),   # number of spikes in train
+        ('encoding', 'u1'),  # see encoding_arrays
+        ('tick', '<f8'),     # sample period of delta-encoded trains
+    ])
+    # float64 seconds; uint16 and uint32 sample intervals
+    data_dtypes = (np.dtype('<f8'), np.dtype('<u2'), np.dtype('<u4'))
+    # Index of the data array used by each encoding: 0-2 are single trains 
+    # stored with the corresponding data dtype, 3-4 are packed trial records
+    # (see SpikeTrains.to_record()) stored as uint16 and uint32.
+    encoding_arrays = (0, 1, 2, 1, 2)
+    chunk_prefix = 'chunk-'
+    chunk_suffix = '.anc'
+
+    def __init__(self, path, max_chunks=16):
+        self.path = path
+        self.max_chunks = max_chunks
+        self._chunks = {}  # filename: (index, data)
+        self._lookup = {}  # key: (filename, offset, length)
+        self._files = []  # chunk files included in self._lookup
+
+    def new_chunk_filename(self):
+        """ Return a unique name for a new chunk file. 
+        
+        Chunk names sort in order of creation, so that trains in newer chunks
+        take precedence over older ones with the same key.
+        """
+        name = '%s%016x-%s%s' % (self.chunk_prefix, int(time.time() * 1e6), 
+                                 uuid.uuid4().hex, self.chunk_suffix)
+        return os.path.join(self.path, name)
+
+    def chunk_files(self):
+        """ Return a list of the chunk files currently in the archive, sorted
+        by creation time.
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        names = [n for n in names if n.startswith(self.chunk_prefix)
+                 and n.endswith(self.chunk_suffix)]
+        names.sort()
+        return [os.path.join(self.path, n) for n in names]
+
+    def reload(self):
+        """ Read the index of any chunks that were added to the archive since
+        the last call, and forget about chunks that have been removed.
+        """
+        for attempt in range(3):
+            files = self.chunk_files()
+            try:
+                for fname in files:
+                    if fname not in self._chunks:
+                        self._chunks[fname] = read_chunk(fname)
+                break
+            except (IOError, OSError):
+                # chunk removed by compaction in another process; list again
+                continue
+
+        removed = set(self._chunks.keys()) - set(files)
+        for fname in removed:
+            del self._chunks[fname]
+        
+        files = [f for f in files if f in self._chunks]
+        if files == self._files:
+            return
+        self._files = files
+        self._lookup = {}
+        for fname in files:
+            index, arrays = self._chunks[fname]
+            cols = [index[k].tolist() for k in ('cf', 'sr', 'seed', 'opts', 'offset', 
+                                                'length', 'encoding', 'tick')]
+            for cf, sr, seed, opts, offset, length, encoding, tick in zip(*cols):
+                key = self.make_key(cf, sr, seed, opts)
+                self._lookup[key] = (fname, offset, length, encoding, tick)
+
+    @staticmethod
+    def make_key(cf, sr, seed, opts):
+        """ Return the key used to look up a train in the archive.
+
+        CF values are compared with 12 significant digits so that equivalent
+        values always find the same train.
+        """
+        if not isinstance(opts, bytes):
+            opts = opts.encode('ascii')
+        return (float('%.12g' % cf), int(sr), int(seed), opts)
+
+    def locate(self, cf, sr, seed, opts):
+        """ Return (chunk_file, offset, length) for the requested train, or
+        None if it is not in the archive.
+        """
+        key = self.make_key(cf, sr, seed, opts)
+        if key not in self._lookup:
+            self.reload()
+        loc = self._lookup.get(key, None)
+        return None if loc is None else loc[:3]
+
+    def get(self, cf, sr, seed, opts):
+        """ Return the requested spike train, or None if it is not in the
+        archive.
+        """
+        return self.get_many([(cf, sr, seed, opts)])[0]
+
+    def get_many(self, keys):
+        """ Return a list of spike trains for a list of (cf, sr, seed, opts)
+        keys. Trains that are not in the archive are returned as None.
+
+        Returned arrays are read-only. Trains stored as float64 are views of 
+        the memory-mapped chunk data; encoded trains are decoded together.
+        """
+        keys = [self.make_key(*k) for k in keys]
+        if any([k not in self._lookup for k in keys]):
+            self.reload()
+        found = [i for i, key in enumerate(keys) if key in self._lookup]
+        locs = [self._lookup[keys[i]] for i in found]
+        arrays = [self._chunks[loc[0]][1][self.encoding_arrays[loc[3]]] for loc in locs]
+        decoded = decode_trains(arrays, *zip(*[loc[1:] for loc in locs])) if len(found) > 0 else []
+        trains = [None] * len(keys)
+        for i, train in zip(found, decoded):
+            trains[i] = train
+        return trains
+
+    def keys(self):
+        """ Return a list of the (cf, sr, seed, opts) keys of all trains in the
+        archive.
+        """
+        self.reload()
+        return list(self._lookup.keys())
+
+    def append(self, keys, trains, tick=None):
+        """ Add spike trains to the archive as a new chunk.
+
+        Parameters
+        ----------
+        keys : list
+            (cf, sr, seed, opts) key for each train
+        trains : list
+            Arrays of spike times
+        tick : float or None
+            Sample period of the stimulus. Trains whose spike times are all
+            multiples of *tick* (to within rounding error) are stored in 
+            compact integer form (see encode_train()).
+        """
+        if len(keys) == 0:
+            return
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # probably another process already created this directory
+                pass
+        write_chunk(self.new_chunk_filename(), keys, trains, 
+                    ticks=[tick] * len(keys))
+
+        if len(self.chunk_files()) > self.max_chunks:
+            self.compact()
+
+    def compact(self):
+        """ Merge all chunks in the archive into a single chunk.
+
+        This is safe to call while other processes are reading or appending to
+        the archive: the merged chunk is written before the old chunks are
+        removed, and chunks added during compaction are left untouched.
+        """
+        self.reload()
+        old_files = list(self._chunks.keys())
+        if len(old_files) < 2:
+            return
+        keys = list(self._lookup.keys())
+        ticks = [self._lookup[key][4] for key in keys]
+        trains = self.get_many(keys)
+        write_chunk(self.new_chunk_filename(), keys, trains, ticks=ticks)
+        for old in old_files:
+            try:
+                os.remove(old)
+            except OSError:
+                # already removed by another process, or still mapped
+                # on windows; duplicate entries are harmless.
+                pass
+        logging.info("Compacted %d chunks in AN spike train archive %s",
+                     len(old_files), self.path)
+        self.reload()
+
+    def size(self):
+        """ Return the total size of all chunks in bytes.
+        """
+        total = 0
+        for fname in self.chunk_files():
+            try:
+                total += os.stat(fname).st_size
+            except OSError:
+                pass
+        return total
+
+
+class SpikeTrains(object):
+    """ A list of spike trains stored as two compact arrays.
+
+    Parameters
+    ----------
+    spikes : array
+        Spike times (in seconds) of all trains, concatenated.
+    offsets : array
+        Index of the first spike of each train in *spikes*, with one extra
+        final element equal to ``len(spikes)``.
+
+    Indexing returns a read-only view of a single train, and iterating yields
+    every train in order.
+    """
+    # Layout of the arrays returned by to_record(). It is part of the cache 
+    # key of stored records, so that records written in an older layout are 
+    # never parsed as the current one. Version 1 had no leading count.
+    record_version = 2
+    
+    def __init__(self, spikes, offsets):
+        self.spikes = np.asarray(spikes, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.spikes.flags.writeable = False
+
+    @classmethod
+    def from_list(cls, trains):
+        """ Return a SpikeTrains instance holding the arrays in *trains*.
+        """
+        lengths = [len(t) for t in trains]
+        offsets = np.zeros(len(trains) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        if len(trains) == 0:
+            spikes = np.zeros(0)
+        else:
+            spikes = np.concatenate([np.asarray(t, dtype=np.float64) for t in trains])
+        return cls(spikes, offsets)
+
+    def to_record(self):
+        """ Return all trains packed into a single array, which can be stored 
+        as one train in a SpikeTrainArchive.
+        
+        The record holds the number of trains (negated, so that records can be
+        told apart from single spike trains), the offsets array, and the spike
+        times; see from_record().
+        """
+        return np.concatenate([[-float(len(self))], 
+                               self.offsets.astype(np.float64), self.spikes])
+
+    @classmethod
+    def from_record(cls, record, n=None):
+        """ Return a SpikeTrains instance holding the *n* trains packed into
+        *record* by to_record(). The spike times are a view of *record*.
+        
+        If *n* is given, a ValueError is raised if the record holds a 
+        different number of trains.
+        """
+        if not is_record(record):
+            raise ValueError("Array is not a packed SpikeTrains record.")
+        count = int(-record[0])
+        if n is not None and count != n:
+            raise ValueError("Record holds %d trains; expected %d." % (count, n))
+        offsets = record[1:count+2]
+        if len(offsets) < count + 1 or offsets[-1] != len(record) - count - 2:
+            raise ValueError("Record is too short to hold %d trains." % count)
+        return cls(record[count+2:], offsets)
+
+    @property
+    def lengths(self):
+        """ Array giving the number of spikes in each train.
+        """
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        return self.spikes[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def is_record(train):
+    """ Return True if *train* is a record of several trains packed by 
+    SpikeTrains.to_record(), rather than a single spike train.
+    """
+    return len(train) > 0 and train[0] < 0
+
+
+def encode_train(train, tick):
+    """ Return (encoding, data) giving the compact form of a spike train, or
+    of a packed trial record (see SpikeTrains.to_record()).
+
+    If all spike times are non-negative, sorted multiples of *tick* (to 
+    within _grid_tolerance samples), *data* holds the number of ticks from
+    each spike to the previous one (from 0 for the first spike) as uint16 or
+    uint32 values, and *encoding* gives its data array (see 
+    SpikeTrainArchive.encoding_arrays). Records keep their count and offsets
+    in front of the intervals, which restart at each trial. Otherwise (or if
+    *tick* is None), the train is returned unchanged as float64 with 
+    encoding 0. Decoding gives the spike times rounded to the sample grid.
+    """
+    train = np.asarray(train, dtype=np.float64)
+    if not tick or tick <= 0:
+        return 0, train
+    record = is_record(train)
+    if record:
+        trials = SpikeTrains.from_record(train)
+        header = train[:len(trials)+2]
+        spikes, starts = trials.spikes, trials.offsets[:-1][trials.lengths > 0]
+    else:
+        header = np.zeros(0)
+        spikes, starts = train, np.zeros(min(1, len(train)), dtype=int)
+    samples = spikes / tick
+    counts = np.round(samples)
+    if np.any(counts < 0) or np.any(np.abs(samples - counts) > _grid_tolerance):
+        return 0, train
+    deltas = np.diff(np.concatenate([[0], counts]))
+    deltas[starts] = counts[starts]
+    if np.any(deltas < 0):
+        return 0, train
+    if record:
+        header = np.concatenate([[-header[0]], header[1:]])
+        deltas = np.concatenate([header, deltas])
+    maxdelta = deltas.max() if len(deltas) > 0 else 0
+    for encoding in (1, 2):
+        dtype = SpikeTrainArchive.data_dtypes[encoding]
+        if maxdelta <= np.iinfo(dtype).max:
+            return encoding + 2 * record, deltas.astype(dtype)
+    return 0, train
+
+
+def round_to_grid(train, tick):
+    """ Return *train* (a spike train or packed trial record) as it is read 
+    back after being stored with sample period *tick*: spike times close 
+    enough to the sample grid to be encoded (see encode_train()) become exact
+    multiples of *tick*, and other trains are returned unchanged.
+    """
+    encoding, data = encode_train(train, tick)
+    if encoding == 0:
+        return train
+    return decode_trains([data], [0], [len(data)], [encoding], [tick])[0].copy()
+
+
+def decode_trains(arrays, offsets, lengths, encodings, ticks):
+    """ Return a list of spike trains (in seconds) read from stored data.
+
+    For each train, *arrays* gives the data array holding it, *offsets* and
+    *lengths* give its location in that array, and *encodings* and *ticks* 
+    describe how it is stored (see encode_train()). Returned arrays are 
+    read-only; float64 trains are views of their data array.
+
+    Encoded trains are decoded with a few vectorized operations for each 
+    data array, regardless of the number of trains.
+    """
+    trains = [None] * len(arrays)
+    groups = OrderedDict()
+    for i, arr in enumerate(arrays):
+        if encodings[i] == 0:
+            trains[i] = arr[offsets[i]:offsets[i]+lengths[i]]
+        elif encodings[i] > 2:
+            trains[i] = _decode_record(arr[offsets[i]:offsets[i]+lengths[i]], ticks[i])
+        else:
+            groups.setdefault(id(arr), []).append(i)
+    for inds in groups.values():
+        arr = arrays[inds[0]]
+        lens = np.array([lengths[i] for i in inds], dtype=np.int64)
+        offs = np.array([offsets[i] for i in inds], dtype=np.int64)
+        starts = np.cumsum(lens) - lens
+        # gather all trains from the data array at once
+        deltas = arr[np.arange(lens.sum()) + np.repeat(offs - starts, lens)]
+        # sample index of every spike, counted from the start of its train
+        counts = np.cumsum(deltas, dtype=np.int64)
+        counts -= np.repeat(np.concatenate([[0], counts])[starts], lens)
+        spikes = counts * np.repeat(np.array([ticks[i] for i in inds], dtype=np.float64), lens)
+        spikes.flags.writeable = False
+        for i, start, end in zip(inds, starts.tolist(), (starts + lens).tolist()):
+            trains[i] = spikes[start:end]
+    return trains
+
+
+def _decode_record(data, tick):
+    """ Return the packed trial record encoded as *data* by encode_train().
+    """
+    n = int(data[0])
+    offsets = data[1:n+2].astype(np.int64)
+    lens = np.diff(offsets)
+    counts = np.cumsum(data[n+2:], dtype=np.int64)
+    counts -= np.repeat(np.concatenate([[0], counts])[offsets[:-1]], lens)
+    record = np.concatenate([[-float(n)], offsets.astype(np.float64), counts * float(tick)])
+    record.flags.writeable = False
+    return record
+
+
+def write_chunk(filename, keys, trains, ticks=None):
+    """ Write a new chunk file containing *trains*, indexed by the
+    (cf, sr, seed, opts) tuples in *keys*. 
+
+    *ticks* gives the sample period used to encode each train (see 
+    encode_train()); if it is None, all trains are stored as float64.
+    The chunk is written to a temporary file and then renamed to *filename*.
+    """
+    if ticks is None:
+        ticks = [None] * len(keys)
+    index = np.zeros(len(keys), dtype=SpikeTrainArchive.index_dtype)
+    data = [[] for dtype in SpikeTrainArchive.data_dtypes]
+    sizes = [0] * len(data)
+    for i, (cf, sr, seed, opts) in enumerate(keys):
+        encoding, encoded = encode_train(trains[i], ticks[i])
+        array = SpikeTrainArchive.encoding_arrays[encoding]
+        index[i]['cf'] = cf
+        index[i]['sr'] = sr
+        index[i]['seed'] = seed
+        index[i]['opts'] = opts
+        index[i]['encoding'] = encoding
+        index[i]['tick'] = ticks[i] or 0
+        index[i]['offset'] = sizes[array]
+        index[i]['length'] = len(encoded)
+        data[array].append(encoded)
+        sizes[array] += len(encoded)
+
+    with atomic_write(filename) as fh:
+        np.lib.format.write_array(fh, index)
+        for arrays, dtype in zip(data, SpikeTrainArchive.data_dtypes):
+            arr = np.concatenate([np.zeros(0, dtype=dtype)] + arrays).astype(dtype)
+            np.lib.format.write_array(fh, arr)
+
+
+def read_chunk(filename):
+    """ Return (index, arrays) stored in a chunk file, where *arrays* holds 
+    one data array for each of SpikeTrainArchive.data_dtypes.
+
+    The index is read into memory, whereas the data arrays are memory-mapped.
+    Chunks written in the older, unencoded format are converted to the 
+    current index format.
+    """
+    index_dtype = SpikeTrainArchive.index_dtype
+    arrays = []
+    with open(filename, 'rb') as fh:
+        index = np.lib.format.read_array(fh)
+        narrays = len(SpikeTrainArchive.data_dtypes) if 'encoding' in index.dtype.names else 1
+        for i in range(narrays):
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(fh)
+            offset = fh.tell()
+            if shape[0] == 0:
+                arrays.append(np.zeros(0, dtype=dtype))
+            else:
+                arrays.append(np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape))
+            fh.seek(offset + shape[0] * dtype.itemsize)
+    if narrays == 1:
+        old = index
+        index = np.zeros(len(old), dtype=index_dtype)
+        for name in old.dtype.names:
+            index[name] = old[name]
+        arrays.extend([np.zeros(0, dtype=dtype) for dtype in SpikeTrainArchive.data_dtypes[1:]])
+    return index, tuple(arrays)
@@ -0,0 +1,172 @@
+"""
+Minimal stand-in for the MATLAB executable, used to test MatlabProcess and
+MatlabPool without MATLAB.
+
+Only the commands issued by cnmodel.util.matlab_proc and cnmodel.an_model.wrapper
+are understood. The model functions are crude imitations of model_IHC and
+model_Synapse that produce deterministic output for a given seed; they are not
+physiologically meaningful.
+
+Usage::
+
+    MatlabProcess(executable=[sys.executable, fake_matlab.__file__])
+"""
+from __future__ import print_function
+import sys, re
+import numpy as np
+import scipy.io
+
+
+workspace = {}
+rng = np.random.RandomState(0)
+files = {}  # open file handles used by the raw transport
+
+
+def model_IHC(pin, cf, nrep, tdres, reptime, cohc, cihc, species):
+    n = int(round(reptime / tdres)) * int(nrep)
+    out = np.zeros((1, n))
+    pin = pin.ravel()
+    out[0, :len(pin)] = 0.01 * np.tanh(pin * cf / 1000.)
+    return out
+
+
+def model_Synapse(vihc, cf, nrep, tdres, fiberType, noiseType, implnt):
+    rate = 200. * fiberType + 1e7 * np.abs(vihc.ravel())
+    psth = (rng.rand(len(rate)) < rate * tdres).astype(float)
+    return rate[None, :], rate[None, :], psth[None, :]
+
+
+def model_Synapse_trials(vihc, cf, nrep, tdres, fiberType, noiseType, implnt, ntrials):
+    trials = []
+    for k in range(int(ntrials)):
+        psth = model_Synapse(vihc, cf, nrep, tdres, fiberType, noiseType, implnt)[2]
+        trials.append(np.argwhere(psth.ravel()).ravel().astype(float))
+    counts = np.array([[len(t) for t in trials]], dtype=float)
+    return np.concatenate([np.zeros(0)] + trials)[None, :], counts
+
+
+functions = {'model_IHC': model_IHC, 'model_Synapse': model_Synapse,
+             'model_Synapse_trials': model_Synapse_trials, 'mexANmodel': None}
+
+
+def value(expr):
+    expr = expr.strip()
+    if expr in workspace:
+        return workspace[expr]
+    return float(expr)
+
+
+def run(cmd):
+    """ Execute one command block and return its output.
+    """
+    output = []
+    for line in cmd.split('\n'):
+        line = line.strip()
+        if line == '':
+            continue
+        m = re.match(r"exist (\w+)$", line)
+        if m:
+            name = m.groups()[0]
+            output.append(str(2 if name in functions else (1 if name in workspace else 0)))
+            continue
+        m = re.match(r"RandStream\.setGlobalStream\(RandStream\('mcg16807','seed',(\d+)\)\);$", line)
+        if m:
+            rng.seed(int(m.groups()[0]))
+            continue
+        m = re.match(r"load\('(.*)'\)$", line)
+        if m:
+            data = scipy.io.loadmat(m.groups()[0])
+            workspace.update(dict([(k, v) for k, v in data.items() if not k.startswith('__')]))
+            continue
+        m = re.match(r"save\('(.*)', '(\w+)', '-v7'\)$", line)
+        if m:
+            filename, name = m.groups()
+            scipy.io.savemat(filename, {name: workspace[name]})
+            continue
+        # raw transport (see MatlabProcess._get_raw and _set_raw)
+        m = re.match(r"if isa\((\w+), 'double'\).*fopen\('([^']*)', 'w'.*end$", line)
+        if m:
+            name, filename = m.groups()
+            val = workspace[name]
+            if isinstance(val, np.ndarray) and val.dtype == np.float64:
+                header = np.array([val.ndim] + list(val.shape), dtype='<f8')
+                with open(filename, 'wb') as fh:
+                    fh.write(header.tobytes())
+                    fh.write(val.astype('<f8').ravel(order='F').tobytes())
+                output.append('::raw')
+            continue
+        m = re.match(r"(\w+) = fopen\('([^']*)', 'r', 'ieee-le'\);$", line)
+        if m:
+            files[m.groups()[0]] = open(m.groups()[1], 'rb')
+            continue
+        m = re.match(r"(\w+) = reshape\(fread\((\w+), (\d+), 'double=>double'\), \[([\d ]*)\]\);$", line)
+        if m:
+            name, fid, n, dims = m.groups()
+            data = np.frombuffer(files[fid].read(8 * int(n)), dtype='<f8')
+            workspace[name] = data.reshape([int(d) for d in dims.split()], order='F')
+            continue
+        m = re.match(r"fclose\((\w+)\); clear \w+;$", line)
+        if m:
+            files.pop(m.groups()[0]).close()
+            continue
+        m = re.match(r"clear (.*);$", line)
+        if m:
+            for name in m.groups()[0].split():
+                workspace.pop(name, None)
+            continue
+        m = re.match(r"\[(.*)\] = (\w+)\((.*)\);$", line)
+        if m:
+            rets, fn, args = m.groups()
+            result = functions[fn](*[value(a) for a in args.split(',')])
+            if not isinstance(result, tuple):
+                result = (result,)
+            for name, val in zip(rets.split(','), result):
+                workspace[name] = val
+            continue
+        if line == 'exit;':
+            sys.exit(0)
+        raise ValueError("Unsupported command: %s" % line)
+    return '\n'.join(output)
+
+
+def skip_bootstrap(stdin):
+    """ Read and discard the command loop sent by MatlabProcess on startup.
+    """
+    depth = 0
+    for line in iter(stdin.readline, ''):
+        line = line.strip()
+        if re.match(r"(while|if|for|try)\b", line):
+            depth += 1
+        elif line == 'end':
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def main():
+    print("Fake MATLAB for cnmodel tests")
+    print("Copyright nobody")
+    print("R0000a (fake)")
+    sys.stdout.flush()
+    skip_bootstrap(sys.stdin)
+    cmd = []
+    print("\n::ready")
+    sys.stdout.flush()
+    for line in iter(sys.stdin.readline, ''):
+        if line.strip() != '::cmd_done':
+            cmd.append(line)
+            continue
+        try:
+            print(run(''.join(cmd)))
+            print("\n::ok")
+        except Exception as exc:
+            print("\n::err")
+            print("::message:%s" % exc)
+            print("::identifier:fake:error")
+        print("\n::ready")
+        sys.stdout.flush()
+        cmd = []
+
+
+if __name__ == '__main__':
+    main()
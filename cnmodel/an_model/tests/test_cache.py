@@ -1,5 +1,6 @@
-import os, tempfile
-from multiprocessing import Pool
+import os, tempfile, socket, threading
+import numpy as np
+from multiprocessing import Pool, Process
 import cnmodel.an_model.cache as cache
 import cnmodel.util.sound as sound
 from cnmodel import an_model
@@ -18,22 +19,559 @@ def run_sim(*args):
                          ramp_duration=0.002, pip_duration=0.004, 
                          pip_start=[0.001])
     spikes = an_model.get_spiketrain(cf=cf, sr=sr, seed=seed, stim=stim)
-    cf = cache.get_cache_filename(cf, sr, seed, stim)
-    mtime = os.stat(cf).st_mtime
-    return cf, mtime, spikes
+    # location of the train in the archive: (chunk file, offset, length)
+    chunk, offset, length = cache.get_archive(stim).locate(cf, sr, seed, cache.make_opts_key())
+    return chunk, offset, spikes
 
 
 def test_cache():
     new_cache()
-    cfile1, mtime1, spikes1 = run_sim()
-    cfile2, mtime2, spikes2 = run_sim()
+    cfile1, offset1, spikes1 = run_sim()
+    cfile2, offset2, spikes2 = run_sim()
     assert cfile1 == cfile2
-    assert mtime1 == mtime2
+    assert offset1 == offset2
     assert all(spikes1 == spikes2)
 
 
+def test_archive():
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    cfs = [1000, 2000, 4000]
+    trains = an_model.get_spiketrains(cfs, 2, [1, 2, 3], stim)
+    
+    # all trains generated in one batch are stored in a single chunk
+    archive = cache.get_archive(stim)
+    assert len(archive.chunk_files()) == 1
+    an_model.get_spiketrain(cf=8000, sr=1, seed=4, stim=stim)
+    assert len(archive.chunk_files()) == 2
+    archive.compact()
+    assert len(archive.chunk_files()) == 1
+    trains2 = an_model.get_spiketrains(cfs, 2, [1, 2, 3], stim)
+    for t1, t2 in zip(trains, trains2):
+        assert np.all(t1 == t2)
+
+
+def test_encoding():
+    from cnmodel.an_model.store import SpikeTrainArchive, SpikeTrains, read_chunk
+    new_cache()
+    dt = 1e-5
+    rng = np.random.RandomState(0)
+    grid = [np.cumsum(rng.randint(1, 1000, size=200)) * dt,  # uint16
+            np.array([0, 50000, 120000]) * dt,  # long intervals: uint32
+            np.zeros(0),
+            rng.uniform(0, 0.1, size=50).cumsum(),  # not on the grid
+            SpikeTrains.from_list([[3 * dt], [dt, 2 * dt]]).to_record()]
+    keys = [(1000., 2, i, cache.make_opts_key()) for i in range(len(grid))]
+    archive = SpikeTrainArchive(os.path.join(cache._cache_path, 'enc'))
+    archive.append(keys, grid, tick=dt)
+    index, arrays = read_chunk(archive.chunk_files()[0])
+    assert list(index['encoding']) == [1, 2, 1, 0, 3]
+    # the record is encoded too, after the first train
+    assert len(arrays[1]) == 200 + len(grid[4]) and arrays[1].dtype == np.uint16
+    
+    # decoding gives exactly the original spike times, before and after 
+    # compaction
+    archive.append(keys[:1], grid[:1], tick=dt)
+    for i in range(2):
+        trains = SpikeTrainArchive(archive.path).get_many(keys)
+        for t1, t2 in zip(grid, trains):
+            assert np.array_equal(t1, t2)
+            assert not t2.flags.writeable
+        archive.compact()
+    assert cache.verify_cache() == []
+    
+    # chunks written before encoding was introduced are still read
+    old_index = np.zeros(1, dtype=[(k, SpikeTrainArchive.index_dtype[k]) for k in 
+                                   ('cf', 'sr', 'seed', 'opts', 'offset', 'length')])
+    old_index[0] = (1000., 2, 99, keys[0][3], 0, 3)
+    with open(archive.new_chunk_filename(), 'wb') as fh:
+        np.lib.format.write_array(fh, old_index)
+        np.lib.format.write_array(fh, np.array([0.1, 0.2, 0.3]))
+    assert np.all(archive.get(1000., 2, 99, keys[0][3]) == [0.1, 0.2, 0.3])
+
+
+def test_encoding_generated():
+    # trains of the cochlea and fast simulators are on the sample grid only
+    # to within rounding error; they are still encoded, and read back 
+    # exactly as they were returned
+    from cnmodel.an_model.store import encode_train, read_chunk
+    from cnmodel.an_model import fast
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    rate_fn = lambda cfs, srs: fast.firing_rates(stim, cfs, srs)
+    raw = fast.sample_spiketrains([4000] * 3, 2, [1, 2, 3], rate_fn)
+    raw = raw + [t.to_record() for t in 
+                 fast.sample_spiketrains(4000, 2, [4], rate_fn, ntrials=4)]
+    assert not np.array_equal(raw[0], np.round(raw[0] / stim.dt) * stim.dt)
+    assert [encode_train(t, stim.dt)[0] for t in raw] == [1, 1, 1, 3]
+    
+    for simulator in ('fast', cache.detect_simulator()):
+        kwds = dict(simulator=simulator)
+        trains = an_model.get_spiketrains([4000] * 3, 2, [1, 2, 3], stim, **kwds)
+        trials = an_model.get_spiketrain(4000, 2, stim, 4, ntrials=4, **kwds)
+        for chunk in cache.get_archive(stim).chunk_files():
+            assert 0 not in read_chunk(chunk)[0]['encoding']
+        cache.clear_memo()
+        trains2 = an_model.get_spiketrains([4000] * 3, 2, [1, 2, 3], stim, **kwds)
+        trials2 = an_model.get_spiketrain(4000, 2, stim, 4, ntrials=4, **kwds)
+        for t1, t2 in zip(trains, trains2):
+            assert np.array_equal(t1, t2)
+        assert np.array_equal(trials.spikes, trials2.spikes)
+        new_cache()
+
+
+def test_migrate_legacy():
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    # write a train using the legacy layout
+    data = np.array([0.001, 0.0023, 0.0071])
+    fname = cache.get_cache_filename(cf=1234.5, sr=1, seed=7, stim=stim)
+    os.makedirs(os.path.dirname(fname))
+    np.savez_compressed(fname, data=data)
+    
+    # legacy trains are read directly..
+    assert np.all(an_model.get_spiketrain(cf=1234.5, sr=1, seed=7, stim=stim) == data)
+    
+    # ..and can be moved into the archive
+    assert cache.migrate_legacy_cache(remove=True) == 1
+    assert not os.path.exists(os.path.dirname(fname))
+    # (spike times are rounded to the sample grid when stored)
+    assert np.allclose(cache.get_archive(stim).get(1234.5, 1, 7, cache.make_opts_key()), data, rtol=0, atol=1e-12)
+    assert np.allclose(an_model.get_spiketrain(cf=1234.5, sr=1, seed=7, stim=stim), data, rtol=0, atol=1e-12)
+
+
+def test_stim_keys():
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    # equivalent parameters map to the same fixed-length key
+    stim2 = sound.TonePip(rate=100000, duration=0.01, f0=4000.0, dbspl=80.,
+                          ramp_duration=0.002, pip_duration=0.004, 
+                          pip_start=(0.001,))
+    key = cache.get_stim_key(stim)
+    assert len(key) == 40
+    assert cache.get_stim_key(stim2) == key
+    
+    train = an_model.get_spiketrain(cf=1000, sr=2, seed=1, stim=stim)
+    cache.clear_memo()
+    assert np.all(an_model.get_spiketrain(cf=1000., sr=2, seed=1, stim=stim2) == train)
+    manifest = cache.read_manifest(cache.get_archive(stim).path)
+    assert manifest['key'] == key
+    assert sound.create(**manifest['stimulus']).fingerprint() == key
+    
+    # a differently specified stimulus can be aliased to an equivalent one
+    stim3 = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                          ramp_duration=0.002, pip_duration=0.004, 
+                          pip_start=[0.001], label='repeat')
+    assert cache.get_stim_key(stim3) != key
+    cache.alias_stimulus(stim3, stim)
+    assert cache.get_stim_key(stim3) == key
+    assert stim3.fingerprint() in cache.read_manifest(cache.get_archive(stim).path)['aliases']
+    cache.clear_memo()
+    assert np.all(an_model.get_spiketrain(cf=1000, sr=2, seed=1, stim=stim3) == train)
+    
+    # or matched by waveform
+    stim4 = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                          ramp_duration=0.002, pip_duration=0.004, 
+                          pip_start=[0.001], label='other')
+    cache.set_hash_waveforms(True)
+    try:
+        assert cache.get_stim_key(stim4) == stim.fingerprint(waveform=True)
+    finally:
+        cache.set_hash_waveforms(False)
+    
+
+def test_batch():
+    # Trains generated in a single batch must match those generated one at a
+    # time, even though the IHC stage is shared between fibers.
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    cfs = [1000, 1000, 1000, 2000]
+    srs = [0, 2, 2, 1]
+    seeds = [1, 2, 3, 4]
+    batch = cache.generate_spiketrains(cfs, srs, seeds, stim)
+    for i in range(len(cfs)):
+        single = cache.generate_spiketrain(cfs[i], srs[i], stim, seeds[i])
+        assert len(single) == len(batch[i])
+        assert all(single == batch[i])
+    
+    # batch access to the cache returns the same trains, and reads back the
+    # trains that were cached one at a time
+    trains1 = an_model.get_spiketrains(cfs, srs, seeds, stim)
+    trains2 = an_model.get_spiketrains(cfs, srs, seeds, stim)
+    for i in range(len(cfs)):
+        assert all(trains1[i] == batch[i])
+        assert all(trains2[i] == batch[i])
+        
+
+def test_trials():
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    trials = an_model.get_spiketrain(cf=1000, sr=2, seed=5, stim=stim, ntrials=8)
+    assert len(trials) == 8
+    # the first trial matches the train generated without ntrials; later 
+    # trials are different
+    single = cache.generate_spiketrain(1000, 2, stim, 5)
+    assert np.all(trials[0] == single)
+    assert any([not np.array_equal(trials[0], t) for t in list(trials)[1:]])
+    
+    # all trials are stored as a single record, separate from single trains
+    archive = cache.get_archive(stim)
+    assert len(archive.keys()) == 1
+    cache.clear_memo()
+    trials2 = an_model.get_spiketrains([1000, 2000], 2, [5, 6], stim, ntrials=8)
+    assert len(archive.keys()) == 2
+    assert np.all(trials2[0].spikes == trials.spikes)
+    assert np.all(trials2[0].offsets == trials.offsets)
+    batch = cache.generate_spiketrains([2000], 2, [6], stim, ntrials=8)
+    for t1, t2 in zip(trials2[1], batch[0]):
+        assert np.all(t1 == t2)
+    assert cache.verify_cache() == []
+
+    # records in the old layout (offsets first, without the count) are
+    # stored under a different key and never returned
+    old = np.concatenate([trials.offsets.astype(float), trials.spikes[::-1]])
+    archive.append([(1000, 2, 5, cache.make_opts_key(ntrials=8))], [old])
+    cache.clear_memo()
+    trials3 = an_model.get_spiketrain(cf=1000, sr=2, seed=5, stim=stim, ntrials=8)
+    assert np.all(trials3.spikes == trials.spikes)
+
+
+def test_resample():
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    seeds = list(range(200))
+    trains = an_model.get_spiketrains(4000, 2, seeds, stim, resample=True)
+    # the rate function is computed once and cached
+    rate = cache.get_rate(4000, 2, stim, cache.detect_simulator())
+    assert os.path.exists(cache.get_rate_cache_filename(4000, 2, stim, cache.detect_simulator()))
+    assert rate.dtype == np.float32 and len(rate) == len(stim.sound)
+    
+    # trains are independent, reproducible, and follow the rate function
+    assert len(set([tuple(t) for t in trains])) > 100
+    cache.clear_memo()
+    trains2 = cache.generate_spiketrains(4000, 2, seeds[:10], stim, resample=True)
+    for t1, t2 in zip(trains, trains2):
+        assert np.all(t1 == t2)
+    # the mean of the dead-time corrected rate (not the correction applied
+    # to the mean rate, which is larger)
+    expected = np.mean(rate / (1 + 0.75e-3 * rate))
+    measured = np.mean([len(t) for t in trains]) / stim.duration
+    assert abs(measured - expected) < 0.2 * expected
+    
+    # resampled trains are cached separately from model trains
+    archive = cache.get_archive(stim)
+    assert len(archive.keys()) == len(seeds)
+    an_model.get_spiketrain(4000, 2, stim, 0)
+    assert len(archive.keys()) == len(seeds) + 1
+
+
+def test_ihc_cache():
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    simulator = cache.detect_simulator()
+    spikes1 = cache.generate_spiketrain(1000, 2, stim, 1234, simulator=simulator)
+    
+    # IHC waveform is cached in float32 and reused for new seeds / SR groups
+    ihc_file = cache.get_ihc_cache_filename(1000, stim, simulator)
+    assert os.path.isfile(ihc_file)
+    mtime = os.stat(ihc_file).st_mtime
+    inode = os.stat(ihc_file).st_ino
+    vihc = cache.get_ihc(1000, stim, simulator)
+    assert vihc.dtype == np.float32
+    cache.generate_spiketrain(1000, 0, stim, 5678, simulator=simulator)
+    assert os.stat(ihc_file).st_ino == inode  # not regenerated
+    
+    # spike trains do not depend on whether the IHC waveform was cached
+    spikes2 = cache.generate_spiketrain(1000, 2, stim, 1234, simulator=simulator)
+    assert all(spikes1 == spikes2)
+    
+    # eviction removes least-recently used waveforms
+    cache.generate_spiketrain(2000, 2, stim, 1234, simulator=simulator)
+    ihc_file2 = cache.get_ihc_cache_filename(2000, stim, simulator)
+    os.utime(ihc_file, (mtime - 10, mtime - 10))
+    cache.evict_ihc_cache(max_size=os.stat(ihc_file2).st_size)
+    assert not os.path.exists(ihc_file)
+    assert os.path.exists(ihc_file2)
+    cache.evict_ihc_cache(max_size=0)
+    assert not os.path.exists(ihc_file2)
+    
+    # new waveforms are counted without scanning the cache, which is only 
+    # evicted when the count exceeds the limit
+    root = os.path.join(cache._cache_path, cache._ihc_cache_dir)
+    assert cache._ihc_cache_sizes[root] == 0
+    max_size = cache._ihc_cache_max_size
+    try:
+        cache.get_ihc(1000, stim, simulator)
+        size = os.stat(ihc_file).st_size
+        assert cache._ihc_cache_sizes[root] == size
+        os.utime(ihc_file, (mtime - 10, mtime - 10))
+        cache._ihc_cache_max_size = size + 1
+        cache.get_ihc(2000, stim, simulator)
+        assert not os.path.exists(ihc_file)
+        assert os.path.exists(ihc_file2)
+        assert cache._ihc_cache_sizes[root] == os.stat(ihc_file2).st_size
+    finally:
+        cache._ihc_cache_max_size = max_size
+
+
+def test_cochlea_options():
+    new_cache()
+    if cache._cochlea_zilany is None:
+        return
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    calls = []
+    run_ihc = cache._cochlea_zilany.run_ihc
+    def record_ihc(**kwds):
+        calls.append(kwds)
+        return run_ihc(**kwds)
+    cache._cochlea_zilany.run_ihc = record_ihc
+    try:
+        # IHC options are passed to cochlea
+        cache.get_ihc(1000, stim, 'cochlea', cohc=0.5, species=2)
+        assert calls[-1]['cohc'] == 0.5
+        assert calls[-1]['cihc'] == 1.
+        assert calls[-1]['species'] == 'human'
+        cache.get_ihc(1000, stim, 'cochlea')
+        assert calls[-1]['cohc'] == 1.
+        assert calls[-1]['species'] == 'cat'
+        assert len(calls) == 2
+        # options that cochlea does not support are rejected
+        for kwds, exc in [({'implnt': 1}, TypeError), ({'species': 5}, ValueError)]:
+            try:
+                cache.generate_spiketrain(1000, 2, stim, 1, simulator='cochlea', **kwds)
+                raise AssertionError("Expected %s" % exc.__name__)
+            except exc:
+                pass
+    finally:
+        cache._cochlea_zilany.run_ihc = run_ihc
+
+
+def test_cochlea_fallback():
+    # without the internal stages of cochlea, each fiber is simulated by 
+    # cochlea.run_zilany2014()
+    new_cache()
+    if not cache.HAVE_COCHLEA:
+        return
+    import cochlea
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    stages = cache._cochlea_zilany
+    cache._cochlea_zilany = None
+    try:
+        spikes = cache.generate_spiketrain(1000, 2, stim, 1234, simulator='cochlea')
+        sp = cochlea.run_zilany2014(stim.sound, fs=100000, anf_num=[1, 0, 0], 
+                                    cf=1000, seed=1234, species='cat')
+        assert np.allclose(spikes, sp.spikes.values[0])
+        assert not os.path.exists(cache.get_ihc_cache_filename(1000, stim, 'cochlea'))
+        for kwds in [{'ntrials': 2}, {'resample': True}]:
+            try:
+                cache.generate_spiketrains([1000], [2], [1234], stim, 
+                                           simulator='cochlea', **kwds)
+                raise AssertionError("Expected ValueError")
+            except ValueError as exc:
+                assert '_zilany2014' in str(exc)
+    finally:
+        cache._cochlea_zilany = stages
+
+
+def test_cache_management():
+    new_cache()
+    stims = [sound.TonePip(rate=100e3, duration=0.01, f0=f0, dbspl=80,
+                           ramp_duration=0.002, pip_duration=0.004, 
+                           pip_start=[0.001]) for f0 in (2000, 4000, 8000)]
+    an_model.get_spiketrains([1000, 2000], 2, 1, stims[0])
+    cache.clear_memo()
+    an_model.get_spiketrains([1000, 2000], 2, 1, stims[0])
+    
+    # usage statistics
+    stats = cache.read_stats()
+    name = os.path.basename(cache.get_archive(stims[0]).path)
+    assert stats[name]['hits'] == 2
+    assert stats[name]['misses'] == 2
+    cache.flush_stats()
+    assert cache.read_stats()[name]['hits'] == 2
+    assert os.path.isfile(os.path.join(cache._cache_path, cache._index_file))
+    
+    # least-recently used stimuli are evicted when the cache is too large
+    an_model.get_spiketrains([1000, 2000], 2, 1, stims[1])
+    size = max([r['size'] for r in cache.cache_report()])
+    path0 = cache.get_archive(stims[0]).path
+    os.utime(path0, (0, 0))
+    cache.set_max_size(size * 2.5)
+    try:
+        an_model.get_spiketrains([1000, 2000], 2, 1, stims[2])
+    finally:
+        cache.set_max_size(None)
+    paths = [r['path'] for r in cache.cache_report()]
+    assert len(paths) == 2
+    assert path0 not in paths
+    
+    # verification detects corrupt files
+    assert cache.verify_cache() == []
+    chunk = cache.get_archive(stims[1]).chunk_files()[0]
+    open(chunk, 'wb').write(b'garbage')
+    problems = cache.verify_cache(fix=True)
+    assert len(problems) == 1 and problems[0][0] == chunk
+    assert not os.path.exists(chunk)
+
+
+def test_memo():
+    new_cache()
+    cache.clear_memo()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    spikes1 = an_model.get_spiketrain(cf=1000, sr=2, seed=1, stim=stim)
+    info = cache.memo_info()
+    assert info['entries'] == 1 and info['bytes'] == spikes1.nbytes
+    
+    # memo hits do not touch the disk cache
+    path = cache.get_archive(stim).path
+    os.rename(path, path + '_moved')
+    spikes2 = an_model.get_spiketrain(cf=1000, sr=2, seed=1, stim=stim)
+    assert spikes2 is spikes1
+    assert cache.memo_info()['hits'] == 1
+    trains = an_model.get_spiketrains([1000], [2], [1], stim)
+    assert trains[0] is spikes1
+    os.rename(path + '_moved', path)
+    
+    # byte budget
+    an_model.get_spiketrain(cf=2000, sr=2, seed=1, stim=stim)
+    assert cache.memo_info()['entries'] == 2
+    cache.set_memo_size(cache.memo_info()['bytes'] - 1)
+    assert cache.memo_info()['entries'] == 1
+    cache.set_memo_size(256 * 1024**2)
+    
+    cache.clear_memo()
+    assert cache.memo_info()['entries'] == 0
+
+
+def test_in_flight():
+    new_cache()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    archive = cache.get_archive(stim)
+    key = (1000., 2, 5, cache.make_opts_key())
+    memo_key = (cache.get_stim_key(stim),) + archive.make_key(*key)
+    marker = cache._in_flight_marker(archive, memo_key)
+    
+    # Pretend that another live process is generating the train; we should
+    # wait for its result rather than generating the train ourselves.
+    fake = np.array([0.001, 0.002])
+    os.makedirs(archive.path)
+    open(marker.path, 'w').write('%s %d' % (socket.gethostname(), os.getpid()))
+    def finish():
+        archive.append([key], [fake])
+        os.remove(marker.path)
+    threading.Timer(0.2, finish).start()
+    assert np.all(an_model.get_spiketrain(cf=1000., sr=2, seed=5, stim=stim) == fake)
+    
+    # Markers left by dead processes are ignored
+    proc = Process(target=int)
+    proc.start()
+    proc.join()
+    key = (1000., 2, 6, cache.make_opts_key())
+    memo_key = (cache.get_stim_key(stim),) + archive.make_key(*key)
+    marker = cache._in_flight_marker(archive, memo_key)
+    open(marker.path, 'w').write('%s %d' % (socket.gethostname(), proc.pid))
+    train = an_model.get_spiketrain(cf=1000., sr=2, seed=6, stim=stim)
+    assert not os.path.exists(marker.path)
+    assert np.all(archive.get(*key) == train)
+
+
+def test_shift_reuse():
+    new_cache()
+    cache.set_shift_reuse(True)
+    try:
+        kwds = dict(rate=100e3, duration=0.04, f0=4000, dbspl=80,
+                    ramp_duration=0.002, pip_duration=0.004)
+        stim1 = sound.TonePip(pip_start=[0.008], **kwds)
+        trains1 = an_model.get_spiketrains(4000, 2, [1, 2], stim1)
+        
+        # delayed copies are served by shifting the cached trains; spikes 
+        # wrap around at the edges
+        for start in (0.0055, 0.01):
+            stim2 = sound.TonePip(pip_start=[start], **kwds)
+            info = cache.shift_info()
+            trains2 = an_model.get_spiketrains(4000, 2, [1, 2], stim2)
+            assert cache.shift_info()['hits'] == info['hits'] + 2
+            for t1, t2 in zip(trains1, trains2):
+                t1 = np.sort(np.mod(t1 + start - 0.008, stim1.num_samples * stim1.dt))
+                assert np.allclose(t1, t2)
+            assert len(cache.get_archive(stim2).keys()) == 2
+            assert cache.read_stats()[cache.get_stim_key(stim2)]['shifted'] == 2
+        
+        # shifts that would wrap the response around are not used
+        stim3 = sound.TonePip(pip_start=[0.02], **kwds)
+        info = cache.shift_info()
+        an_model.get_spiketrains(4000, 2, [1, 2], stim3)
+        assert cache.shift_info() == {'hits': info['hits'], 'misses': info['misses'] + 2}
+        
+        # nor are stimuli of different duration
+        stim4 = sound.TonePip(pip_start=[0.0055], **dict(kwds, duration=0.05))
+        info = cache.shift_info()
+        an_model.get_spiketrains(4000, 2, [1, 2], stim4)
+        assert cache.shift_info()['hits'] == info['hits']
+        
+        # trials are shifted together
+        trials1 = an_model.get_spiketrain(4000, 2, stim1, 3, ntrials=4)
+        trials2 = an_model.get_spiketrain(4000, 2, stim2, 3, ntrials=4)
+        for t1, t2 in zip(trials1, trials2):
+            assert np.allclose(np.sort(np.mod(t1 + 0.002, 0.04001)), t2)
+    finally:
+        cache.set_shift_reuse(False)
+
+
+def test_prewarm():
+    new_cache()
+    stims = [sound.TonePip(rate=100e3, duration=0.01, f0=f0, dbspl=80,
+                           ramp_duration=0.002, pip_duration=0.004, 
+                           pip_start=[0.001]) for f0 in (2000, 4000)]
+    cfs = [1000, 2000, 4000]
+    srs = [0, 1, 2]
+    an_model.get_spiketrains(cfs[:2], srs[:2], [10, 11], stims[0])
+    
+    # only the missing trains are generated, with seeds offset per fiber
+    filename = os.path.join(cache._cache_path, 'manifest.json')
+    an_model.write_prewarm_manifest(filename, stims, cfs, srs, seeds=[10, 20], 
+                                    seed_offsets=[0, 1, 2])
+    args = cache.read_prewarm_manifest(filename)
+    reports = []
+    n = an_model.prewarm(batch_size=2, progress=lambda *args: reports.append(args), **args)
+    assert n == 10
+    assert reports == [(1, 10), (3, 10), (4, 10), (6, 10), (7, 10), (9, 10), (10, 10)]
+    for stim in stims:
+        for seed in (10, 20):
+            keys = [(cf, sr, seed + i, cache.make_opts_key()) for i, (cf, sr) in 
+                    enumerate(zip(cfs, srs))]
+            assert all([t is not None for t in cache.get_archive(stim).get_many(keys)])
+    
+    # resuming finds nothing to do
+    assert an_model.prewarm(**args) == 0
+
+
 def test_parallel():
-    # Make sure file locking works correctly.
+    # Make sure concurrent access to the cache works correctly.
     new_cache()  # note that subprocesses will all inherit this new cache 
     p = Pool(10)
     results = p.map(run_sim, range(10))
@@ -0,0 +1,53 @@
+import tempfile
+import numpy as np
+import cnmodel.an_model.cache as cache
+import cnmodel.an_model.fast as fast
+import cnmodel.util.sound as sound
+from cnmodel import an_model
+
+
+def tone(dbspl):
+    return sound.TonePip(rate=100e3, duration=0.2, f0=4000, dbspl=dbspl,
+                         ramp_duration=2.5e-3, pip_duration=0.1, 
+                         pip_start=[0.05])
+
+
+def test_fast_rates():
+    # spontaneous and driven rates are ordered by SR group and increase
+    # with level
+    n = 10
+    driven = []
+    for dbspl in (20, 60):
+        trains = fast.generate_spiketrains([4000]*3*n, [0, 1, 2]*n, range(3*n), tone(dbspl))
+        spont = [np.mean([(t < 0.05).sum() / 0.05 for t in trains[sr::3]]) for sr in range(3)]
+        rates = [np.mean([((t > 0.05) & (t < 0.15)).sum() / 0.1 for t in trains[sr::3]]) 
+                 for sr in range(3)]
+        assert spont[0] < spont[1] < spont[2]
+        assert 60 < spont[2] < 120
+        driven.append(rates)
+        # refractory period is respected
+        assert min([np.diff(t).min() for t in trains if len(t) > 1]) > fast._refractory - 1e-9
+    assert np.all(np.array(driven[1]) > np.array(driven[0]))
+    assert driven[1][2] > 200
+
+
+def test_fast_cache():
+    cache._cache_path = tempfile.mkdtemp()
+    stim = tone(60)
+    cfs = [1000, 4000, 4000, 8000]
+    srs = [2, 0, 2, 1]
+    seeds = [1, 2, 3, 4]
+    trains = an_model.get_spiketrains(cfs, srs, seeds, stim, simulator='fast')
+    # each train depends only on its own fiber, not on the rest of the batch
+    for i in range(len(cfs)):
+        single = cache.generate_spiketrain(cfs[i], srs[i], stim, seeds[i], simulator='fast')
+        assert np.all(single == trains[i])
+    assert len(cache.get_archive(stim).keys()) == len(cfs)
+    
+    trials = an_model.get_spiketrain(4000, 2, stim, 3, simulator='fast', ntrials=4)
+    assert len(trials) == 4
+    assert np.all(trials[0] == trains[2])
+    
+    report = fast.fidelity_report(stim, [4000], [2], seeds, reference='fast')
+    assert report[0]['ntrains'] == len(seeds)
+    assert abs(report[0]['psth_corr'] - 1) < 1e-9
@@ -0,0 +1,87 @@
+import sys, os, time, tempfile, traceback
+import numpy as np
+import cnmodel.an_model.cache as cache
+import cnmodel.an_model.wrapper as wrapper
+import cnmodel.util.sound as sound
+from cnmodel.util.matlab_proc import MatlabProcess
+
+# Stand-in for the MATLAB executable; see fake_matlab.py
+fake_matlab = [sys.executable, os.path.join(os.path.dirname(__file__), 'fake_matlab.py')]
+
+
+def test_matlab_pool():
+    pool = wrapper.MatlabPool(3, executable=fake_matlab)
+    try:
+        assert pool.workers == 3
+        # requests are distributed over all workers
+        def task(proc):
+            time.sleep(0.05)
+            return proc
+        reqs = [pool.submit(task) for i in range(12)]
+        procs = set([id(req.result()) for req in reqs])
+        assert procs == set([id(proc) for proc in pool.procs])
+        
+        # errors are raised when the result is requested
+        req = pool.submit(lambda proc: proc('unknown_command'))
+        try:
+            req.result()
+            raise AssertionError("MATLAB error was not raised")
+        except Exception as exc:
+            assert 'Unsupported command' in str(exc)
+        
+        # the traceback reaches into the worker thread
+        def fail(proc):
+            raise KeyError('x')
+        try:
+            pool.submit(fail).result()
+            raise AssertionError("Expected KeyError")
+        except KeyError:
+            tb = traceback.extract_tb(sys.exc_info()[2])
+            assert tb[-1][2] == 'fail'
+    finally:
+        pool.close()
+    
+    try:
+        wrapper.MatlabPool(0, executable=fake_matlab)
+        raise AssertionError("Expected ValueError")
+    except ValueError:
+        pass
+
+
+def test_generate_with_pool():
+    cache._cache_path = tempfile.mkdtemp()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    cfs = [1000, 1000, 2000, 4000, 4000, 4000]
+    srs = [0, 2, 1, 2, 1, 2]
+    seeds = [1, 2, 3, 4, 5, 6]
+    
+    # fibers are seeded individually, so results do not depend on the 
+    # number of workers
+    results = []
+    for workers in (1, 3):
+        wrapper.set_matlab_workers(workers, executable=fake_matlab)
+        try:
+            results.append(cache.generate_spiketrains(cfs, srs, seeds, stim, 
+                                                      simulator='matlab'))
+        finally:
+            wrapper.set_matlab_workers(0)
+    assert wrapper.get_matlab_pool() is None
+    for t1, t2 in zip(*results):
+        assert len(t1) > 0
+        assert np.all(t1 == t2)
+    
+    # trials generated in one call start from the same seed as single trains
+    trials = []
+    for workers in (1, 2):
+        wrapper.set_matlab_workers(workers, executable=fake_matlab)
+        try:
+            trials.append(cache.generate_spiketrains(cfs, srs, seeds, stim, 
+                                                     simulator='matlab', ntrials=3))
+        finally:
+            wrapper.set_matlab_workers(0)
+    for t1, t2, single in zip(trials[0], trials[1], results[0]):
+        assert len(t1) == 3
+        assert np.all(t1.spikes == t2.spikes)
+        assert np.all(t1[0] == single)
@@ -0,0 +1,35 @@
+import tempfile
+import numpy as np
+import cnmodel.an_model.cache as cache
+import cnmodel.util.sound as sound
+from cnmodel.an_model.pool import SpikeTrainPool, SpikeTrains
+
+
+def test_pool():
+    cache._cache_path = tempfile.mkdtemp()
+    stim = sound.TonePip(rate=100e3, duration=0.01, f0=4000, dbspl=80,
+                         ramp_duration=0.002, pip_duration=0.004, 
+                         pip_start=[0.001])
+    cfs = [4000, 1000, 2000, 1000, 4000, 8000, 2000]
+    srs = [2, 1, 0, 2, 0, 1, 2]
+    seeds = list(range(100, 107))
+    
+    with SpikeTrainPool(workers=3, chunk_size=2) as pool:
+        trains = pool.get_spiketrains(cfs, srs, seeds, stim)
+    assert isinstance(trains, SpikeTrains)
+    assert len(trains) == len(cfs)
+    
+    # workers write through to the disk cache
+    archive = cache.get_archive(stim)
+    assert len(archive.keys()) == len(cfs)
+    
+    # results do not depend on the number of workers or chunk size
+    cache._cache_path = tempfile.mkdtemp()
+    cache.clear_memo()
+    with SpikeTrainPool(workers=1) as pool:
+        trains2 = pool.get_spiketrains(cfs, srs, seeds, stim)
+    expected = cache.get_spiketrains(cfs, srs, seeds, stim)
+    for t1, t2, t3 in zip(trains, trains2, expected):
+        assert np.all(t1 == t2)
+        assert np.all(t1 == t3)
+    assert np.all(trains.lengths == [len(t) for t in expected])
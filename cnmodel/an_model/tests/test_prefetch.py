@@ -0,0 +1,72 @@
+import sys, tempfile, time, traceback
+import numpy as np
+import cnmodel.an_model.cache as cache
+import cnmodel.util.sound as sound
+from cnmodel.an_model.prefetch import SpikeTrainPrefetcher
+
+
+def test_prefetch():
+    cache._cache_path = tempfile.mkdtemp()
+    stims = [sound.TonePip(rate=100e3, duration=0.01, f0=f0, dbspl=80,
+                           ramp_duration=0.002, pip_duration=0.004, 
+                           pip_start=[0.001]) for f0 in (2000, 4000, 8000, 4000)]
+    cfs = [1000, 4000, 8000]
+    srs = [0, 1, 2]
+    pulled = []
+    def requests():
+        for k, stim in enumerate(stims):
+            pulled.append(k)
+            yield (cfs, srs, [10 * k, 10 * k + 1, 10 * k + 2], stim, {})
+    
+    # trials are returned in order, and no more than *depth* are prepared 
+    # ahead
+    with SpikeTrainPrefetcher(requests(), depth=2) as prefetcher:
+        # once two trials are ready, the thread waits for one to be taken
+        deadline = time.time() + 30
+        while prefetcher._queue.qsize() < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert prefetcher._queue.qsize() == 2
+        assert pulled == [0, 1]
+        results = list(prefetcher)
+    assert len(results) == len(stims)
+    cache.clear_memo()
+    for k, (request, trains) in enumerate(results):
+        assert request[3] is stims[k]
+        expected = cache.get_spiketrains(cfs, srs, request[2], stims[k])
+        for t1, t2 in zip(trains, expected):
+            assert np.all(t1 == t2)
+    
+    # errors in the background thread are raised by next()
+    prefetcher = SpikeTrainPrefetcher([(cfs, srs, [0], stims[0], {'simulator': 'x'})])
+    try:
+        next(prefetcher)
+        raise AssertionError("Expected ValueError")
+    except ValueError:
+        # the traceback reaches into the background thread
+        tb = traceback.extract_tb(sys.exc_info()[2])
+        assert any([frame[2] == '_run' for frame in tb])
+    prefetcher.close()
+    
+    # closing early stops the background thread
+    del pulled[:]
+    prefetcher = SpikeTrainPrefetcher(requests(), depth=1)
+    next(prefetcher)
+    prefetcher.close()
+    assert not prefetcher._thread.is_alive()
+    assert pulled in ([0], [0, 1])
+    
+    # peek() returns the next trial without taking it
+    reqs = [(cfs, srs, [0, 1, 2], stims[0], {}), (cfs, srs, [3, 4, 5], stims[1], {})]
+    with SpikeTrainPrefetcher(reqs, depth=1) as prefetcher:
+        request, trains = prefetcher.peek()
+        assert request is reqs[0]
+        assert prefetcher.peek()[1] is trains
+        assert next(prefetcher)[1] is trains
+        assert prefetcher.peek()[0] is reqs[1]
+        assert next(prefetcher)[0] is reqs[1]
+        for method in (prefetcher.peek, prefetcher.next):
+            try:
+                method()
+                raise AssertionError("Expected StopIteration")
+            except StopIteration:
+                pass
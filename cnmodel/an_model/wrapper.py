@@ -1,34 +1,222 @@
-import os
+import os, sys, threading
 import numpy as np
 from ..util import matlab_proc
 
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue  # python 3.x
+
 _proc = None
+_pool = None
+
+if sys.version_info[0] >= 3:
+    def _reraise(exc_type, exc, tb):
+        raise exc.with_traceback(tb)
+else:
+    # the three-argument raise is a syntax error in python 3
+    exec("def _reraise(exc_type, exc, tb):\n    raise exc_type, exc, tb\n")
+
 
 def get_matlab():
     """ Return a running MatlabProcess instance.
     """
     global _proc
     if _proc is None:
-        path = os.path.dirname(__file__)
-        model_path = os.path.join(path, 'model')
-        _proc = matlab_proc.MatlabProcess(cwd=model_path)
-        # Try building the model mex files 
-        if _proc.exist('model_IHC') == 0:
-            print "\nCompiling MEX for auditory periphery model..."
-            try:
-                _proc('mexANmodel;')
-            except Exception as err:
-                print err.output
-                print ""
-                raise RuntimeError(
-                    "An error occurred while compiling the auditory periphery model.\n" +
-                    "The complete output is printed above. " +
-                    "See cnmodel/an_model/model/readme.txt for more information.")
-            print "Done."
+        _proc = start_matlab()
     return _proc
 
 
-def model_ihc(pin, CF, nrep=1, tdres=1e-5, reptime=1, cohc=1, cihc=1, species=1, **kwds):
+def start_matlab(executable=None, build=True):
+    """ Start and return a new MatlabProcess running in the AN model directory.
+    
+    If *build* is True, the model MEX files are compiled if they are not 
+    already available. *executable* is passed to MatlabProcess.
+    """
+    path = os.path.dirname(__file__)
+    model_path = os.path.join(path, 'model')
+    proc = matlab_proc.MatlabProcess(executable=executable, cwd=model_path)
+    # Try building the model mex files 
+    if build and proc.exist('model_IHC') == 0:
+        print "\nCompiling MEX for auditory periphery model..."
+        try:
+            proc('mexANmodel;')
+        except Exception as err:
+            print err.output
+            print ""
+            raise RuntimeError(
+                "An error occurred while compiling the auditory periphery model.\n" +
+                "The complete output is printed above. " +
+                "See cnmodel/an_model/model/readme.txt for more information.")
+        print "Done."
+    return proc
+
+
+def get_matlab_pool():
+    """ Return the MatlabPool used to run the AN model, or None if no pool has
+    been started (see set_matlab_workers()).
+    """
+    return _pool
+
+
+def set_matlab_workers(workers, executable=None, seed=None):
+    """ Start a pool of *workers* MATLAB processes to run the AN model 
+    concurrently, replacing any existing pool. Use 0 to stop the pool, after
+    which all model calls are run by the single process from get_matlab().
+    
+    When a pool is running, cache.generate_spiketrains() distributes fibers
+    across its workers. See MatlabPool for a description of arguments.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+    if workers > 0:
+        _pool = MatlabPool(workers, executable=executable, seed=seed)
+    return _pool
+
+
+class MatlabRequest(object):
+    """ The pending result of a call submitted to a MatlabPool.
+    """
+    def __init__(self, fn, args, kwds):
+        self.fn = fn
+        self.args = args
+        self.kwds = kwds
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        """ Return True if the request has finished.
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the request to finish and return its result. If the call
+        raised an exception, it is re-raised here with its original traceback.
+        """
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise RuntimeError("Timed out waiting for MATLAB request.")
+        if self._exc_info is not None:
+            _reraise(*self._exc_info)
+        return self._result
+
+    def _run(self, proc):
+        try:
+            self._result = self.fn(proc, *self.args, **self.kwds)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+
+class MatlabPool(object):
+    """ Pool of MATLAB processes for running the AN model concurrently.
+    
+    Each worker is a MatlabProcess served by its own thread, which takes 
+    requests from a shared queue. Each worker is started (and the model MEX
+    files are compiled if necessary) only once, when the pool is created.
+    
+    Parameters
+    ----------
+    workers : int
+        Number of MATLAB processes to start.
+    executable : str or list
+        MATLAB executable (see MatlabProcess).
+    seed : int or None
+        If given, the random number generator of worker *i* is seeded with
+        ``seed + i`` on startup (see seed_rng()). Requests that need 
+        reproducible results should seed the generator themselves.
+    
+    Example::
+    
+        pool = MatlabPool(4)
+        req = pool.submit(lambda proc, x: proc('disp(%d)' % x), 3)
+        output = req.result()
+    """
+    def __init__(self, workers, executable=None, seed=None):
+        if workers < 1:
+            raise ValueError("A MatlabPool needs at least one worker.")
+        self._requests = Queue()
+        self._threads = []
+        self.procs = []
+        
+        # The first worker builds the MEX files if needed; the remaining 
+        # workers are then started concurrently.
+        self.procs.append(start_matlab(executable))
+        errors = []
+        def start():
+            try:
+                proc = start_matlab(executable, build=False)
+            except Exception as exc:
+                errors.append(exc)
+                return
+            self.procs.append(proc)
+        starters = [threading.Thread(target=start) for i in range(workers - 1)]
+        for thread in starters:
+            thread.start()
+        for thread in starters:
+            thread.join()
+        if len(errors) > 0:
+            for proc in self.procs:
+                proc.close()
+            raise errors[0]
+        
+        for i, proc in enumerate(self.procs):
+            if seed is not None:
+                seed_rng(seed + i, matlab=proc)
+            thread = threading.Thread(target=self._serve, args=(proc,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def workers(self):
+        """ The number of MATLAB processes in the pool.
+        """
+        return len(self.procs)
+
+    def submit(self, fn, *args, **kwds):
+        """ Queue ``fn(proc, *args, **kwds)`` to be called with the next 
+        available MatlabProcess, and return a MatlabRequest.
+        """
+        if self._requests is None:
+            raise RuntimeError("MatlabPool has been closed.")
+        req = MatlabRequest(fn, args, kwds)
+        self._requests.put(req)
+        return req
+
+    def map(self, fn, args):
+        """ Call ``fn(proc, *a)`` for each tuple *a* in *args* using all 
+        workers, and return the list of results in order.
+        """
+        reqs = [self.submit(fn, *a) for a in args]
+        return [req.result() for req in reqs]
+
+    def _serve(self, proc):
+        while True:
+            req = self._requests.get()
+            if req is None:
+                break
+            req._run(proc)
+
+    def close(self):
+        """ Stop all workers after pending requests have finished.
+        """
+        if self._requests is None:
+            return
+        for thread in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+        for proc in self.procs:
+            proc.close()
+        self._requests = None
+
+
+def model_ihc(pin, CF, nrep=1, tdres=1e-5, reptime=1, cohc=1, cihc=1, species=1, 
+              matlab=None, **kwds):
     """
     Return the output of model_IHC() from the AN model
     (Zilany, Bruce, Ibrahim and Carney, 2014; requires MATLAB)
@@ -59,6 +247,8 @@ def model_ihc(pin, CF, nrep=1, tdres=1e-5, reptime=1, cohc=1, cihc=1, species=1,
         The model species: "1" for cat, "2" for human with BM tuning from 
         Shera et al. (PNAS 2002), or "3" for human BM tuning from 
         Glasberg & Moore (Hear. Res. 1990)
+    matlab : MatlabProcess or None
+        The MATLAB process to run the model in (default is get_matlab()).
     """
     # make sure pin is a row vector
     pin = pin.reshape(1, pin.size)
@@ -72,13 +262,14 @@ def model_ihc(pin, CF, nrep=1, tdres=1e-5, reptime=1, cohc=1, cihc=1, species=1,
         
     assert reptime >= pin.size * tdres
     
-    ml = get_matlab()
+    ml = get_matlab() if matlab is None else matlab
     fn = ml.model_IHC
     fn.nargout = 1  # necessary because nargout(model_IHC) fails
     return fn(*args, **kwds)
 
 
-def model_synapse(vihc, CF, nrep=1, tdres=1e-5, fiberType=0, noiseType=1, implnt=1, **kwds):
+def model_synapse(vihc, CF, nrep=1, tdres=1e-5, fiberType=0, noiseType=1, implnt=1, 
+                  matlab=None, **kwds):
     """
     Return the output of model_Synapse() from the AN model
     (Zilany, Bruce, Ibrahim and Carney, 2014; requires MATLAB)
@@ -109,6 +300,8 @@ def model_synapse(vihc, CF, nrep=1, tdres=1e-5, fiberType=0, noiseType=1, implnt
     implnt : 0 or 1
         "Approxiate" or "actual" implementation of the power-law functions: 
         "0" for approx. and "1" for actual implementation
+    matlab : MatlabProcess or None
+        The MATLAB process to run the model in (default is get_matlab()).
     """
     # make sure vihc is a row vector (unless it is a reference to a matlab variable)
     if isinstance(vihc, np.ndarray):
@@ -121,17 +314,49 @@ def model_synapse(vihc, CF, nrep=1, tdres=1e-5, fiberType=0, noiseType=1, implnt
             arg = float(arg)
         args.append(arg)
     
-    ml = get_matlab()
+    ml = get_matlab() if matlab is None else matlab
     fn = ml.model_Synapse
     fn.nargout = 3  # necessary because nargout(model_IHC) fails
     return fn(*args, **kwds)
     
 
-def seed_rng(seed):
+def model_synapse_trials(vihc, CF, nrep=1, tdres=1e-5, fiberType=0, noiseType=1, 
+                         implnt=1, ntrials=1, matlab=None, **kwds):
+    """
+    Run model_Synapse() *ntrials* times on the same IHC potential in a single
+    MATLAB call (see model_Synapse_trials.m in the model directory).
+    
+    The return values are:
+    
+    * spikes: the PSTH bin of every spike, concatenated over all trials
+    * counts: the number of spikes in each trial
+    
+    The random number generator is seeded only once (see seed_rng()), so the
+    first trial is identical to the output of model_synapse() after the same
+    seed. All other arguments are as for model_synapse().
+    """
+    if isinstance(vihc, np.ndarray):
+        vihc = vihc.reshape(1, vihc.size)
+
+    args = [vihc]
+    for arg in (CF, nrep, tdres, fiberType, noiseType, implnt, ntrials):
+        if not isinstance(arg, matlab_proc.MatlabReference):
+            arg = float(arg)
+        args.append(arg)
+    
+    ml = get_matlab() if matlab is None else matlab
+    fn = ml.model_Synapse_trials
+    fn.nargout = 2
+    return fn(*args, **kwds)
+
+
+def seed_rng(seed, matlab=None):
     """
     Seed the random number generator used by model_ihc and model_synapse. 
+    
+    *matlab* is the MATLAB process to seed (default is get_matlab()).
     """
     seed = int(seed)
     cmd = "RandStream.setGlobalStream(RandStream('mcg16807','seed',%d));" % seed
-    ml = get_matlab()
+    ml = get_matlab() if matlab is None else matlab
     ml(cmd)
@@ -76,7 +76,7 @@ class DummySGC(SGC):
     """ SGC class with no cell body; this cell only replays a predetermined
     spike train.
     """
-    def __init__(self, cf=None, sr=None, simulator=None):
+    def __init__(self, cf=None, sr=None, simulator=None, spike_gid=None):
         """
         Parameters
         ----------
@@ -87,29 +87,56 @@ class DummySGC(SGC):
             required : Selects the spontaneous rate group from the
             Zilany et al (2010) model. 1 = LSR, 2 = MSR, 3 = HSR
         
-        simulator : 'cochlea' | 'matlab' | None (default None)
+        simulator : 'cochlea' | 'matlab' | 'fast' | None (default None)
             Sets the simulator interface that will be used. All models
             currently use the Zilany et al. model, but the simulator can
             be run though a Python-interface directly to the Matlab code
             as publicy available, (simulator='matlab'), or can be run through
             Rudnicki & Hemmert's Python interface to the simulator's C code 
-            (simulator='cochlea').
+            (simulator='cochlea'). simulator='fast' uses a much faster 
+            approximation of the model (see an_model/fast.py).
+        
+        spike_gid : int or None (default None)
+            If given, the cell has no VecStim of its own. Its terminals 
+            instead receive the events sent for this global id by a 
+            PatternStim shared by the whole population (see the *replay* 
+            argument of populations.SGC).
         
         """
         self._simulator = simulator
         SGC.__init__(self, cf, sr)
-        self.vecstim = h.VecStim()
-        
-        # this causes the terminal to receive events from the VecStim:
-        self.spike_source = self.vecstim
+        self.spike_gid = spike_gid
+        if spike_gid is None:
+            self.vecstim = h.VecStim()
+            
+            # this causes the terminal to receive events from the VecStim:
+            self.spike_source = self.vecstim
         
         # just an empty section for holding the terminal
         self.add_section(h.Section(), 'soma')
 
+    def connect(self, post_cell, pre_opts=None, post_opts=None, **kwds):
+        synapse = SGC.connect(self, post_cell, pre_opts=pre_opts, post_opts=post_opts, **kwds)
+        if self.spike_gid is not None:
+            # drive the terminal from events sent for spike_gid
+            terminal = synapse.terminal
+            old = terminal.netcon
+            nc = h.ParallelContext().gid_connect(self.spike_gid, old.syn())
+            nc.weight[0] = old.weight[0]
+            nc.delay = old.delay
+            terminal.netcon = nc
+        return synapse
+
     def set_spiketrain(self, times):
-        """ Set the times of spikes (in seconds) to be replayed by the cell.
+        """ Set the times of spikes (in ms) to be replayed by the cell.
+        
+        If the cell has a *spike_gid*, the times are only stored; the train 
+        is replayed by the population's PatternStim (see 
+        populations.SGC.set_spike_pattern()).
         """
         self._spiketrain = times
+        if self.spike_gid is not None:
+            return
         self._stvec = h.Vector(times)
         self.vecstim.play(self._stvec)
 
@@ -36,6 +36,7 @@ ENDCOMMENT
 INDEPENDENT {t FROM 0 TO 1 WITH 1 (ms)}
 
 NEURON {
+	THREADSAFE
 	POINT_PROCESS GLYaPL
 	POINTER XMTR
 	RANGE C0, C1, C2, C3, O1, O2, Open
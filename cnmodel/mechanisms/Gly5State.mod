@@ -47,6 +47,7 @@ ENDCOMMENT
 INDEPENDENT {t FROM 0 TO 1 WITH 1 (ms)}
 
 NEURON {
+	THREADSAFE
 	POINT_PROCESS GLYa5
 	POINTER XMTR
 	RANGE C0, C1, C2, O1, O2, Open
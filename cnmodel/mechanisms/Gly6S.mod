@@ -35,6 +35,7 @@ ENDCOMMENT
 INDEPENDENT {t FROM 0 TO 1 WITH 1 (ms)}
 
 NEURON {
+    THREADSAFE
     POINT_PROCESS Gly6S
     POINTER XMTR
     RANGE C0, C1, C2, D1, O1, O2, Open
@@ -24,6 +24,7 @@ INDEPENDENT {t FROM 0 TO 1 WITH 1 (ms)}
 DEFINE NSTEP 5     : maximum number of steps supported in this mechanism 
 
 NEURON {
+    THREADSAFE
     POINT_PROCESS IClamp2
     RANGE  onset, dur, amp, i
     ELECTRODE_CURRENT i
@@ -2,6 +2,7 @@
 : Created 8/15/02 - nwg
 
 NEURON {
+       THREADSAFE
        SUFFIX cadiff
        USEION ca READ ica, cai WRITE cai
        RANGE ca
@@ -44,6 +44,7 @@ TITLE decay of submembrane calcium concentration
 INDEPENDENT {t FROM 0 TO 1 WITH 1 (ms)}
 
 NEURON {
+	THREADSAFE
 	SUFFIX cadyn
 	USEION ca READ ica, cai WRITE cai
 	RANGE depth,kt,kd,cainf,taur
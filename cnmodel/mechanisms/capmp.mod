@@ -1,4 +1,5 @@
 NEURON {
+	THREADSAFE
 	SUFFIX capmp
 	USEION ca READ cao, ica, cai WRITE cai, ica
 	RANGE tau, width, cabulk, ica, pump0
@@ -1,4 +1,5 @@
 NEURON {
+	        THREADSAFE
 	        SUFFIX capump
 	        USEION ca READ cai WRITE ica
 	        RANGE vmax, kmp, ica
@@ -21,12 +22,9 @@ NEURON {
 	        cai (mM)
 	}
 	
-	LOCAL Q, s_celsius
-	
-	BREAKPOINT {
- 	        if (s_celsius*1(degC) != celsius) {
-	                s_celsius = celsius
-	                Q = 3^((celsius - 6.3)/10 (degC))
-	        }               
+	BREAKPOINT { LOCAL Q
+	        : computed on every step, since a cached top-level LOCAL would be
+	        : shared between threads
+	        Q = 3^((celsius - 6.3)/10 (degC))
 	        ica = vmax*Q*cai/(cai + (.001)*kmp) / 5.18
 }
\ No newline at end of file
@@ -33,6 +33,7 @@ INDEPENDENT {t FROM 0 TO 1 WITH 1 (ms)}
 DEFINE NSTEP 5
 
 NEURON {
+    THREADSAFE
     POINT_PROCESS cleftXmtr
     POINTER pre
     RANGE  KV, KU, XMax
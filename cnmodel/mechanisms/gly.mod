@@ -18,6 +18,7 @@ ENDCOMMENT
 INDEPENDENT {t FROM 0 TO 1 WITH 1 (ms)}
 
 NEURON {
+	THREADSAFE
 	POINT_PROCESS GlySynapse
 	USEION cl READ ecl VALENCE 1
 	: negative valence not accepted by nrnivmodl
@@ -17,6 +17,7 @@ UNITS {
 }
     
     NEURON {
+    THREADSAFE
     SUFFIX kif
     USEION k READ ek WRITE ik
      
@@ -10,6 +10,7 @@ Found on ModelDB, 1/21/2013 PBManis
 ENDCOMMENT
 
 NEURON {
+	THREADSAFE
 	SUFFIX KIR
 	USEION  k READ ek WRITE ik
 	RANGE g, ik, gbar
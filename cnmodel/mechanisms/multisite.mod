@@ -74,7 +74,8 @@ NEURON {
                                             :            sigma = latstd + LN_A0*(1-exp(-(t-LN_t0)/LN_tau))
 
     : externally assigned pointers to RNG functions
-    POINTER uniform_rng  : for deciding the number of active synapses when multisite==0
+    POINTER uniform_rng  : for deciding the number of active synapses when multisite==0,
+                         : and for all release draws when multisite==1 if set
 }
 
 UNITS {
@@ -167,12 +168,45 @@ VERBATIM
 ENDVERBATIM
 }
 
-: Function to allow RNG to be externally set
+: Return a pick from a uniform distribution on [0, 1) for release_multisite().
+: If an RNG has been set with setUniformRNG(), each instance draws from its own
+: stream, which is required for reproducible results when the model is split
+: across threads. Otherwise, all instances share the SCoP generator.
+FUNCTION rand_release() {
+VERBATIM
+    if (_p_uniform_rng) {
+        _lrand_release = nrn_random_pick(_p_uniform_rng);
+    } else {
+        _lrand_release = scop_random();
+    }
+ENDVERBATIM
+}
+
+: Return a pick from a normal distribution with mean mu and standard deviation
+: sd, drawn from the same generator as rand_release() (Box-Muller transform).
+FUNCTION rand_normal(mu, sd) {
+VERBATIM
+    if (_p_uniform_rng) {
+        double u1, u2;
+        u1 = 1.0 - nrn_random_pick(_p_uniform_rng);  /* (0, 1] */
+        u2 = nrn_random_pick(_p_uniform_rng);
+        _lrand_normal = _lmu + _lsd * sqrt(-2.0 * log(u1)) * cos(2.0 * 3.14159265358979323846 * u2);
+    } else {
+        _lrand_normal = normrand(_lmu, _lsd);
+    }
+ENDVERBATIM
+}
+
+: Function to allow RNG to be externally set (or cleared, if no RNG is given)
 PROCEDURE setUniformRNG() {
 VERBATIM
  {
     void** pv = (void**)(&_p_uniform_rng);
-    *pv = nrn_random_arg(1);
+    if (ifarg(1)) {
+        *pv = nrn_random_arg(1);
+    } else {
+        *pv = (void*)0;
+    }
  }
 ENDVERBATIM
 }
@@ -312,7 +346,7 @@ PROCEDURE release_multisite() {
     
     FROM i = 0 TO (nZones-1) { : for each zone in the synapse
         if(tRelease[i] < t) {
-            scrand = scop_random()
+            scrand = rand_release()
             : look to make release if we have not already (single vesicle per zone per spike)
             : check for release and release probability - assume infinite supply of vesicles
             if (scrand  < Fn*Dn) { 
@@ -333,9 +367,10 @@ PROCEDURE release_multisite() {
 :               The median of the lognormal dist. is e^mu; Note that if mu is 0, then the median is 1.0
 :               The mode of the lognormal dist is e^(u-sigma^2). 
 :               Note that normrand is a SCoP function, see http://cns.iaf.cnrs-gif.fr/files/scopman.html
+:               (rand_normal uses it unless an RNG has been set with setUniformRNG).
                 if (LN_Flag == 0 || t < LN_t0) { : use fixed sigma in lognormal distribution for all time.
                     if (latstd > 0.0) {
-                        latzone = normrand(0.0, latstd) : set a latency for the zone with one draw from the distribution
+                        latzone = rand_normal(0.0, latstd) : set a latency for the zone with one draw from the distribution
                         latzone = exp(latzone) - 1.0 + vesicleLatency : the latency should not be too short.... 
                     }
                     else {
@@ -344,7 +379,7 @@ PROCEDURE release_multisite() {
                 }
                 else {
                     sigma = latstd + LN_A0*(1-exp(-(t-LN_t0)/LN_tau)) : time-dependent std shift
-                    latzone = normrand(0.0, sigma)
+                    latzone = rand_normal(0.0, sigma)
                     latzone = exp(latzone)-1.0 + vesicleLatency
                 }
                 if (latzone < 0.0) { : this is to be safe... must have causality.
@@ -2,6 +2,7 @@ TITLE Purkinje Leak Current
 
 : A passive purkinje cell leak current
 NEURON {
+	THREADSAFE
 	SUFFIX lkpkj
 	NONSPECIFIC_CURRENT i
 	RANGE i, e, gbar
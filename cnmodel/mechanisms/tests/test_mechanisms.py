@@ -1,6 +1,6 @@
 import numpy as np
 from neuron import h
-from cnmodel.util import reset
+from cnmodel.util import reset, set_threads
 
 
 def test_max_open_probability():
@@ -33,6 +33,77 @@ def test_max_open_probability():
     assert np.allclose(max(op[0]), apsd.MaxOpen)
     assert np.allclose(max(op[1]), npsd.MaxOpen)
     
+
+
+def test_release_streams():
+    # With set_threads(), each MultiSiteSynapse draws from its own stream,
+    # restarted by finitialize(), so repeated runs release identically
+    # regardless of the number of threads.
+    reset(raiseError=False)
+    secs = [h.Section(), h.Section()]
+    terms = []
+    netcons = []
+    stim = h.NetStim()
+    stim.number = 10
+    stim.interval = 10.0
+    stim.start = 1.0
+    for i, sec in enumerate(secs):
+        term = h.MultiSiteSynapse(0.5, sec=sec)
+        term.nZones = 20
+        term.multisite = 1
+        term.rseed = 1234
+        term.latstd = 0.5
+        terms.append(term)
+        netcons.append(h.NetCon(stim, term, 0, 1.0, 1))
+    
+    def run():
+        h.finitialize()
+        while h.t < 110.0:
+            h.fadvance()
+        return [(term.nReleases, np.array(term.EventLatencies)[:int(term.ev_index)])
+                for term in terms]
     
+    previous = set_threads(1, release_streams=True)
+    try:
+        first = run()
+        set_threads(2)
+        second = run()
+    finally:
+        set_threads(previous, release_streams=False)
+    assert first[0][0] > 0
+    for (n1, lat1), (n2, lat2) in zip(first, second):
+        assert n1 == n2
+        assert np.all(lat1 == lat2)
+    # instances have independent streams
+    assert not np.all(first[0][1][:5] == first[1][1][:5])
+
+
+def test_thread_min_delay():
+    # NetCon delays shorter than two time steps are raised while threads
+    # are in use, and restored afterward.
+    reset(raiseError=False)
+    sec = h.Section()
+    stim = h.NetStim()
+    syn = h.ExpSyn(0.5, sec=sec)
+    nc = h.NetCon(stim, syn, 0, 0, 0.01)
+    previous = set_threads(2)
+    try:
+        h.finitialize()
+        h.fadvance()
+        assert nc.delay == 2 * h.dt
+        set_threads(1)
+        h.finitialize()
+        assert nc.delay == 0
+        # the model can still be cleared after a threaded run
+        set_threads(2)
+        h.finitialize()
+        del nc, syn, stim, sec
+        reset()
+    finally:
+        set_threads(previous)
+
+
 if __name__ == '__main__':
     test_max_open_probability()
+    test_release_streams()
+    test_thread_min_delay()
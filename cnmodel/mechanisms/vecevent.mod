@@ -2,6 +2,7 @@
 :  From NEURON source: nrn/examples/nrniv/netcon/vecevent.mod
     
 NEURON {
+	THREADSAFE
 	ARTIFICIAL_CELL VecStim
 }
 
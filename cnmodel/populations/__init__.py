@@ -11,4 +11,5 @@ from .dstellate import DStellate
 from .pyramidal import Pyramidal
 from .tuberculoventral import Tuberculoventral
 from .sgc import SGC
-
+from .circuit import save_circuit, load_circuit
+from .distributed import DistributedNetwork
@@ -14,6 +14,7 @@ class Bushy(Population):
     it is NOT the measured CF of the cell (although it should be close).
     """
     type = 'bushy'
+    cell_class = cells.Bushy
     
     def __init__(self, species='mouse', **kwds):
         freqs = self._get_cf_array(species)
@@ -50,3 +51,18 @@ class Bushy(Population):
             dist['sr'] = (sr_vals == cell_rec['sgc_sr']).astype(float)
 
         return size, dist
+
+    def connection_stats_many(self, pop, cell_recs):
+        """ Bulk version of connection_stats(); see 
+        Population.connection_stats_many().
+        """
+        sizes, weights = Population.connection_stats_many(self, pop, cell_recs)
+        
+        from .. import populations
+
+        if isinstance(pop, populations.SGC):
+            # only select SGC inputs from a single SR group
+            sr_vals = pop.cells['sr']
+            weights *= sr_vals[np.newaxis, :] == cell_recs['sgc_sr'][:, np.newaxis]
+
+        return sizes, weights
@@ -0,0 +1,171 @@
+"""
+Saving and loading circuits built from populations.
+
+Building a circuit selects the presynaptic partners of every real cell and
+draws random parameters for every synapse. A circuit saved after its inputs
+have been resolved can be rebuilt with exactly the same cells, synapses and
+synapse conductances, without repeating the selection::
+
+    pops = {'sgc': sgc, 'bushy': bushy, 'dstellate': dstellate}
+    save_circuit('circuit.npz', pops)
+    ...
+    pops = load_circuit('circuit.npz')
+
+The file is a numpy .npz archive; it contains no pickled objects.
+"""
+import json, importlib
+from collections import OrderedDict
+import numpy as np
+
+from ..util import random
+
+
+_circuit_version = 1
+
+
+def save_circuit(filename, populations):
+    """ Save a circuit to *filename*.
+
+    *populations* is a dict of {name: Population} containing every population
+    in the circuit. For each population this records its class, constructor
+    arguments, cell table and real cells; for each connection between
+    populations, all synapses in its ConnectionTable and the conductance of
+    each postsynaptic receptor mechanism (which include the variability drawn
+    when the synapse was made). The global random seed, and the next spike
+    train seed of SGC populations, are saved as well.
+    """
+    names = list(populations.keys())
+    pops = [populations[name] for name in names]
+    index = dict([(id(pop), i) for i, pop in enumerate(pops)])
+    meta = {'version': _circuit_version, 'seed': random.current_seed(),
+            'populations': [], 'connections': []}
+    arrays = {}
+    for i, (name, pop) in enumerate(zip(names, pops)):
+        meta['populations'].append({
+            'name': name,
+            'module': type(pop).__module__,
+            'class': type(pop).__name__,
+            'species': pop.species,
+            'synapsetype': pop._synapsetype,
+            'cell_args': pop._cell_args,
+            'next_seed': getattr(pop, 'next_seed', None),
+        })
+        arrays['cells_%d' % i] = _cell_table(pop)
+
+        for pre in pop.pre_connections:
+            if id(pre) not in index:
+                raise ValueError("Population %s connects to %s but is not in the "
+                                 "circuit." % (pre, pop))
+            k = len(meta['connections'])
+            meta['connections'].append([index[id(pre)], i])
+            synapses = pop.connection_table(pre).synapses
+            gmax = []
+            for post_ind, input_ind in zip(synapses['post'], synapses['input_index']):
+                gmax.append(_psd_gmax(pop._cells[post_ind]['cell'], input_ind))
+            arrays['synapses_%d' % k] = synapses
+            arrays['psd_count_%d' % k] = np.array([len(g) for g in gmax], dtype=int)
+            arrays['psd_gmax_%d' % k] = np.array([x for g in gmax for x in g], dtype=float)
+
+    arrays['meta'] = np.array(json.dumps(meta))
+    np.savez(filename, **arrays)
+
+
+def load_circuit(filename):
+    """ Rebuild a circuit saved by save_circuit() and return an OrderedDict
+    of {name: Population}.
+
+    The global random seed is restored first, then the populations are
+    created and connected, their real cells instantiated, and every synapse
+    recreated between the same cells (in the order it was originally made)
+    with the saved receptor conductances.
+    """
+    data = np.load(filename, allow_pickle=False)
+    meta = json.loads(str(data['meta']))
+    if meta['version'] != _circuit_version:
+        raise ValueError("Circuit file %s has unsupported version %s." %
+                         (filename, meta['version']))
+    random.set_seed(meta['seed'])
+
+    pops = []
+    for i, info in enumerate(meta['populations']):
+        cls = getattr(importlib.import_module(info['module']), info['class'])
+        kwds = dict([(str(k), v) for k, v in info['cell_args'].items()])
+        pop = cls(species=info['species'], synapsetype=info['synapsetype'], **kwds)
+        cells = data['cells_%d' % i]
+        if len(cells) != len(pop._cells):
+            raise ValueError("Population %s has %d cells; the saved circuit has %d." %
+                             (info['name'], len(pop._cells), len(cells)))
+        for field in cells.dtype.names:
+            if field not in ('real', 'input_resolved'):
+                pop._cells[field] = cells[field]
+        if info['next_seed'] is not None:
+            pop.next_seed = info['next_seed']
+        pops.append(pop)
+
+    for pre, post in meta['connections']:
+        pops[pre].connect(pops[post])
+
+    for i, pop in enumerate(pops):
+        pop.create_cells(np.argwhere(data['cells_%d' % i]['real'])[:,0])
+
+    # Recreate synapses onto each postsynaptic cell in their original order
+    for i, pop in enumerate(pops):
+        conns = [(k, pre) for k, (pre, post) in enumerate(meta['connections']) if post == i]
+        order = []
+        tables = {}
+        for k, pre in conns:
+            syns = data['synapses_%d' % k].copy()
+            starts = np.concatenate([[0], np.cumsum(data['psd_count_%d' % k])])
+            tables[k] = (syns, starts, data['psd_gmax_%d' % k])
+            for j, syn in enumerate(syns):
+                # synapses with unknown input_index are made after the others
+                input_ind = syn['input_index'] if syn['input_index'] >= 0 else np.inf
+                order.append((syn['post'], input_ind, k, j))
+        order.sort()
+        for post_ind, input_ind, k, j in order:
+            syns, starts, gmax = tables[k]
+            gmax = gmax[starts[j]:starts[j+1]]
+            pre_pop = pops[meta['connections'][k][0]]
+            post_cell = pop._cells[post_ind]['cell']
+            synapse = pre_pop.get_cell(syns[j]['pre']).connect(post_cell, type=pop._synapsetype)
+            mechs = getattr(synapse.psd, 'all_psd', [])
+            if len(mechs) != len(gmax):
+                raise ValueError("Synapse from %s %d onto %s %d has %d receptor mechanisms; "
+                                 "the saved circuit has %d." % (pre_pop, syns[j]['pre'], pop, 
+                                                                post_ind, len(mechs), len(gmax)))
+            for mech, g in zip(mechs, gmax):
+                mech.gmax = g
+            if syns[j]['input_index'] >= 0:
+                syns[j]['input_index'] = len(post_cell.inputs) - 1
+        for k, pre in conns:
+            syns = tables[k][0]
+            params = dict([(name, syns[name]) for name in syns.dtype.names
+                           if name not in ('pre', 'post')])
+            pop.connection_table(pops[pre]).add(syns['post'], syns['pre'], **params)
+        pop._cells['input_resolved'] = data['cells_%d' % i]['input_resolved']
+
+    names = [info['name'] for info in meta['populations']]
+    return OrderedDict(zip(names, pops))
+
+
+def _cell_table(pop):
+    """ Return the cell table of *pop* without the cell objects, with a 'real'
+    field marking the real cells.
+    """
+    cells = pop._cells
+    fields = [(name, cells.dtype[name]) for name in cells.dtype.names if name != 'cell']
+    table = np.zeros(len(cells), dtype=fields + [('real', bool)])
+    for name, dtype in fields:
+        table[name] = cells[name]
+    table['real'] = cells['cell'] != 0
+    return table
+
+
+def _psd_gmax(post_cell, input_index):
+    """ Return the gmax of each receptor mechanism of the synapse at
+    *input_index* in the inputs of *post_cell*.
+    """
+    if input_index < 0:
+        return []
+    synapse = post_cell.inputs[input_index][0]
+    return [mech.gmax for mech in getattr(synapse.psd, 'all_psd', [])]
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class ConnectionTable(object):
+    """ The synapses from the cells of a presynaptic population onto the cells
+    of a postsynaptic population.
+
+    Synapses are stored in compressed sparse row form, with one row per
+    postsynaptic cell: the synapses onto postsynaptic cell i are
+    ``synapses[indptr[i]:indptr[i+1]]``, in the order they were added. A
+    second index sorted by presynaptic cell makes column queries (all
+    synapses made by one presynaptic cell) equally fast.
+
+    Each synapse is a record with 'pre' and 'post' fields giving the indexes
+    of the connected cells, plus one field for each per-synapse parameter
+    given in *fields*, a list of (name, dtype) pairs.
+
+    Tables are created by `Population.connect()`; see
+    `Population.connection_table()`.
+    """
+    def __init__(self, pre, post, fields=()):
+        self.pre = pre
+        self.post = post
+        self._dtype = np.dtype([('pre', int), ('post', int)] + list(fields))
+        self._synapses = np.zeros(0, dtype=self._dtype)
+        self._pending = []  # record arrays added since the last _build()
+        self._indptr = None
+        self._col_order = None
+        self._col_indptr = None
+
+    def add(self, post_index, pre_indexes, **params):
+        """ Add synapses from each cell in *pre_indexes* onto the postsynaptic
+        cell at *post_index*.
+
+        Each keyword argument gives the value of a per-synapse field, either
+        a single value or one value for each synapse. *post_index* may also 
+        be an array giving the postsynaptic index of each synapse.
+        """
+        recs = np.zeros(len(pre_indexes), dtype=self._dtype)
+        recs['pre'] = pre_indexes
+        recs['post'] = post_index
+        for name, value in params.items():
+            recs[name] = value
+        self._pending.append(recs)
+        self._indptr = None
+
+    def _build(self):
+        """ Sort any new synapses into the table and rebuild the row and
+        column indexes.
+        """
+        if self._indptr is not None:
+            return
+        if len(self._pending) > 0:
+            synapses = np.concatenate([self._synapses] + self._pending)
+            self._pending = []
+            # stable sort keeps the synapses of each row in the order added
+            order = np.argsort(synapses['post'], kind='mergesort')
+            self._synapses = synapses[order]
+        npost = len(self.post._cells)
+        npre = len(self.pre._cells)
+        counts = np.bincount(self._synapses['post'], minlength=npost)
+        self._indptr = np.concatenate([[0], np.cumsum(counts)])
+        self._col_order = np.argsort(self._synapses['pre'], kind='mergesort')
+        counts = np.bincount(self._synapses['pre'], minlength=npre)
+        self._col_indptr = np.concatenate([[0], np.cumsum(counts)])
+
+    @property
+    def synapses(self):
+        """ Record array of all synapses, sorted by postsynaptic cell.
+        """
+        self._build()
+        return self._synapses
+
+    @property
+    def indptr(self):
+        """ Array giving the start of the synapses onto each postsynaptic cell
+        in `synapses`, plus the total number of synapses.
+        """
+        self._build()
+        return self._indptr
+
+    def __len__(self):
+        return len(self.synapses)
+
+    def row(self, post_index):
+        """ Return the records of all synapses onto the postsynaptic cell at
+        *post_index*.
+        """
+        self._build()
+        return self._synapses[self._indptr[post_index]:self._indptr[post_index+1]]
+
+    def column(self, pre_index):
+        """ Return the records of all synapses made by the presynaptic cell at
+        *pre_index*.
+        """
+        self._build()
+        inds = self._col_order[self._col_indptr[pre_index]:self._col_indptr[pre_index+1]]
+        return self._synapses[inds]
+
+    def pre_indexes(self, post_index):
+        """ Return the presynaptic indexes of all synapses onto the
+        postsynaptic cell at *post_index*.
+        """
+        return self.row(post_index)['pre']
+
+    def post_indexes(self, pre_index):
+        """ Return the postsynaptic indexes of all synapses made by the
+        presynaptic cell at *pre_index*.
+        """
+        return self.column(pre_index)['post']
+
+    def __str__(self):
+        return "<ConnectionTable %s -> %s (%d synapses)>" % (type(self.pre).__name__,
+                                                            type(self.post).__name__, len(self))
@@ -0,0 +1,275 @@
+"""
+Distributed simulation of population circuits with NEURON's ParallelContext.
+
+Every process (rank) runs the same script, so that all ranks build identical
+populations and select identical connections. A DistributedNetwork created
+before any cells are instantiated assigns a global id (gid) to each real
+cell as it is created, and decides which rank simulates it. Cells owned by
+other ranks are represented by RemoteCell placeholders::
+
+    sgc, bushy, dstellate = populations.SGC(), populations.Bushy(), populations.DStellate()
+    net = populations.DistributedNetwork([sgc, bushy, dstellate], mpi=True)
+    sgc.connect(bushy, dstellate)
+    dstellate.connect(bushy)
+    bushy.select(20, cf=16e3, create=True)
+    bushy.resolve_inputs(depth=2)
+    ...
+    net.record_spikes()
+    net.run(tstop, init=custom_init)
+    times, gids = net.gather_spikes()   # on rank 0
+
+Synapses are always made on the rank of the postsynaptic cell. If the
+presynaptic cell is simulated on another rank, its terminals are placed on
+a ProxyCell (an empty section, like the one used by DummySGC) and driven by
+spike exchange NetCons. Spikes sent between ranks are detected with the
+presynaptic cell's `spike_threshold`, and arrive after at least
+*exchange_delay* ms.
+
+Populations whose cells only replay spike trains (SGC with the 'dummy'
+model) are replicated on every rank instead of being distributed; each rank
+generates the same trains for them.
+
+Run with a local MPI launcher, for example::
+
+    mpiexec -n 4 python script.py
+
+(NEURON must be built with MPI support.) MPI is only initialized when the
+network is created with mpi=True; without it, or if NEURON was started
+without MPI, the network has a single rank.
+"""
+import numpy as np
+from neuron import h
+
+from ..cells import Cell
+from ..util import random
+
+
+class DistributedNetwork(object):
+    """ Distribute the cells of a set of populations across MPI ranks.
+
+    Parameters
+    ----------
+    populations : list
+        All populations in the circuit. The network must be created before
+        any of their cells are instantiated.
+    split : 'round_robin' | 'cf'
+        How cells are assigned to ranks: in turn as they are created, or by
+        dividing the CF range of each population into one band per rank.
+    exchange_delay : float
+        Minimum delay (ms) of connections between cells on different ranks.
+        Connections with a shorter delay are lengthened to this value.
+    mpi : bool
+        If True, initialize MPI (h.nrnmpi_init()) so that the ranks started
+        by mpiexec form one parallel context. This must only be used when the
+        script runs under an MPI launcher; otherwise the network has a single
+        rank (or uses the MPI context NEURON was started with, as in 
+        ``nrniv -mpi``).
+    """
+    def __init__(self, populations, split='round_robin', exchange_delay=0.1,
+                 mpi=False):
+        if split not in ('round_robin', 'cf'):
+            raise ValueError("split must be 'round_robin' or 'cf'.")
+        if exchange_delay <= 0:
+            raise ValueError("exchange_delay must be greater than zero.")
+        if mpi:
+            if not hasattr(h, 'nrnmpi_init'):
+                raise RuntimeError("This NEURON version cannot initialize MPI "
+                                   "from Python; start it with nrniv -mpi.")
+            h.nrnmpi_init()
+        self.pc = h.ParallelContext()
+        self.rank = int(self.pc.id())
+        self.nhost = int(self.pc.nhost())
+        self.split = split
+        self.exchange_delay = exchange_delay
+        self.populations = list(populations)
+        self._next_gid = 0
+        self._source_netcons = []  # spike sources of cells on this rank
+        self._proxies = {}  # gid: ProxyCell
+        self._proxy_classes = {}  # cell class: ProxyCell subclass
+        self._spike_vectors = None
+        self.stats = {'local_synapses': 0, 'remote_synapses': 0}
+        for pop in self.populations:
+            if pop._network is not None:
+                raise ValueError("Population %s already belongs to a network." % pop)
+            if len(pop.real_cells()) > 0:
+                raise ValueError("Population %s already has real cells." % pop)
+            pop._network = self
+
+    def owner(self, pop, index, gid):
+        """ Return the rank that simulates the cell in *pop* at *index*, which
+        has global id *gid*.
+        """
+        if self.split == 'round_robin' or 'cf' not in pop._cells.dtype.names:
+            return gid % self.nhost
+        cfs = np.log(pop._cells['cf'])
+        span = cfs.max() - cfs.min()
+        if span == 0:
+            return gid % self.nhost
+        frac = (cfs[index] - cfs.min()) / span
+        return min(self.nhost - 1, int(frac * self.nhost))
+
+    def is_local(self, cell):
+        """ Return True if *cell* is simulated on this rank.
+        """
+        return not isinstance(cell, RemoteCell)
+
+    def create_cell(self, pop, index):
+        """ Called by Population.create_cells() to instantiate the cell in
+        *pop* at *index*. Return the new cell, or a RemoteCell if the cell is
+        simulated on another rank.
+        """
+        cell_rec = pop._cells[index]
+        if pop.replicated:
+            return pop.create_cell(cell_rec)
+        gid = self._next_gid
+        self._next_gid += 1
+        pop._cells[index]['gid'] = gid
+        rank = self.owner(pop, index, gid)
+        if rank != self.rank:
+            return RemoteCell(pop.type, gid, rank)
+        cell = pop.create_cell(cell_rec)
+        self.pc.set_gid2node(gid, self.rank)
+        nc = h.NetCon(cell.soma(0.5)._ref_v, None, sec=cell.soma)
+        nc.threshold = cell.spike_threshold
+        self.pc.cell(gid, nc)
+        self._source_netcons.append(nc)
+        return cell
+
+    def connect(self, pre_pop, pre_index, post_pop, post_index):
+        """ Called by Population to make a synapse from the cell in *pre_pop*
+        at *pre_index* onto the cell in *post_pop* at *post_index*. Return
+        the synapse, or None if the postsynaptic cell is on another rank.
+
+        Synapse parameters are drawn from a random state derived from the
+        global seed and the postsynaptic cell, leaving the global random state
+        unchanged, so that all ranks continue to make the same selections.
+        """
+        # The presynaptic cell is created on every rank, so that all ranks
+        # assign the same gids.
+        pre_cell = pre_pop.get_cell(pre_index)
+        post_cell = post_pop._cells[post_index]['cell']
+        if not self.is_local(post_cell):
+            return None
+        post_gid = post_pop._cells[post_index]['gid']
+        state = np.random.get_state()
+        np.random.seed([random.current_seed() % 2**32, post_gid + 1, post_index,
+                        len(post_cell.inputs)])
+        try:
+            if self.is_local(pre_cell):
+                self.stats['local_synapses'] += 1
+                return pre_cell.connect(post_cell, type=post_pop._synapsetype)
+            synapse = self._proxy(pre_pop, pre_cell).connect(post_cell, type=post_pop._synapsetype)
+            self._rewire(synapse, pre_cell.gid)
+            self.stats['remote_synapses'] += 1
+            return synapse
+        finally:
+            np.random.set_state(state)
+
+    def _proxy(self, pop, remote_cell):
+        """ Return the ProxyCell holding terminals of *remote_cell* on this
+        rank.
+        """
+        proxy = self._proxies.get(remote_cell.gid, None)
+        if proxy is None:
+            cls = self._proxy_classes.get(pop.cell_class, None)
+            if cls is None:
+                cls = _proxy_class(pop)
+                self._proxy_classes[pop.cell_class] = cls
+            proxy = cls(pop.species, remote_cell.gid)
+            self._proxies[remote_cell.gid] = proxy
+        return proxy
+
+    def _rewire(self, synapse, gid):
+        """ Replace the NetCon that drives the terminal of *synapse* with one
+        that receives the spikes of cell *gid* from another rank.
+        """
+        terminal = synapse.terminal
+        old = terminal.netcon
+        nc = self.pc.gid_connect(gid, old.syn())
+        nc.weight[0] = old.weight[0]
+        nc.delay = max(old.delay, self.exchange_delay)
+        terminal.netcon = nc
+
+    def record_spikes(self):
+        """ Record the spikes of all cells simulated on this rank.
+        """
+        self._spike_vectors = (h.Vector(), h.Vector())
+        self.pc.spike_record(-1, self._spike_vectors[0], self._spike_vectors[1])
+
+    def run(self, tstop, init=None):
+        """ Initialize the model by calling *init* (default h.finitialize) and
+        run the simulation on all ranks until *tstop*.
+        """
+        self.pc.set_maxstep(10)
+        if init is None:
+            h.finitialize()
+        else:
+            init()
+        self.pc.psolve(tstop)
+
+    def gather_spikes(self):
+        """ Return (times, gids) arrays of the spikes recorded on all ranks,
+        sorted by time, on rank 0 (None on other ranks). See record_spikes().
+        """
+        local = (np.array(self._spike_vectors[0]), np.array(self._spike_vectors[1]).astype(int))
+        gathered = self.pc.py_gather(local, 0)
+        if self.rank != 0:
+            return None
+        times = np.concatenate([t for t, g in gathered])
+        gids = np.concatenate([g for t, g in gathered])
+        order = np.argsort(times, kind='mergesort')
+        return times[order], gids[order]
+
+    def cell_index(self, gid):
+        """ Return (population, index) for the cell with global id *gid*.
+        """
+        for pop in self.populations:
+            inds = np.argwhere(pop._cells['gid'] == gid)[:,0]
+            if len(inds) > 0:
+                return pop, inds[0]
+        raise KeyError("No cell has gid %d." % gid)
+
+    def done(self):
+        """ Wait for all ranks and shut down the parallel context.
+        """
+        self.pc.barrier()
+        self.pc.done()
+
+
+class RemoteCell(object):
+    """ Placeholder for a real cell that is simulated on another rank.
+    """
+    def __init__(self, type, gid, rank):
+        self.type = type
+        self.gid = gid
+        self.rank = rank
+        self.inputs = []
+
+    def __repr__(self):
+        return "<RemoteCell %s gid=%d rank=%d>" % (self.type, self.gid, self.rank)
+
+
+class ProxyCell(Cell):
+    """ Stand-in on this rank for a cell simulated on another rank.
+
+    A ProxyCell has a single empty section that holds the terminals of
+    synapses made by the remote cell onto cells on this rank. Subclasses
+    created by _proxy_class() also derive from the cell class of the remote
+    cell's population, so that terminals are configured exactly as the real 
+    cell would configure them.
+    """
+    def __init__(self, species, gid):
+        Cell.__init__(self)
+        self.species = species
+        self.gid = gid
+        self.spike_source = None
+        self.add_section(h.Section(name="Proxy_%s_%d" % (self.type, gid)), 'soma')
+
+
+def _proxy_class(pop):
+    """ Return a ProxyCell subclass for the cells of population *pop*.
+    """
+    cls = pop.cell_class
+    if cls is None:
+        raise TypeError("Population %s does not define cell_class." % pop)
+    return type('Proxy' + cls.__name__, (ProxyCell, cls), {})
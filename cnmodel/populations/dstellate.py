@@ -7,6 +7,7 @@ from .. import cells
 
 class DStellate(Population):
     type = 'dstellate'
+    cell_class = cells.DStellate
     
     def __init__(self, species='mouse', **kwds):
         # Note that `cf` is the mean value used when selecting SGCs to connect;
@@ -3,6 +3,7 @@ import scipy.stats
 import numpy as np
 
 from .. import data
+from .connections import ConnectionTable
 
 
 class Population(object):
@@ -26,6 +27,23 @@ class Population(object):
     Subclasses represent populations for a specific cell type, and at least
     need to reimplement the `create_cell` and `connection_stats` methods.
     """
+    # number of postsynaptic cells handled together by connect_pop_to_cells()
+    bulk_block_size = 128
+    
+    # If True, real cells are instantiated on every rank of a distributed 
+    # network rather than on a single rank (see DistributedNetwork).
+    replicated = False
+    
+    # Base class of the cells created by this population (for example 
+    # cells.Bushy); used to make stand-ins for cells simulated on other 
+    # ranks of a distributed network.
+    cell_class = None
+    
+    # Per-synapse fields recorded in connection tables: the index of the
+    # synapse in the postsynaptic cell's inputs list, and its number of
+    # release zones (-1 if unknown).
+    synapse_fields = [('input_index', int), ('n_zones', int)]
+    
     def __init__(self, species, size, fields, synapsetype='multisite', **kwds):
         self._species = species
         self._post_connections = []  # populations this one connects to
@@ -37,10 +55,13 @@ class Population(object):
             ('id', int),
             ('cell', object), 
             ('input_resolved', bool),
-            ('connections', object),  # {pop: [cells], ...}
+            ('gid', int),  # global id in a distributed network, or -1
         ] + fields
         self._cells = np.zeros(size, dtype=fields)
         self._cells['id'] = np.arange(size)
+        self._cells['gid'] = -1
+        self._network = None  # DistributedNetwork, if any
+        self._connection_tables = {}  # maps pre population:ConnectionTable
         self._cell_indexes = {}  # maps cell:index
         self._cell_args = kwds
 
@@ -78,6 +99,20 @@ class Population(object):
         """
         return np.argwhere(self._cells['cell'] != 0)[:,0]
 
+    def local_cells(self):
+        """ Return indexes of all real cells that are simulated in this 
+        process.
+        
+        This is the same as `real_cells()`, except in a distributed network
+        (see DistributedNetwork), where real cells simulated on other ranks 
+        are excluded.
+        """
+        real = self.real_cells()
+        if self._network is None:
+            return real
+        return np.array([i for i in real if self._network.is_local(self._cells[i]['cell'])],
+                        dtype=int)
+
     def connect(self, *pops):
         """ Connect this population to any number of other populations. 
         
@@ -90,6 +125,8 @@ class Population(object):
         self._post_connections.extend(pops)
         for pop in pops:
             pop._pre_connections.append(self)
+            if self not in pop._connection_tables:
+                pop._connection_tables[self] = ConnectionTable(self, pop, fields=pop.synapse_fields)
 
     @property
     def pre_connections(self):
@@ -97,13 +134,33 @@ class Population(object):
         """
         return self._pre_connections[:]
 
+    @property
+    def post_connections(self):
+        """ The list of populations this one connects to.
+        """
+        return self._post_connections[:]
+
+    def connection_table(self, pop):
+        """ Return the ConnectionTable holding all synapses from the 
+        presynaptic population *pop* onto cells in this population.
+        
+        Each synapse in the table has the fields listed in `synapse_fields`.
+        """
+        return self._connection_tables[pop]
+
     def cell_connections(self, index):
         """ Return a dictionary containing, for each population, a list of 
         cells connected to the cell in this population at *index*.
+        
+        The dictionary is empty if the inputs of the cell have not been 
+        resolved.
         """
-        return self._cells[index]['connections']
+        if not self._cells[index]['input_resolved']:
+            return {}
+        return dict([(pop, list(table.pre_indexes(index))) 
+                     for pop, table in self._connection_tables.items()])
 
-    def resolve_inputs(self, depth=1):
+    def resolve_inputs(self, depth=1, bulk=False):
         """ For each _real_ cell in the population, select a set of 
         presynaptic partners from each connected population and generate a 
         synapse from each.
@@ -112,25 +169,68 @@ class Population(object):
         a single population, each individual cell will only resolve its inputs
         once. Therefore, it is recommended to create and connect all 
         populations before making any calls to ``resolve_inputs``.
+        
+        If *bulk* is True, the inputs of all unresolved cells are resolved 
+        together by `connect_pop_to_cells()`, which is much faster for large
+        numbers of real cells. The random draws are made in a different order,
+        so the cells selected differ from those selected with *bulk* False 
+        (for the same random seed).
         """
-        for i in self.unresolved_cells():
-            # loop over all cells whose presynaptic inputs have not been resolved
-            cell = self._cells[i]['cell']
-            logging.info("Resolving inputs for %s %d", self, i)
-            self._cells[i]['connections'] = {}
-            
-            # select cells from each population to connect to this cell
-            for pop in self._pre_connections:
-                pre_cells = self.connect_pop_to_cell(pop, i)
-                logging.info("  connected %d cells from %s", len(pre_cells), pop)
-                assert pre_cells is not None
-                self._cells[i]['connections'][pop] = pre_cells
-            self._cells[i]['input_resolved'] = True
+        if bulk:
+            self._resolve_inputs_bulk()
+        else:
+            for i in self.unresolved_cells():
+                # loop over all cells whose presynaptic inputs have not been resolved
+                cell = self._cells[i]['cell']
+                logging.info("Resolving inputs for %s %d", self, i)
+                
+                # select cells from each population to connect to this cell
+                for pop in self._pre_connections:
+                    first_input = len(cell.inputs)
+                    pre_cells = self.connect_pop_to_cell(pop, i)
+                    logging.info("  connected %d cells from %s", len(pre_cells), pop)
+                    assert pre_cells is not None
+                    self._record_synapses(pop, i, pre_cells, first_input)
+                self._cells[i]['input_resolved'] = True
 
         # recursively resolve inputs in connected populations
         if depth > 1:
             for pop in self.pre_connections:
-                pop.resolve_inputs(depth-1)
+                pop.resolve_inputs(depth-1, bulk=bulk)
+
+    def _resolve_inputs_bulk(self):
+        """ Resolve the inputs of all unresolved cells using 
+        `connect_pop_to_cells()`.
+        """
+        unresolved = self.unresolved_cells()
+        if len(unresolved) == 0:
+            return
+        logging.info("Resolving inputs for %d cells in %s", len(unresolved), self)
+        cells = self._cells[unresolved]['cell']
+        for pop in self._pre_connections:
+            first_inputs = [len(cell.inputs) for cell in cells]
+            pre_cells = self.connect_pop_to_cells(pop, unresolved)
+            assert len(pre_cells) == len(unresolved)
+            logging.info("  connected %d cells from %s", 
+                         sum([len(pre) for pre in pre_cells]), pop)
+            for i, pre, first_input in zip(unresolved, pre_cells, first_inputs):
+                self._record_synapses(pop, i, pre, first_input)
+        self._cells['input_resolved'][unresolved] = True
+
+    def _record_synapses(self, pop, index, pre_cells, first_input):
+        """ Add the synapses just made from *pre_cells* in *pop* onto the cell
+        at *index* to the connection table for *pop*. *first_input* is the 
+        length of the cell's inputs list before they were made.
+        """
+        table = self._connection_tables[pop]
+        inputs = self._cells[index]['cell'].inputs[first_input:]
+        if len(inputs) != len(pre_cells):
+            # synapses were not made by Cell.connect(); parameters are unknown
+            table.add(index, pre_cells, input_index=-1, n_zones=-1)
+            return
+        n_zones = [getattr(synapse.terminal, 'n_rzones', 1) for synapse, post_opts, kwds in inputs]
+        table.add(index, pre_cells, n_zones=n_zones,
+                  input_index=np.arange(first_input, first_input + len(inputs)))
 
     def connect_pop_to_cell(self, pop, cell_index):
         """ Connect cells in a presynaptic population to the cell in this 
@@ -150,11 +250,51 @@ class Population(object):
         # todo: select sgcs with similar spont. rate?
         pre_cells = pop.select(size=size, create=False, **dist)
         for j in pre_cells:
-            pre_cell = pop.get_cell(j)
             # use default settings for connecting these. 
-            pre_cell.connect(cell, type=self._synapsetype)
+            self.connect_cells(pop, j, cell_index)
+        return pre_cells
+
+    def connect_pop_to_cells(self, pop, cell_indexes):
+        """ Connect cells in a presynaptic population to each cell in this
+        population at *cell_indexes*, and return a list containing the 
+        presynaptic indexes of cells connected to each.
+        
+        This is the bulk version of `connect_pop_to_cell()`, used by 
+        ``resolve_inputs(bulk=True)``. The default implementation calls 
+        `self.connection_stats_many()` to determine the number of presynaptic
+        cells and their selection weights for all cells at once, selects all 
+        presynaptic cells with `select_weighted()`, and instantiates them 
+        together before creating the synapses. Subclasses that reimplement 
+        `connect_pop_to_cell()` should reimplement this method as well.
+        """
+        cell_indexes = np.asarray(cell_indexes)
+        pre_cells = []
+        # selection weights are computed for a block of cells at a time to
+        # limit memory use
+        for start in range(0, len(cell_indexes), self.bulk_block_size):
+            cell_recs = self._cells[cell_indexes[start:start+self.bulk_block_size]]
+            sizes, weights = self.connection_stats_many(pop, cell_recs)
+            pre_cells.extend(pop.select_weighted(sizes, weights, create=True))
+        for i, pre in zip(cell_indexes, pre_cells):
+            for j in pre:
+                # use default settings for connecting these. 
+                self.connect_cells(pop, j, i)
         return pre_cells
 
+    def connect_cells(self, pop, pre_index, post_index):
+        """ Make a synapse from the cell in *pop* at *pre_index* to the cell in
+        this population at *post_index*, using this population's synapse type,
+        and return the synapse.
+        
+        In a distributed network (see DistributedNetwork), the synapse is 
+        only made on the rank that simulates the postsynaptic cell; None is 
+        returned on other ranks.
+        """
+        if self._network is not None:
+            return self._network.connect(pop, pre_index, self, post_index)
+        pre_cell = pop.get_cell(pre_index)
+        return pre_cell.connect(self._cells[post_index]['cell'], type=self._synapsetype)
+
     def connection_stats(self, pop, cell_rec):
         """ The population *pop* is being connected to the cell described in 
         *cell_rec*.
@@ -178,15 +318,10 @@ class Population(object):
           of this dictionary.
         """
         cf = cell_rec['cf']
+        n_connections, input_range = self._convergence(pop)
         
         # Convergence distributions (how many presynaptic 
         # cells to connect)  
-        try:
-            n_connections = data.get(
-                'convergence' , species=self.species, pre_type=pop.type, post_type=self.type)
-        except KeyError:
-            raise TypeError("Cannot connect population %s to %s; no convergence specified in data table." % (pop, self))
-            
         if isinstance(n_connections, tuple):
             size_dist = scipy.stats.norm(loc=n_connections[0], scale=n_connections[1])
             size = max(0, size_dist.rvs())
@@ -196,15 +331,69 @@ class Population(object):
         
         # Convergence ranges -- over what range of CFs should we
         # select presynaptic cells.
+        dist = {'cf': scipy.stats.lognorm(input_range, scale=cf)}
+
+        return size, dist
+    
+    def connection_stats_many(self, pop, cell_recs):
+        """ The population *pop* is being connected to each of the cells 
+        described in the record array *cell_recs*.
+        
+        This is the bulk version of `connection_stats()`. It must return a 
+        tuple (sizes, weights):
+        
+        * sizes: integer array giving the number of cells to select from the
+          presynaptic population for each postsynaptic cell.
+        * weights: array of shape (len(cell_recs), len(pop.cells)) giving
+          the (unnormalized) probability of selecting each presynaptic cell
+          for each postsynaptic cell. See `select_weighted()`.
+        
+        The default implementation computes the same lognormal CF kernels as
+        `connection_stats()`, for all cells at once. Subclasses that 
+        reimplement `connection_stats()` should reimplement this method as 
+        well.
+        """
+        n_connections, input_range = self._convergence(pop)
+        
+        if isinstance(n_connections, tuple):
+            size_dist = scipy.stats.norm(loc=n_connections[0], scale=n_connections[1])
+            sizes = np.maximum(0, size_dist.rvs(size=len(cell_recs)))
+        else:
+            sizes = np.repeat(n_connections, len(cell_recs))
+        sizes = sizes.astype(int)
+        
+        # lognormal CF kernel for every (postsynaptic, presynaptic) pair,
+        # weighted by the density of presynaptic cells as in select(). The
+        # pdf is computed directly (scipy's pdf is several times slower for 
+        # large arrays); constant factors cancel in the normalization.
+        pre_cf = pop._cells['cf']
+        dens = np.diff(pre_cf)
+        dens = np.concatenate([dens[:1], dens])
+        # (operations are done in place to avoid large temporary arrays)
+        weights = np.subtract.outer(np.log(cell_recs['cf']), np.log(pre_cf))
+        weights *= weights
+        weights *= -0.5 / input_range**2
+        np.exp(weights, out=weights)
+        weights *= dens / pre_cf
+        weights /= weights.sum(axis=1)[:, np.newaxis]
+        
+        return sizes, weights
+    
+    def _convergence(self, pop):
+        """ Return the convergence and convergence range from the data tables
+        for connecting *pop* to this population.
+        """
+        try:
+            n_connections = data.get(
+                'convergence' , species=self.species, pre_type=pop.type, post_type=self.type)
+        except KeyError:
+            raise TypeError("Cannot connect population %s to %s; no convergence specified in data table." % (pop, self))
         try:
             input_range = data.get('convergence_range', 
                 species=self.species, pre_type=pop.type, post_type=self.type)
         except KeyError:
             raise TypeError("Cannot connect population %s to %s; no convergence range specified in data table." % (pop, self))
-            
-        dist = {'cf': scipy.stats.lognorm(input_range, scale=cf)}
-
-        return size, dist
+        return n_connections, input_range
     
     def _get_cf_array(self, species):
         """Return the array of CF values that should be used when instantiating
@@ -248,7 +437,114 @@ class Population(object):
         """
         if len(kwds) == 0:
             raise TypeError("Must specify at least one selection criteria")
+        full_dist, nearest_field, nearest = self._selection_weights(kwds)
+        if nearest_field is not None:
+            cells = self._select_nearest(full_dist, nearest_field, nearest, size)
+        else:
+            vals = np.random.uniform(size=size)
+            cells = self._select_random(full_dist, vals)
+            
+        if create:
+            self.create_cells(cells)
+        
+        return cells
+
+    def select_many(self, sizes, criteria, create=False):
+        """ Select cells for many postsynaptic cells at once.
+        
+        *sizes* is a list giving the number of cells to select for each 
+        postsynaptic cell, and *criteria* a list of the same length giving the
+        keyword arguments that would be passed to `select()` for that cell 
+        (see `select()`). Return a list containing the list of selected 
+        indexes for each postsynaptic cell.
+        
+        The random values for all selections are drawn in a single call, so 
+        that the result is identical to calling ``select(size, **kwds)`` for 
+        each item in turn (provided that nothing else uses the random number
+        generator in between).
+        """
+        if len(sizes) != len(criteria):
+            raise ValueError("sizes and criteria must have the same length.")
+        selections = []
+        for size, kwds in zip(sizes, criteria):
+            if len(kwds) == 0:
+                raise TypeError("Must specify at least one selection criteria")
+            selections.append(self._selection_weights(kwds))
+        
+        nrandom = sum([int(size) for size, sel in zip(sizes, selections) if sel[1] is None])
+        vals = np.random.uniform(size=nrandom)
+        
+        result = []
+        start = 0
+        for size, (full_dist, nearest_field, nearest) in zip(sizes, selections):
+            if nearest_field is not None:
+                cells = self._select_nearest(full_dist, nearest_field, nearest, size)
+            else:
+                cells = self._select_random(full_dist, vals[start:start+size])
+                start += size
+            result.append(cells)
+            
+        if create:
+            self.create_cells(sorted(set([i for cells in result for i in cells])))
+            
+        return result
+    
+    def select_weighted(self, sizes, weights, create=False):
+        """ Select cells for many postsynaptic cells in one vectorized pass.
+        
+        *weights* is an array of shape (len(sizes), len(self.cells)); row i 
+        gives the (unnormalized) probability of selecting each cell, and 
+        ``sizes[i]`` the number of cells to select, for postsynaptic cell i.
+        Return a list containing the list of selected indexes for each row.
+        
+        Each row is sampled as by ``select(sizes[i], field=weights[i])``
+        with an array criterion, and the random values are drawn in the same
+        order, but all rows are searched at once. Rows with no nonzero
+        weight select no cells. If *create* is True, all selected cells are
+        instantiated.
+        """
+        sizes = np.asarray(sizes, dtype=int)
+        weights = np.asarray(weights, dtype=float)
+        nrows, ncells = weights.shape
+        if len(sizes) != nrows:
+            raise ValueError("weights must have one row for each size.")
+        if nrows == 0:
+            return []
+        
+        totals = weights.sum(axis=1)
+        valid = totals > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cumulative = weights / totals[:, np.newaxis]
+        np.cumsum(cumulative, axis=1, out=cumulative)
+        cumulative[~valid] = -1
+        
+        rows = np.repeat(np.arange(nrows), sizes)
+        vals = np.random.uniform(size=len(rows))
+        vals = vals[np.lexsort((vals, rows))]
         
+        # Cumulative values of each row lie in [-1, 1]; offsetting row i by 
+        # 2i makes the flattened array sorted, so that one search finds the
+        # selected cell for every value. Values past the end of their row 
+        # land in a later row and select nothing.
+        offset = 2. * np.arange(nrows)
+        cumulative += offset[:, np.newaxis]
+        inds = np.searchsorted(cumulative.ravel(), vals + offset[rows], side='left')
+        keep = inds < (rows + 1) * ncells
+        cells = (inds - rows * ncells)[keep]
+        counts = np.bincount(rows[keep], minlength=nrows)
+        selections = [list(sel) for sel in np.split(cells, np.cumsum(counts)[:-1])]
+        
+        if create:
+            self.create_cells(np.unique(cells))
+        
+        return selections
+    
+    def _selection_weights(self, kwds):
+        """ Return (full_dist, nearest_field, nearest) for the selection 
+        criteria in *kwds* (see `select()`). *full_dist* is the combined
+        weight of each cell; *nearest_field* and *nearest* are None unless a 
+        single-valued criterion was given.
+        """
         full_dist = np.ones(len(self._cells))
         nearest = None
         nearest_field = None
@@ -268,37 +564,42 @@ class Population(object):
                 full_dist *= dist
             else:
                 raise TypeError("Distributed criteria must be array or rv_frozen.")
-                
-        # Select cells nearest to the requested value, but only pick from 
-        # cells with nonzero probability. 
-        if nearest is not None:
-            cells = []
-            mask = full_dist == 0
-            err = np.abs(self._cells[nearest_field] - nearest).astype(float)
-            for i in range(size):
-                err[mask] = np.inf
-                cell = np.argmin(err)
-                mask[cell] = True
-                cells.append(cell)
-            
-        # Select cells randomly from the specified combined probability 
-        # distribution
-        else:
-            cells = []
-            full_dist /= full_dist.sum()
-            vals = np.random.uniform(size=size)
-            vals.sort()
-            cumulative = np.cumsum(full_dist)
-            for val in vals:
-                u = np.argwhere(cumulative >= val)
-                if len(u) > 0:
-                    cell = u[0,0]
-                    cells.append(cell)
-            
-        if create:
-            self.create_cells(cells)
+        return full_dist, nearest_field, nearest
         
-        return cells
+    def _select_nearest(self, full_dist, field, value, size):
+        """ Return the indexes of the *size* cells whose *field* is closest 
+        to *value*, picking only from cells with nonzero probability. 
+        
+        Ties are resolved in favor of the lowest index. If there are fewer 
+        than *size* such cells, the remaining selections are index 0.
+        """
+        err = np.abs(self._cells[field] - value).astype(float)
+        err[full_dist == 0] = np.inf
+        # stable sort so that ties keep index order, as argmin would
+        order = np.argsort(err, kind='mergesort')
+        n = min(size, np.isfinite(err).sum())
+        return list(order[:n]) + [0] * (size - n)
+        
+    def _select_random(self, full_dist, vals):
+        """ Return the indexes of cells drawn from the probability 
+        distribution *full_dist*, given uniform random *vals* in [0, 1).
+        
+        Each value selects the first cell at which the cumulative 
+        distribution reaches it; values beyond the end of the distribution
+        select nothing, as does a distribution with no nonzero weight.
+        """
+        total = full_dist.sum()
+        if not total > 0:
+            return []
+        full_dist = full_dist / total
+        vals = np.sort(vals)
+        cumulative = np.cumsum(full_dist)
+        inds = np.searchsorted(cumulative, vals, side='left')
+        inds = inds[inds < len(cumulative)]
+        # searchsorted assumes a sorted array; drop anything that would not
+        # satisfy cumulative >= val (e.g. if the distribution contains nan)
+        inds = inds[cumulative[inds] >= vals[:len(inds)]]
+        return list(inds)
 
     def get_cell(self, i, create=True):
         """ Return the cell at index i. If the cell is virtual, then it will 
@@ -320,7 +621,12 @@ class Population(object):
         for i in cell_inds:
             if self._cells[i]['cell'] != 0:
                 continue
-            cell = self.create_cell(self._cells[i])
+            if self._network is None:
+                cell = self.create_cell(self._cells[i])
+            else:
+                # assigns a gid, and returns a RemoteCell if the cell is 
+                # simulated on another rank
+                cell = self._network.create_cell(self, i)
             self._cells[i]['cell'] = cell
             self._cell_indexes[cell] = i
             
@@ -340,8 +646,12 @@ class Population(object):
         """Return a picklable copy of self.__dict__. 
         
         Note that we remove references to the actual cells in order to allow pickling.
+        An unpickled population therefore cannot be simulated; use 
+        `save_circuit()` and `load_circuit()` to save a circuit that can be 
+        rebuilt.
         """
         state = self.__dict__.copy()
+        state['_network'] = None
         state['_cells'] = state['_cells'].copy()
         mask = state['_cells']['cell'] != 0
         state['_cells'][mask] = [str(cell) for cell in state['_cells'][mask]]
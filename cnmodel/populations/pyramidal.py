@@ -7,6 +7,7 @@ from .. import cells
 
 class Pyramidal(Population):
     type = 'pyramidal'
+    cell_class = cells.Pyramidal
     
     def __init__(self, species='mouse', **kwds):  # ***** NOTE Species - no direct data for mouse (uses RAT data)
         # Note that `cf` is the mean value used when selecting SGCs to connect;
@@ -1,9 +1,10 @@
 import logging
 import numpy as np
-import pyqtgraph.multiprocess as mp
+from neuron import h
 
 from .population import Population
 from .. import cells
+from .. import an_model
 
 
 class SGC(Population):
@@ -11,10 +12,26 @@ class SGC(Population):
     
     The cell distribution is uniform from 2kHz to 64kHz, evenly divided between
     spontaneous rate groups.
+    
+    With model='dummy', each real cell replays a spike train. By default 
+    (replay='vecstim') every cell has its own VecStim and Vector. With
+    replay='pattern', a single PatternStim replays the trains of all cells
+    from one (time, index) buffer, and each cell is identified by a global
+    id (gid) to which its terminals are connected.
     """
     type = 'sgc'
+    cell_class = cells.SGC
+    
+    # first gid used by populations with replay='pattern'; each population 
+    # reserves one gid per cell. These must not overlap the gids assigned by
+    # a DistributedNetwork, which count up from 0.
+    _next_pattern_gid = 10**9
     
-    def __init__(self, species='mouse', model='dummy', **kwds):
+    def __init__(self, species='mouse', model='dummy', replay='vecstim', **kwds):
+        if replay not in ('vecstim', 'pattern'):
+            raise ValueError("replay must be 'vecstim' or 'pattern'.")
+        if replay == 'pattern' and model != 'dummy':
+            raise ValueError("replay='pattern' requires model='dummy'.")
         # Completely fabricated cell distribution: uniform from 2kHz to 40kHz,
         # evenly divided between SR groups. We only go up to 40kHz because the
         # auditory periphery model does not support >40kHz.
@@ -23,53 +40,203 @@ class SGC(Population):
             ('cf', float),
             ('sr', int),  # 0=low sr, 1=mid sr, 2=high sr
         ]
-        super(SGC, self).__init__(species, len(freqs), fields=fields, model=model, **kwds)
+        super(SGC, self).__init__(species, len(freqs), fields=fields, model=model, 
+                                  replay=replay, **kwds)
         self._cells['cf'] = freqs
         # evenly distribute SR groups
         self._cells['sr'] = np.arange(len(freqs)) % 3
+        
+        self._pattern = None  # PatternStim, created by set_spike_pattern()
+        self._pattern_vectors = None  # (times, gids) played by the PatternStim
+        if replay == 'pattern':
+            self._gid_base = SGC._next_pattern_gid
+            SGC._next_pattern_gid += len(freqs)
+    
+    @property
+    def replicated(self):
+        """ Dummy SGCs only replay spike trains, so in a distributed network
+        they are instantiated on every rank.
+        """
+        return self._cell_args.get('model', 'dummy') == 'dummy'
     
     def set_seed(self, seed):
         self.next_seed = seed
-    
+
+    def write_prewarm_manifest(self, filename, stims, seeds):
+        """Write a manifest describing the spike trains needed by this
+        population, so that the AN cache can be filled in advance by a
+        separate (parallel) job::
+
+            python -m cnmodel.an_model.cache prewarm manifest.json --workers 0
+
+        For each stimulus in *stims* and each seed in *seeds*, the manifest
+        lists the trains that set_sound_stim() would use after
+        ``set_seed(seed)``. This should be called after all inputs in the
+        network have been resolved, so that the real cells are known.
+        """
+        real = self.real_cells()
+        cells = [self.get_cell(ind) for ind in real]
+        an_model.write_prewarm_manifest(filename, stims,
+                                        cfs=[cell.cf for cell in cells],
+                                        srs=[cell.sr for cell in cells],
+                                        seeds=seeds,
+                                        seed_offsets=np.arange(len(real)),
+                                        simulator=self._cell_args.get('simulator', None))
+
     def create_cell(self, cell_rec):
         """ Return a single new cell to be used in this population. The 
         *cell_rec* argument is the row from self.cells that describes the cell 
         to be created.
         """
+        kwds = dict(self._cell_args)
+        if kwds.pop('replay', 'vecstim') == 'pattern':
+            kwds['spike_gid'] = self._gid_base + cell_rec['id']
         return cells.SGC.create(species=self.species, cf=cell_rec['cf'],
-                                sr=cell_rec['sr'], **self._cell_args)
+                                sr=cell_rec['sr'], **kwds)
         
     def connect_pop_to_cell(self, pop, index):
         # SGC does not support any inputs
         assert len(self.connections) == 0
 
-    def set_sound_stim(self, stim, parallel=False):
+    def prefetch(self, trials, depth=1, parallel=False, chunk_size=None):
+        """Return an an_model.SpikeTrainPrefetcher that loads or generates the
+        spike trains for a sequence of trials in the background.
+
+        *trials* is a list of (stim, seed) pairs giving the stimulus of each
+        trial and the seed that will be passed to set_seed() before it. If 
+        seed is None, seeds continue from the previous trial, as they do 
+        when set_seed() is not called between trials (the seed of the first
+        trial may only be None if set_seed() was already called). For each 
+        trial, pass the prefetcher to set_sound_stim(), which then uses the 
+        prepared trains instead of loading them::
+
+            with sgc.prefetch(trials) as prefetcher:
+                for stim, seed in trials:
+                    sgc.set_seed(seed)
+                    sgc.set_sound_stim(stim, prefetcher=prefetcher)
+                    ...  # run the simulation
+
+        At most *depth* trials are prepared ahead. If *parallel* is given,
+        missing trains are generated by a pool of worker processes as 
+        described in set_sound_stim(). The real cells of the population must
+        not change while the prefetcher is in use.
+        """
+        real = self.real_cells()
+        cells = [self.get_cell(ind) for ind in real]
+        cfs = [cell.cf for cell in cells]
+        srs = [cell.sr for cell in cells]
+        kwds = {'simulator': self._cell_args.get('simulator', None)}
+        requests = []
+        next_seed = getattr(self, 'next_seed', None)
+        for stim, seed in trials:
+            if seed is None:
+                seed = next_seed
+            if seed is None:
+                raise ValueError("The seed of the first trial must be given "
+                                 "unless set_seed() has been called.")
+            requests.append((cfs, srs, list(range(seed, seed + len(real))), stim, kwds))
+            next_seed = seed + len(real)
+        return an_model.SpikeTrainPrefetcher(requests, depth=depth, parallel=parallel,
+                                             chunk_size=chunk_size)
+
+    def set_sound_stim(self, stim, parallel=False, chunk_size=None, prefetcher=None):
         """Set a sound stimulus to generate spike trains for all (real) cells
         in this population.
+        
+        Unless *parallel* is given, the spike trains for all cells are loaded 
+        or generated in a single call to an_model.get_spiketrains(), which 
+        computes the IHC stage only once for each CF.
+        
+        If *parallel* is True, missing spike trains are generated by a pool of
+        worker processes (see an_model.SpikeTrainPool), one per CPU. *parallel* 
+        may also be the number of workers, or an existing SpikeTrainPool. 
+        *chunk_size* sets the number of trains handled by a worker in each 
+        task. Each cell receives the same spike train regardless of how the 
+        work is divided.
+        
+        To avoid generating trains during the simulation, the cache can be 
+        filled beforehand (see write_prewarm_manifest()), or the trains for 
+        the next trials prepared while the current one runs (see prefetch()).
+        If *prefetcher* is given, the trains for this call are taken from it;
+        a ValueError is raised if they were prepared for a different 
+        stimulus, seeds or cells. In that case neither the prefetched trial
+        nor the seeds are used up, so the call can be repeated with matching
+        arguments.
         """
         real = self.real_cells()
         logging.info("Assigning spike trains to %d SGC cells..", len(real))
-        if not parallel:
-            for i, ind in enumerate(real):
-                logging.info("Assigning spike train to SGC %d (%d/%d)", ind, i, len(real))
-                cell = self.get_cell(ind)
-                cell.set_sound_stim(stim, self.next_seed)
-                self.next_seed += 1
-                
+        seeds = range(self.next_seed, self.next_seed + len(real))
+        cells = [self.get_cell(ind) for ind in real]
+        cfs = [cell.cf for cell in cells]
+        srs = [cell.sr for cell in cells]
+        simulator = self._cell_args.get('simulator', None)
+        if prefetcher is not None:
+            request, trains = prefetcher.peek()
+            pcfs, psrs, pseeds, pstim, kwds = request
+            if (list(pseeds) != list(seeds) or list(pcfs) != cfs or 
+                    list(psrs) != srs or 
+                    pstim.fingerprint() != stim.fingerprint()):
+                raise ValueError("Prefetched spike trains do not match the "
+                                 "requested stimulus, seeds and cells.")
+            next(prefetcher)
+        elif parallel is False:
+            trains = an_model.get_spiketrains(cfs=cfs, srs=srs, seeds=seeds, 
+                                              stim=stim, simulator=simulator)
+        elif isinstance(parallel, an_model.SpikeTrainPool):
+            trains = parallel.get_spiketrains(cfs, srs, seeds, stim, 
+                                              simulator=simulator)
         else:
-            seeds = range(self.next_seed, self.next_seed + len(real))
-            self.next_seed = seeds[-1] + 1
-            tasks = zip(seeds, real)
-            trains = [None] * len(tasks)
-            # generate spike trains in parallel
-            with mp.Parallelize(enumerate(tasks), trains=trains, progressDialog='Generating SGC spike trains..') as tasker:
-                for i, x in tasker:
-                    seed, ind = x
-                    cell = self.get_cell(ind)
-                    train = cell.generate_spiketrain(stim, seed)
-                    tasker.trains[i] = train
-            # collected all trains; now assign to cells
-            for i,ind in enumerate(real):
-                cell = self.get_cell(ind)
-                cell.set_spiketrain(trains[i])
-            
\ No newline at end of file
+            workers = None if parallel is True else parallel
+            with an_model.SpikeTrainPool(workers=workers, chunk_size=chunk_size) as pool:
+                trains = pool.get_spiketrains(cfs, srs, seeds, stim, 
+                                              simulator=simulator)
+        self.next_seed += len(real)
+        self.set_spike_trains(real, [train * 1000 for train in trains])
+
+    def set_spike_trains(self, indexes, trains):
+        """Set the spike trains (in ms) replayed by the real cells at 
+        *indexes*.
+        
+        With replay='pattern', all trains are loaded into the population's 
+        PatternStim at once (see set_spike_pattern()), replacing those of the
+        previous trial.
+        """
+        for ind, train in zip(indexes, trains):
+            self.get_cell(ind).set_spiketrain(train)
+        if self._cell_args.get('replay', 'vecstim') == 'pattern':
+            counts = [len(train) for train in trains]
+            if sum(counts) == 0:
+                times = np.zeros(0)
+            else:
+                times = np.concatenate([np.asarray(train, dtype=float) for train in trains])
+            self.set_spike_pattern(times, np.repeat(np.asarray(indexes, dtype=int), counts))
+
+    def set_spike_pattern(self, times, indexes):
+        """Replay a spike at each of *times* (ms) from the cell at the 
+        corresponding position in *indexes*, replacing any previous pattern.
+        
+        This is a single update of the buffers of the population's 
+        PatternStim, and is only available with replay='pattern'. Cells 
+        store no spike trains of their own when it is called directly.
+        """
+        if self._cell_args.get('replay', 'vecstim') != 'pattern':
+            raise RuntimeError("set_spike_pattern() requires replay='pattern'.")
+        times = np.asarray(times, dtype=float)
+        indexes = np.asarray(indexes, dtype=int)
+        if times.shape != indexes.shape:
+            raise ValueError("times and indexes must have the same length.")
+        # PatternStim expects events in time order
+        order = np.argsort(times, kind='mergesort')
+        if self._pattern is None:
+            self._pattern = h.PatternStim()
+            self._pattern_vectors = (h.Vector(), h.Vector())
+        tvec, gidvec = self._pattern_vectors
+        tvec.from_python(times[order])
+        gidvec.from_python((self._gid_base + indexes[order]).astype(float))
+        self._pattern.play(tvec, gidvec)
+
+    def __getstate__(self):
+        state = super(SGC, self).__getstate__()
+        state['_pattern'] = None
+        state['_pattern_vectors'] = None
+        return state
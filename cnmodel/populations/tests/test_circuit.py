@@ -0,0 +1,85 @@
+import os, tempfile
+import numpy as np
+from cnmodel.populations.population import Population
+from cnmodel.populations.circuit import save_circuit, load_circuit
+
+
+class DummyMechanism(object):
+    def __init__(self):
+        self.gmax = 1.0 + 0.1 * np.random.standard_normal()
+
+
+class DummyTerminal(object):
+    n_rzones = 2
+
+
+class DummyPSD(object):
+    def __init__(self, n):
+        self.all_psd = [DummyMechanism() for i in range(n)]
+
+
+class DummySynapse(object):
+    def __init__(self, pre_cell):
+        self.pre_cell = pre_cell
+        self.terminal = DummyTerminal()
+        self.psd = DummyPSD(2)
+
+
+class DummyCell(object):
+    def __init__(self):
+        self.inputs = []
+        
+    def connect(self, post_cell, type):
+        synapse = DummySynapse(self)
+        post_cell.inputs.append([synapse, {}, {'type': type}])
+        return synapse
+
+
+class DummyPopulation(Population):
+    type = 'dummy'
+    
+    def __init__(self, species='mouse', size=500, **kwds):
+        fields = [('cf', float)]
+        super(DummyPopulation, self).__init__(species, size, fields=fields, **kwds)
+        self._cell_args['size'] = size
+        self._cells['cf'] = 2000 * 1.005**np.arange(size)
+        
+    def create_cell(self, cell_rec):
+        return DummyCell()
+    
+    def _convergence(self, pop):
+        return 5, 0.1
+
+
+def test_save_load():
+    pre1 = DummyPopulation(size=800)
+    pre2 = DummyPopulation(size=300, synapsetype='simple')
+    post = DummyPopulation(size=200)
+    pre1.connect(post, pre2)
+    pre2.connect(post)
+    post.create_cells([10, 50, 51])
+    post.resolve_inputs(depth=2)
+    pops = {'pre1': pre1, 'pre2': pre2, 'post': post}
+    
+    filename = os.path.join(tempfile.mkdtemp(), 'circuit.npz')
+    save_circuit(filename, pops)
+    loaded = load_circuit(filename)
+    
+    for name, pop in pops.items():
+        pop2 = loaded[name]
+        assert type(pop2) is DummyPopulation
+        assert pop2._synapsetype == pop._synapsetype
+        assert len(pop2.cells) == len(pop.cells)
+        assert list(pop2.real_cells()) == list(pop.real_cells())
+        assert list(pop2.unresolved_cells()) == list(pop.unresolved_cells())
+        for pre in pop.pre_connections:
+            table = pop.connection_table(pre)
+            table2 = pop2.connection_table(loaded[[k for k in pops if pops[k] is pre][0]])
+            assert np.all(table2.synapses == table.synapses)
+        for i in pop.real_cells():
+            inputs = pop.get_cell(i).inputs
+            inputs2 = pop2.get_cell(i).inputs
+            assert len(inputs2) == len(inputs)
+            for (syn, post_opts, kwds), (syn2, post_opts2, kwds2) in zip(inputs, inputs2):
+                assert kwds2 == kwds
+                assert [m.gmax for m in syn2.psd.all_psd] == [m.gmax for m in syn.psd.all_psd]
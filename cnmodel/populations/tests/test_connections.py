@@ -0,0 +1,34 @@
+import numpy as np
+from cnmodel.populations.connections import ConnectionTable
+
+
+class DummyPopulation(object):
+    def __init__(self, size):
+        self._cells = np.zeros(size, dtype=[('id', int)])
+
+
+def test_connection_table():
+    pre = DummyPopulation(10)
+    post = DummyPopulation(5)
+    table = ConnectionTable(pre, post, fields=[('weight', float)])
+    assert len(table) == 0
+    assert len(table.row(2)) == 0
+    
+    table.add(3, [4, 1, 4], weight=[0.1, 0.2, 0.3])
+    table.add(0, [1, 9], weight=1.0)
+    assert len(table) == 5
+    assert list(table.indptr) == [0, 2, 2, 2, 5, 5]
+    # rows keep the order synapses were added
+    assert list(table.pre_indexes(3)) == [4, 1, 4]
+    assert list(table.row(3)['weight']) == [0.1, 0.2, 0.3]
+    assert list(table.pre_indexes(0)) == [1, 9]
+    assert list(table.post_indexes(4)) == [3, 3]
+    assert list(table.post_indexes(1)) == [0, 3]
+    assert list(table.column(1)['weight']) == [1.0, 0.2]
+    assert len(table.column(0)) == 0
+    
+    # tables can grow after being queried
+    table.add(1, [0])
+    assert list(table.pre_indexes(1)) == [0]
+    assert list(table.post_indexes(0)) == [1]
+    assert list(table.synapses['post']) == [0, 0, 1, 3, 3, 3]
@@ -0,0 +1,106 @@
+import numpy as np
+from neuron import h
+from cnmodel import populations, cells
+from cnmodel.populations.distributed import RemoteCell, ProxyCell
+from cnmodel.util import reset
+
+
+def make_network(**kwds):
+    reset(raiseError=False)
+    h.ParallelContext().gid_clear()
+    sgc = populations.SGC(model='dummy')
+    bushy = populations.Bushy()
+    dstellate = populations.DStellate()
+    sgc.connect(bushy, dstellate)
+    dstellate.connect(bushy)
+    net = populations.DistributedNetwork([sgc, bushy, dstellate], **kwds)
+    return net, sgc, bushy, dstellate
+
+
+def test_single_rank():
+    net, sgc, bushy, dstellate = make_network()
+    assert (net.rank, net.nhost) == (0, 1)
+
+    # gids are assigned in creation order; replicated SGCs get none
+    bushy.create_cells([7, 3])
+    dstellate.create_cells([5])
+    sgc.create_cells([0])
+    assert bushy.cells['gid'][7] == 0
+    assert bushy.cells['gid'][3] == 1
+    assert dstellate.cells['gid'][5] == 2
+    assert sgc.cells['gid'][0] == -1
+    assert net.cell_index(2) == (dstellate, 5)
+    for pop, ind in [(bushy, 7), (bushy, 3), (dstellate, 5), (sgc, 0)]:
+        assert net.is_local(pop.get_cell(ind))
+    assert list(bushy.local_cells()) == [3, 7]
+
+    # synapses do not consume the global random state
+    np.random.seed(12)
+    state = np.random.get_state()
+    syn = net.connect(dstellate, 5, bushy, 7)
+    assert syn is not None
+    assert net.stats == {'local_synapses': 1, 'remote_synapses': 0}
+    after = np.random.get_state()
+    assert np.all(after[1] == state[1]) and after[2:] == state[2:]
+
+    # spikes of local cells are gathered on rank 0
+    cell = bushy.get_cell(7)
+    stim = h.IClamp(0.5, sec=cell.soma)
+    stim.delay, stim.dur, stim.amp = 2., 10., 2.
+    net.record_spikes()
+    net.run(15.)
+    times, gids = net.gather_spikes()
+    assert len(times) > 0
+    assert np.all(gids == 0)
+    assert np.all(np.diff(times) >= 0)
+    assert np.all((times > 2.) & (times < 15.))
+
+
+def test_owner():
+    net, sgc, bushy, dstellate = make_network()
+    net.nhost = 4
+    gids = np.arange(10)
+    assert [net.owner(bushy, i, gid) for i, gid in enumerate(gids)] == list(gids % 4)
+
+    net.split = 'cf'
+    cfs = bushy.cells['cf']
+    ranks = np.array([net.owner(bushy, i, 0) for i in range(len(cfs))])
+    order = np.argsort(cfs)
+    assert ranks[order[0]] == 0
+    assert ranks[order[-1]] == 3
+    assert np.all(np.diff(ranks[order]) >= 0)
+    assert set(ranks) == set(range(4))
+
+
+def test_remote_synapse():
+    net, sgc, bushy, dstellate = make_network(exchange_delay=0.5)
+    # pretend that all D-stellate cells are simulated on rank 1
+    net.owner = lambda pop, index, gid: 1 if pop is dstellate else 0
+    bushy.create_cells([7])
+    pre = dstellate.get_cell(5)
+    assert isinstance(pre, RemoteCell)
+    assert not net.is_local(pre)
+    assert (pre.gid, pre.rank) == (1, 1)
+
+    syn = net.connect(dstellate, 5, bushy, 7)
+    assert net.stats == {'local_synapses': 0, 'remote_synapses': 1}
+    proxy = net._proxies[1]
+    assert isinstance(proxy, ProxyCell)
+    assert isinstance(proxy, cells.DStellate)
+    assert syn.terminal.cell is proxy
+    nc = syn.terminal.netcon
+    assert nc.srcgid() == 1
+    assert nc.delay >= 0.5
+    assert nc.weight[0] == 1
+
+    # further synapses from the same cell share its proxy
+    bushy.create_cells([8])
+    net.connect(dstellate, 5, bushy, 8)
+    assert len(net._proxies) == 1
+    assert list(net._proxy_classes) == [cells.DStellate]
+
+
+if __name__ == '__main__':
+    test_single_rank()
+    test_owner()
+    test_remote_synapse()
@@ -0,0 +1,146 @@
+import warnings
+import numpy as np
+import scipy.stats
+from cnmodel.populations.population import Population
+
+
+class DummyTerminal(object):
+    n_rzones = 3
+
+
+class DummySynapse(object):
+    def __init__(self, pre_cell):
+        self.pre_cell = pre_cell
+        self.terminal = DummyTerminal()
+
+
+class DummyCell(object):
+    def __init__(self):
+        self.inputs = []
+        
+    def connect(self, post_cell, type):
+        synapse = DummySynapse(self)
+        post_cell.inputs.append([synapse, {}, {}])
+        return synapse
+
+
+class DummyPopulation(Population):
+    type = 'dummy'
+    
+    def __init__(self, size):
+        fields = [('cf', float), ('sr', int)]
+        super(DummyPopulation, self).__init__('mouse', size, fields=fields)
+        self._cells['cf'] = 2000 * 1.001**np.arange(size)
+        self._cells['sr'] = np.arange(size) % 3
+        
+    def create_cell(self, cell_rec):
+        return DummyCell()
+    
+    def _convergence(self, pop):
+        return 10, 0.1
+
+
+def reference_select(pop, size, full_dist, nearest_field=None, nearest=None):
+    """ Per-value selection loop that select() must reproduce.
+    """
+    cells = []
+    if nearest_field is not None:
+        mask = full_dist == 0
+        err = np.abs(pop.cells[nearest_field] - nearest).astype(float)
+        for i in range(size):
+            err[mask] = np.inf
+            cell = np.argmin(err)
+            mask[cell] = True
+            cells.append(cell)
+    else:
+        full_dist = full_dist / full_dist.sum()
+        vals = np.random.uniform(size=size)
+        vals.sort()
+        cumulative = np.cumsum(full_dist)
+        for val in vals:
+            u = np.argwhere(cumulative >= val)
+            if len(u) > 0:
+                cells.append(u[0,0])
+    return cells
+
+
+def test_select():
+    pop = DummyPopulation(2000)
+    cfs = pop.cells['cf']
+    criteria = []
+    for i in range(20):
+        cf = cfs[(i * 97) % len(cfs)]
+        criteria.append({'cf': scipy.stats.lognorm(0.1, scale=cf), 
+                         'sr': (pop.cells['sr'] == i % 3).astype(float)})
+    criteria.append({'cf': 5000., 'sr': (pop.cells['sr'] == 1).astype(float)})
+    # fewer candidates than requested
+    criteria.append({'cf': 5000., 'sr': (np.arange(len(cfs)) < 3).astype(float)})
+    sizes = [10] * len(criteria)
+    
+    np.random.seed(0)
+    expected = []
+    for size, kwds in zip(sizes, criteria):
+        full_dist, nearest_field, nearest = pop._selection_weights(kwds)
+        expected.append(reference_select(pop, size, full_dist, nearest_field, nearest))
+    
+    np.random.seed(0)
+    selected = [pop.select(size, **kwds) for size, kwds in zip(sizes, criteria)]
+    assert selected == expected
+    
+    np.random.seed(0)
+    assert pop.select_many(sizes, criteria) == expected
+    
+    assert len(pop.real_cells()) == 0
+    pop.select_many(sizes[:2], criteria[:2], create=True)
+    assert len(pop.real_cells()) > 0
+
+
+def test_select_weighted():
+    pop = DummyPopulation(2000)
+    post = DummyPopulation(50)
+    cell_recs = post.cells[::5]
+    sizes, weights = post.connection_stats_many(pop, cell_recs)
+    assert list(sizes) == [10] * len(cell_recs)
+    # same CF kernels as connection_stats()
+    for rec, row in zip(cell_recs, weights):
+        size, dist = post.connection_stats(pop, rec)
+        assert np.allclose(row, pop._selection_weights(dist)[0])
+    
+    # rows with no nonzero weight select nothing
+    weights[3] = 0
+    sizes[5] = 0
+    np.random.seed(1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        expected = [pop.select(size, cf=row) for size, row in zip(sizes, weights)]
+    np.random.seed(1)
+    selected = pop.select_weighted(sizes, weights)
+    assert selected == expected
+    assert selected[3] == [] and selected[5] == []
+    assert pop.select_weighted([], np.zeros((0, 2000))) == []
+
+
+def test_resolve_inputs():
+    for bulk in (False, True):
+        pre = DummyPopulation(2000)
+        post = DummyPopulation(300)
+        post.bulk_block_size = 16
+        pre.connect(post)
+        post.create_cells(range(0, 300, 7))
+        post.resolve_inputs(bulk=bulk)
+        assert len(post.unresolved_cells()) == 0
+        assert post.cell_connections(1) == {}
+        
+        table = post.connection_table(pre)
+        assert len(table) == 10 * len(post.real_cells())
+        assert np.all(table.synapses['n_zones'] == 3)
+        for i in post.real_cells():
+            pre_cells = post.cell_connections(i)[pre]
+            assert len(pre_cells) == 10
+            inputs = post.get_cell(i).inputs
+            assert [syn.pre_cell for syn, post_opts, kwds in inputs] == [
+                pre.get_cell(j, create=False) for j in pre_cells]
+            assert list(table.row(i)['input_index']) == list(range(10))
+        for j in pre.real_cells():
+            for i in table.post_indexes(j):
+                assert j in post.cell_connections(i)[pre]
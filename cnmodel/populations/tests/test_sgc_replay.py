@@ -0,0 +1,103 @@
+import tempfile
+import numpy as np
+from neuron import h
+from cnmodel import populations, cells
+import cnmodel.an_model.cache as cache
+from cnmodel.protocols import SpikeRecorder
+from cnmodel.util import reset, sound
+
+
+def test_pattern_replay():
+    # All trains of a replay='pattern' population are played by one
+    # PatternStim; swapping trials only replaces its buffers.
+    reset(raiseError=False)
+    sgc = populations.SGC(model='dummy', replay='pattern')
+    inds = [2, 10, 11]
+    sgc.create_cells(inds)
+    for ind in inds:
+        assert not hasattr(sgc.get_cell(ind), 'vecstim')
+    recorder = SpikeRecorder([sgc])
+
+    def run(trains):
+        sgc.set_spike_trains(inds, trains)
+        h.finitialize()
+        while h.t < 20:
+            h.fadvance()
+        return [recorder.spike_times(sgc, ind) for ind in inds]
+
+    trains = [[1., 5.], [], [3.5]]
+    for train, times in zip(trains, run(trains)):
+        assert np.allclose(times, train)
+    assert np.allclose(sgc.get_cell(2)._spiketrain, [1., 5.])
+
+    trains = [[2.], [4., 8., 9.], []]
+    for train, times in zip(trains, run(trains)):
+        assert np.allclose(times, train)
+
+
+def test_pattern_terminal():
+    # Spikes replayed by the PatternStim reach the terminals of a real 
+    # postsynaptic cell at the same times as those replayed by a VecStim.
+    train = [1., 4.5, 12.]
+    def run(replay):
+        reset(raiseError=False)
+        sgc = populations.SGC(model='dummy', replay=replay)
+        sgc.create_cells([3])
+        post = cells.Bushy.create()
+        synapse = sgc.get_cell(3).connect(post)
+        relsite = synapse.terminal.relsite
+        requests = h.Vector()
+        requests.record(relsite._ref_nRequests)
+        v = h.Vector()
+        v.record(post.soma(0.5)._ref_v)
+        sgc.set_spike_trains([3], [train])
+        h.finitialize(-65)
+        while h.t < 20:
+            h.fadvance()
+        steps = np.argwhere(np.diff(np.array(requests)) > 0)[:,0] + 1
+        return steps * h.dt, synapse.terminal.netcon.delay, np.array(v)
+    
+    times, delay, v = run('pattern')
+    assert len(times) == len(train)
+    assert np.allclose(times, np.array(train) + delay, atol=1.01 * h.dt)
+    # the postsynaptic cell responds
+    assert v.max() > v[0] + 1.
+    vtimes, vdelay, vv = run('vecstim')
+    assert vdelay == delay
+    assert np.all(vtimes == times)
+
+
+def test_prefetch():
+    reset(raiseError=False)
+    cache._cache_path = tempfile.mkdtemp()
+    sgc = populations.SGC(model='dummy', simulator='fast')
+    inds = [2, 10, 11]
+    sgc.create_cells(inds)
+    stims = [sound.TonePip(rate=100e3, duration=0.01, f0=f0, dbspl=80,
+                           ramp_duration=0.002, pip_duration=0.004,
+                           pip_start=[0.001]) for f0 in (4000, 8000)]
+    try:
+        sgc.prefetch([(stims[0], None)])
+        raise AssertionError("Expected ValueError")
+    except ValueError:
+        pass
+
+    with sgc.prefetch([(stims[0], 5), (stims[1], None)]) as prefetcher:
+        # a mismatch leaves the trial and the seeds for the next call
+        for stim, seed in [(stims[1], 5), (stims[0], 6)]:
+            sgc.set_seed(seed)
+            try:
+                sgc.set_sound_stim(stim, prefetcher=prefetcher)
+                raise AssertionError("Expected ValueError")
+            except ValueError:
+                pass
+            assert sgc.next_seed == seed
+        sgc.set_seed(5)
+        for stim in stims:
+            sgc.set_sound_stim(stim, prefetcher=prefetcher)
+            prefetched = [sgc.get_cell(ind)._spiketrain for ind in inds]
+            sgc.next_seed -= len(inds)
+            sgc.set_sound_stim(stim)
+            for ind, train in zip(inds, prefetched):
+                assert np.all(sgc.get_cell(ind)._spiketrain == train)
+        assert sgc.next_seed == 5 + 2 * len(inds)
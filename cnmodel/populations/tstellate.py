@@ -7,6 +7,7 @@ from .. import cells
 
 class TStellate(Population):
     type = 'tstellate'
+    cell_class = cells.TStellate
     
     def __init__(self, species='mouse', **kwds):
         # Note that `cf` is the mean value used when selecting SGCs to connect;
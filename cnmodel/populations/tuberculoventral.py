@@ -6,6 +6,7 @@ from .. import cells
 
 class Tuberculoventral(Population):
     type = 'tuberculoventral'
+    cell_class = cells.Tuberculoventral
     
     def __init__(self, species='mouse', **kwds):
         # Note that `cf` is the mean value used when selecting SGCs to connect;
@@ -42,3 +43,17 @@ class Tuberculoventral(Population):
             dist['sr'] = (pop.cells['sr'] < 2).astype(float)
 
         return size, dist
+
+    def connection_stats_many(self, pop, cell_recs):
+        """ Bulk version of connection_stats(); see 
+        Population.connection_stats_many().
+        """
+        sizes, weights = Population.connection_stats_many(self, pop, cell_recs)
+        
+        from .. import populations
+
+        if isinstance(pop, populations.SGC):
+            # only select SGC inputs from low- and medium SR
+            weights *= pop.cells['sr'] < 2
+
+        return sizes, weights
@@ -4,4 +4,5 @@ from .cc import CurrentClamp
 from .synapse_test import SynapseTest
 from .simple_synapse_test import SimpleSynapseTest
 from .protocol import Protocol
+from .spike_recorder import SpikeRecorder
 from .population_test import PopulationTest
@@ -17,7 +17,7 @@ class CurrentClamp(Protocol):
     def __init__(self):
         super(CurrentClamp, self).__init__()
     
-    def run(self, cell, cmd, temp=22, dt=0.025):
+    def run(self, cell, cmd, temp=22, dt=0.025, threads=None):
         """
         Run a single current-clamp recording on *section*.
         
@@ -31,8 +31,12 @@ class CurrentClamp(Protocol):
             temperature of simulation (22)
         dt : 
             timestep of simulation (0.025)
+        threads :
+            number of threads used to simulate the model (None leaves the 
+            current setting unchanged; see Protocol.set_threads())
         """
         self.reset()
+        self.set_threads(threads)
         self.cell = cell
         self.current_cmd = cmd
         self.dt = dt
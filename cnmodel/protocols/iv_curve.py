@@ -32,7 +32,7 @@ class IVCurve(Protocol):
         self.initdelay = 0.
         
     def run(self, ivrange, cell, durs=None, sites=None, reppulse=None, temp=22,
-            dt=0.025, initdelay=0.):
+            dt=0.025, initdelay=0., threads=None):
         """
         Run a current-clamp I/V curve on *cell*.
         
@@ -62,9 +62,13 @@ class IVCurve(Protocol):
             temperature of simulation (32)
         dt : 
             timestep of simulation (0.025)
+        threads : int or None
+            number of threads used to simulate the model (see 
+            Protocol.set_threads())
             
         """
         self.reset()
+        self.set_threads(threads)
         self.cell = cell
         self.initdelay = initdelay
         self.dt = dt
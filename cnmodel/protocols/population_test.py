@@ -12,13 +12,18 @@ class PopulationTest(Protocol):
     def reset(self):
         super(PopulationTest, self).reset()
 
-    def run(self, pops, cf=16e3, temp=34.0, dt=0.025, stim='sound', simulator='cochlea'):
+    def run(self, pops, cf=16e3, temp=34.0, dt=0.025, stim='sound', simulator='cochlea',
+            threads=None):
         """ 
         1. Connect pop1 => pop2
         2. Instantiate a single cell in pop2
         3. Automatically generate presynaptic cells and synapses from pop1
         4. Stimulate presynaptic cells and record postsynaptically
+        
+        If *threads* is given, the simulation is split across that many 
+        threads (see Protocol.set_threads()).
         """
+        self.set_threads(threads)
         
         pre_pop, post_pop = pops
         pre_pop.connect(post_pop)
@@ -1,6 +1,7 @@
 from neuron import h
 import numpy as np
-from ..util import random, custom_init
+from ..util import random, custom_init, set_threads
+from .spike_recorder import SpikeRecorder
 
 class Protocol(object):
     """
@@ -8,20 +9,26 @@ class Protocol(object):
     simulations.
     """
     def __init__(self):
+        self._spike_recorder = None
         self.reset()
 
     def reset(self):
+        # The spike recorder is kept; its vectors are emptied by finitialize()
         self._vectors = {}
         
-    def run(self, seed=None):
+    def run(self, seed=None, threads=None):
         """
         Run this protocol. 
         
+        If *threads* is given, the simulation is split across that many 
+        threads (see set_threads()).
+        
         Subclasses should extend this method.
         """
         if seed is not None:
             random.set_seed(seed)
         self.reset()
+        self.set_threads(threads)
     
     def __setitem__(self, name, variable):
         """
@@ -37,5 +44,37 @@ class Protocol(object):
         """
         return np.array(self._vectors[name])
 
+    def record_spikes(self, populations, thresholds=None, spikes_per_cell=100):
+        """
+        Record the spike times of all real cells in *populations* during the
+        following runs, and return the SpikeRecorder.
+        
+        This is much cheaper than recording the membrane potential of every
+        cell; see SpikeRecorder for the arguments. Unlike other recordings,
+        the recorder is kept by reset(), so this may be called before run();
+        it is replaced by the next call to record_spikes().
+        """
+        self._spike_recorder = SpikeRecorder(populations, thresholds=thresholds,
+                                             spikes_per_cell=spikes_per_cell)
+        return self._spike_recorder
+    
+    def spikes(self):
+        """
+        Return a record array of (population, cell, time) for all spikes 
+        recorded in the last run (see record_spikes()).
+        """
+        if getattr(self, '_spike_recorder', None) is None:
+            raise RuntimeError("Spikes are not being recorded; call record_spikes() first.")
+        return self._spike_recorder.spikes()
+
+    def set_threads(self, threads):
+        """
+        Set the number of threads used to simulate the model in this process
+        (see util.set_threads()). If *threads* is None, the current setting
+        is left unchanged.
+        """
+        if threads is not None:
+            set_threads(threads)
+
     def custom_init(self, vinit=-60.):
         return custom_init(vinit)
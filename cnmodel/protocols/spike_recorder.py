@@ -0,0 +1,104 @@
+import numpy as np
+from neuron import h
+
+
+class SpikeRecorder(object):
+    """ Record the spike times of all real cells in a set of populations.
+
+    One NetCon per cell records into a pair of vectors shared by all cells.
+    The vectors hold the spike times and the position of the cell, and their
+    buffers are preallocated. Spikes are detected at the soma, using the
+    cell's `spike_threshold`. The exceptions are cells with a `spike_source`
+    or a `spike_gid` (DummySGC), whose events are recorded directly.
+
+    In a distributed network (see populations.DistributedNetwork), only the
+    cells simulated on this rank are recorded.
+
+    Parameters
+    ----------
+    populations : list
+        The populations to record from. Cells must already have been
+        instantiated (for example by resolve_inputs()).
+    thresholds : dict or None
+        Optional {population: threshold (mV)}. This overrides the
+        spike_threshold of the cells in each population given.
+    spikes_per_cell : int
+        Expected maximum number of spikes per cell in one run. It is used to
+        size the buffers. More spikes can still be recorded, at the cost of
+        reallocation.
+    """
+    def __init__(self, populations, thresholds=None, spikes_per_cell=100):
+        self.populations = list(populations)
+        thresholds = {} if thresholds is None else thresholds
+        self._times = h.Vector()
+        self._ids = h.Vector()
+        self._netcons = []
+        self._target = None
+        pop_index = []
+        cell_index = []
+        for i, pop in enumerate(self.populations):
+            threshold = thresholds.get(pop, None)
+            for ind in pop.local_cells():
+                nc = self._spike_netcon(pop.get_cell(ind), threshold)
+                nc.record(self._times, self._ids, len(self._netcons))
+                self._netcons.append(nc)
+                pop_index.append(i)
+                cell_index.append(ind)
+        self._pop_index = np.array(pop_index, dtype=int)
+        self._cell_index = np.array(cell_index, dtype=int)
+        size = len(self._netcons) * spikes_per_cell
+        self._times.buffer_size(size)
+        self._ids.buffer_size(size)
+
+    def _spike_netcon(self, cell, threshold=None):
+        """ Return a NetCon that detects the spikes of *cell*.
+        """
+        gid = getattr(cell, 'spike_gid', None)
+        if gid is not None:
+            # Events replayed by a PatternStim (see populations.SGC) only
+            # reach NetCons made by gid_connect(), which need a target.
+            nc = h.ParallelContext().gid_connect(gid, self._event_target())
+            nc.weight[0] = 0
+            return nc
+        source = getattr(cell, 'spike_source', None)
+        if source is not None:
+            return h.NetCon(source, None)
+        nc = h.NetCon(cell.soma(0.5)._ref_v, None, sec=cell.soma)
+        nc.threshold = cell.spike_threshold if threshold is None else threshold
+        return nc
+
+    def _event_target(self):
+        """ Return a synapse on a scratch section, shared by all NetCons
+        that need a target but only record events.
+        """
+        if self._target is None:
+            self._target_sec = h.Section(name='spike_recorder_target')
+            self._target = h.ExpSyn(0.5, sec=self._target_sec)
+        return self._target
+
+    def spikes(self):
+        """ Return a record array of all spikes recorded during the last run,
+        sorted by time. Its fields are 'population' (index into
+        `populations`), 'cell' (index of the cell in its population) and
+        'time' (ms).
+        """
+        times = np.array(self._times)
+        ids = np.array(self._ids).astype(int)
+        order = np.argsort(times, kind='mergesort')
+        ids = ids[order]
+        spikes = np.empty(len(times), dtype=[('population', int), ('cell', int), ('time', float)])
+        spikes['population'] = self._pop_index[ids]
+        spikes['cell'] = self._cell_index[ids]
+        spikes['time'] = times[order]
+        return spikes
+
+    def spike_times(self, pop, index, spikes=None):
+        """ Return the spike times of the cell in *pop* at *index*.
+
+        *spikes* may be given to reuse an array already returned by spikes().
+        """
+        if spikes is None:
+            spikes = self.spikes()
+        i = self.populations.index(pop)
+        mask = (spikes['population'] == i) & (spikes['cell'] == index)
+        return spikes['time'][mask]
@@ -0,0 +1,80 @@
+import numpy as np
+from neuron import h
+from cnmodel.util import reset
+from cnmodel.protocols import Protocol, SpikeRecorder
+
+
+class FakeCell(object):
+    def __init__(self, spike_threshold=-20):
+        self.soma = h.Section()
+        self.soma.L = 20
+        self.soma.diam = 20
+        self.soma.insert('hh')
+        self.spike_threshold = spike_threshold
+
+
+class FakeStimCell(object):
+    def __init__(self, times):
+        self.vec = h.Vector(times)
+        self.spike_source = h.VecStim()
+        self.spike_source.play(self.vec)
+
+
+class FakePopulation(object):
+    def __init__(self, cells):
+        self.cells = cells
+
+    def local_cells(self):
+        return np.arange(len(self.cells))
+
+    def get_cell(self, index):
+        return self.cells[index]
+
+
+def test_spike_recorder():
+    reset(raiseError=False)
+    driven = FakePopulation([FakeCell(), FakeCell()])
+    stims = []
+    for i, cell in enumerate(driven.cells):
+        stim = h.IClamp(0.5, sec=cell.soma)
+        stim.delay = 5 + 10 * i
+        stim.dur = 1
+        stim.amp = 1.0
+        stims.append(stim)
+    trains = FakePopulation([FakeStimCell([3., 12.]), FakeStimCell([7.])])
+
+    recorder = SpikeRecorder([driven, trains])
+    h.finitialize(-65)
+    while h.t < 30:
+        h.fadvance()
+
+    spikes = recorder.spikes()
+    assert np.all(np.diff(spikes['time']) >= 0)
+    assert np.allclose(recorder.spike_times(trains, 0), [3., 12.])
+    assert np.allclose(recorder.spike_times(trains, 1), [7.])
+    for i in range(2):
+        times = recorder.spike_times(driven, i)
+        assert len(times) == 1
+        assert 5 + 10 * i < times[0] < 8 + 10 * i
+    assert len(spikes) == 5
+    assert set(spikes['population']) == set([0, 1])
+
+
+def test_protocol_spikes():
+    # a recorder set up before Protocol.run() is kept, and each run only
+    # returns its own spikes
+    reset(raiseError=False)
+    trains = FakePopulation([FakeStimCell([3., 12.])])
+    protocol = Protocol()
+    protocol.record_spikes([trains])
+    for i in range(2):
+        protocol.run()
+        h.finitialize(-65)
+        while h.t < 20:
+            h.fadvance()
+        assert np.allclose(protocol.spikes()['time'], [3., 12.])
+
+
+if __name__ == '__main__':
+    test_spike_recorder()
+    test_protocol_spikes()
@@ -48,7 +48,7 @@ class VCCurve(Protocol):
         self.time_values = None
         self.dt = None
 
-    def run(self, vcrange, cell, dt=0.025):
+    def run(self, vcrange, cell, dt=0.025, threads=None):
         """
         Run voltage-clamp I/V curve.
 
@@ -61,8 +61,12 @@ class VCCurve(Protocol):
             Voltage difference between steps
         cell :
             The Cell instance to test.
+        threads :
+            Number of threads used to simulate the model (None leaves the 
+            current setting unchanged; see Protocol.set_threads())
         """
         self.reset()
+        self.set_threads(threads)
         self.cell = cell
         try:
             (vmin, vmax, vstep) = vcrange  # unpack the tuple...
@@ -6,4 +6,5 @@ from .expfitting import *
 from .user_tester import UserTester
 from .get_anspikes import *
 from .Params import *
+from .threads import set_threads
 
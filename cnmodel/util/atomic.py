@@ -0,0 +1,73 @@
+"""
+Tools for writing files atomically, so that concurrent readers never see a
+partially written file and no locking is required.
+
+Example::
+
+    with atomic_write('data.npy') as fh:
+        np.save(fh, data)
+
+The data is written to a temporary file in the same directory, which is renamed
+to the final name only if the block completes without error.
+"""
+import os
+import threading
+import contextlib
+
+
+def replace_file(src, dst):
+    """ Rename *src* to *dst*, replacing *dst* if it already exists.
+
+    This is atomic on POSIX systems; on Windows, *dst* is briefly absent.
+    """
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def temp_filename(filename):
+    """ Return the name of a temporary file used while writing *filename*.
+
+    The name is unique to this process and thread, and ends in '.tmp' so that
+    stale temporary files can be found and removed.
+    """
+    return '%s.%d-%d.tmp' % (filename, os.getpid(), threading.current_thread().ident)
+
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='wb', makedirs=True):
+    """ Context manager returning a file handle opened for writing; the file
+    appears as *filename* only after the block exits without error.
+
+    Parameters
+    ----------
+    filename : str
+        Final name of the file. An existing file is replaced.
+    mode : str
+        Mode used to open the temporary file ('w' or 'wb').
+    makedirs : bool
+        If True, create the parent directory of *filename* if necessary.
+    """
+    path = os.path.dirname(filename)
+    if makedirs and path != '' and not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # probably another process already created this directory
+            if not os.path.isdir(path):
+                raise
+    tmp = temp_filename(filename)
+    try:
+        with open(tmp, mode) as fh:
+            yield fh
+        replace_file(tmp, filename)
+    except:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
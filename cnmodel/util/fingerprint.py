@@ -0,0 +1,69 @@
+"""
+Stable, fixed-length fingerprints for parameter sets.
+
+Parameter dictionaries (for example those returned by `Sound.key()`) are first
+reduced to a canonical form in which equivalent values compare equal: numbers
+are rounded to 12 significant digits and written in a single format (so that
+1000, 1000.0 and np.float32(1000) are indistinguishable), sequences and arrays
+become lists, and dictionary keys are sorted. The canonical form is then
+serialized as JSON and hashed together with a version salt.
+"""
+import json
+import hashlib
+import numbers
+import numpy as np
+
+
+#: Increment to invalidate all fingerprints if the canonical form changes.
+fingerprint_version = 1
+
+
+def normalize(value):
+    """ Return a canonical, JSON-serializable version of *value*.
+    """
+    if isinstance(value, dict):
+        return dict([(str(k), normalize(v)) for k, v in value.items()])
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return [normalize(v) for v in value.tolist()]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, numbers.Real):
+        return '%.12g' % value
+    if isinstance(value, bytes) and not isinstance(value, str):
+        value = value.decode('utf-8')
+    return str(value)
+
+
+def canonical(value):
+    """ Return the canonical JSON string for *value*.
+    """
+    return json.dumps(normalize(value), sort_keys=True, separators=(',', ':'))
+
+
+def fingerprint(value, salt=''):
+    """ Return a fixed-length (40 character) hex digest identifying *value*.
+
+    Parameters
+    ----------
+    value : object
+        Any combination of dicts, sequences, arrays, numbers and strings.
+    salt : str
+        Extra string mixed into the hash, used to separate namespaces and
+        to invalidate fingerprints when the meaning of a value changes.
+    """
+    text = 'v%d:%s:%s' % (fingerprint_version, salt, canonical(value))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def array_digest(arr):
+    """ Return a hex digest of the contents, dtype and shape of *arr*.
+    """
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.sha1()
+    h.update(('%s:%s:' % (arr.dtype.str, arr.shape)).encode('utf-8'))
+    h.update(arr.data)
+    return h.hexdigest()
@@ -0,0 +1,167 @@
+"""
+Deduplication of work shared between processes.
+
+When several processes need the same result (for example a spike train that is
+not yet cached), an InFlight marker lets one of them compute it while the
+others wait::
+
+    marker = InFlight('/path/to/result.pending')
+    if marker.claim():
+        try:
+            compute_and_store_result()
+        finally:
+            marker.release()
+    else:
+        marker.wait()
+        # load the result, or compute it if the owner failed
+
+The marker is a file created with O_EXCL, so claiming it is atomic. Unlike
+FileLock, nothing is locked while reading: only processes that need a result
+that is still being computed have to wait. Waiting threads within the owning
+process are woken immediately; other processes poll with an increasing delay.
+Markers left behind by processes that died are detected and ignored.
+"""
+import os
+import errno
+import time
+import socket
+import threading
+
+
+class InFlight(object):
+    """ Marker file announcing that a result is being computed.
+
+    Parameters
+    ----------
+    path : str
+        Name of the marker file. Its directory is created if necessary.
+    timeout : float
+        Markers older than this (in seconds) are assumed to be left over from
+        a process that was killed, and may be taken over by other processes.
+    """
+    # markers claimed by this process, and an event set when each is released
+    _events = {}
+    _events_lock = threading.Lock()
+
+    def __init__(self, path, timeout=600.):
+        self.path = path
+        self.timeout = timeout
+        self.claimed = False
+
+    def claim(self):
+        """ Attempt to claim the marker. Return True if this process should
+        compute the result, or False if another process or thread is already
+        doing so.
+        """
+        with InFlight._events_lock:
+            if self.path in InFlight._events:
+                return False
+            for attempt in range(2):
+                try:
+                    fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    break
+                except OSError as exc:
+                    if exc.errno == errno.ENOENT:
+                        self._makedirs()
+                        continue
+                    if exc.errno != errno.EEXIST:
+                        raise
+                    if attempt == 0 and self.is_stale():
+                        self._remove()
+                        continue
+                    return False
+            else:
+                return False
+            owner = '%s %d' % (socket.gethostname(), os.getpid())
+            os.write(fd, owner.encode('utf8'))
+            os.close(fd)
+            InFlight._events[self.path] = threading.Event()
+            self.claimed = True
+            return True
+
+    def release(self):
+        """ Remove the marker, waking any waiting threads in this process.
+        """
+        if not self.claimed:
+            return
+        self._remove()
+        self.claimed = False
+        with InFlight._events_lock:
+            event = InFlight._events.pop(self.path, None)
+        if event is not None:
+            event.set()
+
+    def wait(self, timeout=None, max_delay=0.5):
+        """ Wait until the marker is released, or until it is found to be stale.
+
+        Return True if the marker was released, or False if waiting timed out
+        or the owner appears to have died (in which case the caller should
+        compute the result itself).
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start = time.time()
+        with InFlight._events_lock:
+            event = InFlight._events.get(self.path, None)
+        if event is not None:
+            # claimed by another thread in this process
+            event.wait(timeout)
+            return event.is_set()
+
+        delay = 0.005
+        while os.path.exists(self.path):
+            if self.is_stale():
+                return False
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+        return True
+
+    def is_stale(self):
+        """ Return True if the marker was left behind by a process that no
+        longer exists, or is older than the timeout.
+        """
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+            owner = open(self.path).read().split()
+        except (IOError, OSError):
+            # marker was just released
+            return False
+        if age > self.timeout:
+            return True
+        if len(owner) != 2 or not owner[1].isdigit():
+            # marker is still being written; give the owner some time
+            return age > 10.
+        host, pid = owner[0], int(owner[1])
+        if host != socket.gethostname() or not hasattr(os, 'getpgid'):
+            # can only check processes on this host (and not on windows,
+            # where os.kill() would terminate the process)
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError as exc:
+            return exc.errno == errno.ESRCH
+        return False
+
+    def _remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _makedirs(self):
+        path = os.path.dirname(self.path)
+        try:
+            os.makedirs(path)
+        except OSError:
+            # probably another process already created this directory
+            if not os.path.isdir(path):
+                raise
+
+    def __enter__(self):
+        return self.claim()
+
+    def __exit__(self, *args):
+        self.release()
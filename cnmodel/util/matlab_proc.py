@@ -1,6 +1,10 @@
 """
 Simple system for interfacing with a MATLAB process using stdin/stdout pipes.
 
+Commands are sent to MATLAB through its stdin pipe. Real double-precision 
+arrays are transferred as raw binary buffers through a scratch file that is 
+created once per process (in shared memory, where available); all other
+values are transferred as .mat files.
 """
 from process import Process
 from StringIO import StringIO
@@ -59,8 +63,24 @@ class MatlabProcess(object):
     end
     """
     
-    def __init__(self, executable=None, **kwds):
+    def __init__(self, executable=None, transport=None, **kwds):
+        """
+        Parameters
+        ----------
+        executable : str or list or None
+            The MATLAB executable to start. A list is used as the command 
+            prefix (for example an interpreter followed by a script). If None,
+            the first matlab executable found is used.
+        transport : 'raw' | 'mat' | None
+            How arrays are transferred to and from MATLAB. 'raw' moves the 
+            contents of real double arrays through a reusable scratch file; 
+            'mat' saves every transfer to a temporary .mat file. The default
+            is 'raw' if it works with this MATLAB process, otherwise 'mat'.
+        
+        All other keyword arguments are passed to Process.
+        """
         self.__closed = False
+        self.__scratch = None
         self.__refs = weakref.WeakValueDictionary()
         
         # Decide which executables to try
@@ -77,7 +97,11 @@ class MatlabProcess(object):
         self.__proc = None
         for exe in execs:
             try:
-                self.__proc = Process([exe, '-nodesktop', '-nosplash'], **kwds)
+                if isinstance(exe, (list, tuple)):
+                    args = list(exe)
+                else:
+                    args = [exe]
+                self.__proc = Process(args + ['-nodesktop', '-nosplash'], **kwds)
                 break
             except Exception as e:
                 last_exception = e
@@ -86,13 +110,16 @@ class MatlabProcess(object):
         # bail out if we couldn't start any
         if self.__proc is None:
             raise RuntimeError("Could not start MATLAB process.\nPaths attempted: %s "
-                               "\nLast error: %s" % (str(execs), str(e)))
+                               "\nLast error: %s" % (str(execs), str(last_exception)))
 
         
         # Wait a moment for MATLAB to start up, 
         # read the version string
         while True:
-            line = self.__proc.stdout.readline()
+            line = self.__proc.stdout.readline(timeout=1.0)
+            if line == '' and self.__proc.poll() is not None:
+                raise RuntimeError("MATLAB process exited during startup:\n%s" % 
+                                   self.__proc.stderr.read())
             if 'Copyright' in line:
                 # next line is version info
                 self.__version_str = self.__proc.stdout.readline().strip()
@@ -109,6 +136,24 @@ class MatlabProcess(object):
             
         atexit.register(self.close)
         
+        self.__transport = 'mat'
+        if transport in (None, 'raw'):
+            try:
+                self._init_raw_transport()
+                self.__transport = 'raw'
+            except Exception:
+                if transport == 'raw':
+                    raise
+                self._close_scratch()
+        elif transport != 'mat':
+            raise ValueError("transport must be 'raw', 'mat', or None")
+    
+    @property
+    def transport(self):
+        """ The method used to transfer arrays: 'raw' or 'mat'.
+        """
+        return self.__transport
+        
     def __call__(self, cmd, parse_result=True):
         """
         Execute the specified statement(s) on the MATLAB interpreter and return
@@ -142,10 +187,118 @@ class MatlabProcess(object):
             
         raise RuntimeError("No success/failure code found in output (printed above).")
 
+    def _init_raw_transport(self):
+        """ Create the scratch file used for raw transfers, and check that 
+        MATLAB can read and write it.
+        """
+        shm = '/dev/shm'
+        fd, self.__scratch = tempfile.mkstemp(prefix='cnmodel_matlab_', suffix='.bin',
+                                              dir=shm if os.path.isdir(shm) else None)
+        os.close(fd)
+        test = np.arange(6, dtype=np.float64).reshape(2, 3) / 7.
+        self._set_raw(cnm_transport_test_=test)
+        ret = self._get_raw('cnm_transport_test_')
+        self('clear cnm_transport_test_;')
+        if ret is None or ret.shape != test.shape or not np.all(ret == test):
+            raise RuntimeError("Raw array transfer to MATLAB failed.")
+
+    def _close_scratch(self):
+        if self.__scratch is not None:
+            try:
+                os.remove(self.__scratch)
+            except OSError:
+                pass
+            self.__scratch = None
+
+    @staticmethod
+    def _raw_compatible(value):
+        """ Return True if *value* can be sent with the raw transport: a 
+        double-precision array or float. Other numeric types are sent as .mat
+        files, which keep their MATLAB class (int64, single, ...).
+        """
+        if isinstance(value, float):
+            return True
+        return (isinstance(value, np.ndarray) and value.dtype.kind == 'f' and 
+                value.dtype.itemsize == 8)
+
     def _get(self, name):
         """
         Transfer an object from MATLAB to Python.
         """
+        if self.__transport == 'raw':
+            ret = self._get_raw(name)
+            if ret is not None:
+                return ret
+        return self._get_mat(name)
+
+    def _set(self, **kwds):
+        """
+        Transfer an object from Python to MATLAB and assign it to the given
+        variable name.
+        """
+        if self.__transport == 'raw':
+            raw = dict([(k, v) for k, v in kwds.items() if self._raw_compatible(v)])
+            if len(raw) > 0:
+                self._set_raw(**raw)
+            kwds = dict([(k, v) for k, v in kwds.items() if k not in raw])
+        if len(kwds) > 0:
+            self._set_mat(**kwds)
+
+    def _get_raw(self, name):
+        """
+        Transfer a real double array from MATLAB to Python through the scratch
+        file. Return None if the variable is of any other type.
+        
+        MATLAB writes a header giving the number of dimensions and the size
+        of each, followed by the array data in column-major order.
+        """
+        assert isinstance(name, str)
+        out = self("if isa(%s, 'double') && isreal(%s) && ~issparse(%s), "
+                   "cnm_fid_ = fopen('%s', 'w', 'ieee-le'); "
+                   "fwrite(cnm_fid_, [ndims(%s) size(%s)], 'double'); "
+                   "fwrite(cnm_fid_, %s, 'double'); fclose(cnm_fid_); clear cnm_fid_; "
+                   "fprintf('::raw\\n'); end" % 
+                   (name, name, name, self.__scratch, name, name, name))
+        if '::raw' not in out:
+            return None
+        header = np.memmap(self.__scratch, dtype='<f8', mode='r', shape=(1,))
+        ndim = int(header[0])
+        header = np.memmap(self.__scratch, dtype='<f8', mode='r', shape=(1 + ndim,))
+        shape = tuple([int(x) for x in header[1:]])
+        del header
+        size = int(np.prod(shape))
+        if size == 0:
+            return np.zeros(shape)
+        data = np.memmap(self.__scratch, dtype='<f8', mode='r', 
+                         offset=8 * (1 + ndim), shape=shape, order='F')
+        ret = np.array(data, dtype=np.float64)
+        del data
+        return ret
+
+    def _set_raw(self, **kwds):
+        """
+        Transfer double-precision arrays (or floats) from Python to MATLAB
+        through the scratch file. 0- and 1-dimensional arrays become row 
+        vectors.
+        """
+        lines = ["cnm_fid_ = fopen('%s', 'r', 'ieee-le');" % self.__scratch]
+        with open(self.__scratch, 'r+b') as fh:
+            fh.truncate()
+            for name, value in kwds.items():
+                value = np.asarray(value, dtype='<f8')
+                if value.ndim < 2:
+                    value = value.reshape(1, value.size)
+                fh.write(value.ravel(order='F').data)
+                dims = ' '.join([str(d) for d in value.shape])
+                lines.append("%s = reshape(fread(cnm_fid_, %d, 'double=>double'), [%s]);" % 
+                             (name, value.size, dims))
+        lines.append("fclose(cnm_fid_); clear cnm_fid_;")
+        self('\n'.join(lines))
+
+    def _get_mat(self, name):
+        """
+        Transfer an object from MATLAB to Python through a temporary .mat file.
+        """
         assert isinstance(name, str)
         tmp = tempfile.mktemp(suffix='.mat')
         out = self("save('%s', '%s', '-v7')" % (tmp, name))
@@ -153,10 +306,9 @@ class MatlabProcess(object):
         os.remove(tmp)
         return objs[name]
 
-    def _set(self, **kwds):
+    def _set_mat(self, **kwds):
         """
-        Transfer an object from Python to MATLAB and assign it to the given
-        variable name.
+        Transfer objects from Python to MATLAB through a temporary .mat file.
         """
         tmp = tempfile.mktemp(suffix='.mat')
         scipy.io.savemat(tmp, kwds)
@@ -251,6 +403,7 @@ class MatlabProcess(object):
             return
         self('exit;\n', parse_result=False)
         self.__closed = True
+        self._close_scratch()
 
 
 class MatlabReference(object):
@@ -310,8 +463,6 @@ class MatlabFunction(object):
         If _transfer is False, then the return values are left in MATLAB and 
         references to these values are returned instead.
         """
-        import pyqtgraph as pg
-        
         _transfer = kwds.pop('_transfer', True)
         assert len(kwds) == 0
         
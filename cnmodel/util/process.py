@@ -61,7 +61,7 @@ class PipeQueue(Queue):
         
     @staticmethod
     def enqueue_output(out, queue):
-        for line in iter(out.readline, b''):
+        for line in iter(out.readline, ''):
             queue.put(line)
             #print "READ: " + repr(line)
         out.close()
@@ -4,6 +4,7 @@ Tools for generating auditory stimuli.
 from __future__ import division
 import numpy as np
 import scipy
+from . import fingerprint as _fingerprint
 
 
 def create(type, **kwds):
@@ -81,6 +82,53 @@ class Sound(object):
         k['type'] = self.__class__.__name__
         return k
 
+    def fingerprint(self, waveform=False):
+        """
+        Return a fixed-length hex string that identifies this sound.
+
+        The fingerprint is a hash of the normalized parameters in `key()`, so
+        equivalent parameter values (for example 4000 and 4000.0, or lists
+        and tuples with the same items) give the same fingerprint.
+
+        Parameters
+        ----------
+        waveform : bool
+            If True, hash the generated waveform and sample rate instead of
+            the parameters. Sounds that are specified differently but
+            produce identical waveforms then share a fingerprint. This
+            requires the sound to be generated.
+        """
+        if waveform:
+            value = {'rate': self.opts['rate'],
+                     'sound': _fingerprint.array_digest(self.sound)}
+            return _fingerprint.fingerprint(value, salt='sound-waveform')
+        return _fingerprint.fingerprint(self.key(), salt='sound')
+
+    def onset_fingerprint(self):
+        """
+        Return a fingerprint that identifies this sound regardless of its
+        leading and trailing silence, and the onset of the sound.
+
+        The fingerprint is a hash of the sample rate and the generated
+        waveform from its first to its last nonzero sample. Sounds that differ
+        only in their start times (for example TonePip or NoisePip stimuli
+        with all of `pip_start` delayed by the same amount) or in their
+        duration share an onset fingerprint. This requires the sound to be
+        generated.
+
+        Returns
+        -------
+        tuple : (fingerprint, onset) where onset is the index of the first
+            nonzero sample, or (None, None) if the sound is silent.
+        """
+        nonzero = np.flatnonzero(self.sound)
+        if len(nonzero) == 0:
+            return None, None
+        onset, offset = nonzero[0], nonzero[-1]
+        value = {'rate': self.opts['rate'],
+                 'sound': _fingerprint.array_digest(self.sound[onset:offset+1])}
+        return _fingerprint.fingerprint(value, salt='sound-onset'), int(onset)
+
     def measure_dbspl(self, tstart, tend):
         """ 
         Measure the sound pressure for the waveform in a window of time
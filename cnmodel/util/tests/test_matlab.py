@@ -1,7 +1,13 @@
+import os, sys
 import pytest
 import numpy as np
+import cnmodel
 from cnmodel.util.matlab_proc import MatlabProcess
 
+# Stand-in for the MATLAB executable
+fake_matlab = [sys.executable, os.path.join(os.path.dirname(cnmodel.__file__), 
+                                            'an_model', 'tests', 'fake_matlab.py')]
+
 
 def test_matlab():
     global proc
@@ -28,6 +34,42 @@ def test_matlab():
 
     proc.close()
 
+
+def test_transport():
+    arrays = {
+        'a': np.random.normal(size=(3, 5)),
+        'b': np.arange(7.),
+        'c': np.random.normal(size=(2, 3, 4)),
+        'd': np.zeros((0, 3)),
+    }
+    for transport in ('raw', 'mat'):
+        proc = MatlabProcess(executable=fake_matlab, transport=transport)
+        try:
+            assert proc.transport == transport
+            proc._set(**arrays)
+            for name, arr in arrays.items():
+                ret = proc._get(name)
+                if arr.ndim == 1:
+                    # vectors are stored as row vectors
+                    arr = arr.reshape(1, arr.size)
+                if arr.size == 0 and transport == 'mat':
+                    # the shape of empty arrays read by loadmat() depends
+                    # on the scipy version; only the raw transport keeps it
+                    assert ret.size == 0
+                    continue
+                assert ret.shape == arr.shape
+                assert np.all(ret == arr)
+        finally:
+            proc.close()
+    
+    # only double-precision values use the raw transport; others keep their
+    # MATLAB class by going through .mat files
+    for value in (np.zeros(3), 2.5, np.float64(1), np.zeros((2, 0))):
+        assert MatlabProcess._raw_compatible(value)
+    for value in (np.arange(3), np.zeros(3, dtype=np.float32), 3, True, 
+                  np.int32(1), 'abc', np.zeros(2, dtype=complex)):
+        assert not MatlabProcess._raw_compatible(value)
+
     
 if __name__ == '__main__':
     test_matlab()
@@ -79,4 +79,44 @@ def test_noisepip():
     assert not np.any(s1.sound[start:end] == s3.sound[start:end])
 
 
-    
\ No newline at end of file
+def test_fingerprint():
+    kwds = dict(rate=100000, duration=0.1, f0=5321, dbspl=60, 
+                pip_duration=0.08, pip_start=[0.01], ramp_duration=0.02)
+    s1 = sound.TonePip(**kwds)
+    fp = s1.fingerprint()
+    assert len(fp) == 40
+    
+    # equivalent parameters give the same fingerprint
+    kwds2 = dict(kwds, rate=100e3, f0=np.float64(5321.0), pip_start=(0.01,))
+    assert sound.TonePip(**kwds2).fingerprint() == fp
+    assert sound.create(**s1.key()).fingerprint() == fp
+    
+    # different parameters do not
+    assert sound.TonePip(**dict(kwds, f0=5322)).fingerprint() != fp
+    assert sound.NoisePip(seed=1, **dict(kwds, f0=None)).fingerprint() != fp
+    
+    # waveform fingerprints depend only on the generated sound
+    wfp = s1.fingerprint(waveform=True)
+    assert wfp != fp
+    assert sound.TonePip(**kwds2).fingerprint(waveform=True) == wfp
+
+
+def test_onset_fingerprint():
+    kwds = dict(rate=100000, duration=0.1, f0=5321, dbspl=60, 
+                pip_duration=0.04, pip_start=[0.01], ramp_duration=0.005)
+    s1 = sound.TonePip(**kwds)
+    fp, onset = s1.onset_fingerprint()
+    assert onset >= 1000 and onset < 1010
+    
+    # delayed copies share the onset fingerprint
+    s2 = sound.TonePip(**dict(kwds, pip_start=[0.0153], duration=0.12))
+    fp2, onset2 = s2.onset_fingerprint()
+    assert fp2 == fp
+    assert onset2 - onset == 530
+    s3 = sound.NoisePip(seed=1, **dict(kwds, f0=None, pip_start=[0.01, 0.05]))
+    s4 = sound.NoisePip(seed=1, **dict(kwds, f0=None, pip_start=[0.02, 0.06]))
+    assert s3.onset_fingerprint()[0] == s4.onset_fingerprint()[0]
+    
+    # other changes do not
+    assert sound.TonePip(**dict(kwds, dbspl=61)).onset_fingerprint()[0] != fp
+    assert s4.onset_fingerprint()[0] != fp
@@ -0,0 +1,123 @@
+"""
+Multithreaded simulation within a single process, using NEURON's
+ParallelContext.nthread().
+
+NEURON divides the cells of the model among the threads. Every mechanism in
+cnmodel/mechanisms except naRsg is declared THREADSAFE; naRsg solves its
+initial state with a LINEAR block, which is not thread safe, so models with
+cartwheel cells can only be run in one thread. A few things differ from a
+single-threaded run:
+
+* MultiSiteSynapse normally draws release events from the SCoP random number
+  generator shared by all instances, so the order in which threads make
+  their draws would change the result. With release streams (the default
+  for more than one thread), each multisite MultiSiteSynapse instead draws 
+  from its own Random123 stream, derived from its `rseed` and its creation
+  order and restarted at every finitialize(). Results then do not depend on
+  the number of threads (but differ from single-threaded runs without
+  release streams).
+* NEURON cannot run several threads if any NetCon has a delay shorter than
+  two time steps, and the terminals of most cells use a delay of 0. At every
+  finitialize() with more than one thread, or with release streams, such
+  delays are raised to two time steps (so that, again, results do not depend
+  on the number of threads). The original delays are restored at the first
+  finitialize() after returning to one thread without release streams.
+* Receptors read the transmitter concentration of their release site through
+  a POINTER. When the pre- and postsynaptic cells are simulated in different
+  threads, a receptor may see the concentration from the previous time step.
+
+With the default arguments, set_threads(1) gives exactly the same results
+as a model that never used set_threads().
+"""
+from neuron import h
+
+_thread_init = None  # FInitializeHandler installed by set_threads()
+_release_streams = False
+_release_rngs = []  # Random objects used by MultiSiteSynapse instances
+_min_delay_steps = 2  # minimum NetCon delay usable with threads, in time steps
+_short_delays = {}  # NetCon name: original delay, for delays that were raised
+
+
+def set_threads(n, release_streams=None):
+    """
+    Simulate the model in *n* threads. Return the previous number of threads.
+
+    If *release_streams* is True, each multisite MultiSiteSynapse draws from
+    its own random number stream in all following runs (see above); if
+    False, they return to the shared generator. By default, release streams
+    are used if *n* is greater than 1.
+    """
+    global _thread_init, _release_streams, _release_rngs
+    if n < 1:
+        raise ValueError("Number of threads must be at least 1.")
+    if release_streams is None:
+        release_streams = n > 1
+    pc = h.ParallelContext()
+    previous = int(pc.nthread())
+    if n != previous:
+        pc.nthread(n)
+    if _thread_init is None:
+        # type 3 handlers run before NEURON checks the NetCon delays
+        _thread_init = h.FInitializeHandler(3, _init_threads)
+    if _release_streams and not release_streams:
+        for relsite in h.List('MultiSiteSynapse'):
+            if relsite.multisite == 1:
+                relsite.setUniformRNG()
+        _release_rngs = []
+    _release_streams = release_streams
+    return previous
+
+
+def _init_threads():
+    """ Called at the beginning of each finitialize() once set_threads() has
+    been used.
+    """
+    _init_min_delay()
+    _init_release_streams()
+
+
+def _init_min_delay():
+    """ Raise the delay of every NetCon to at least _min_delay_steps time
+    steps if threads or release streams are in use, or restore the delays
+    raised earlier otherwise.
+
+    Only the original delays are kept, by NetCon name, so that NetCons can 
+    be deleted with the rest of the model; names of deleted NetCons are
+    dropped here.
+    """
+    global _short_delays
+    raise_delays = int(h.ParallelContext().nthread()) > 1 or _release_streams
+    min_delay = _min_delay_steps * h.dt
+    delays = {}
+    for nc in h.List('NetCon'):
+        name = nc.hname()
+        if name in _short_delays:
+            delays[name] = _short_delays[name]
+            if not raise_delays:
+                nc.delay = delays[name]
+        if raise_delays and nc.delay < min_delay:
+            delays.setdefault(name, nc.delay)
+            nc.delay = min_delay
+    _short_delays = delays if raise_delays else {}
+
+
+def _init_release_streams():
+    """ Restart the random number stream of every multisite MultiSiteSynapse.
+
+    The streams must outlive the mechanisms that use them, so they are kept
+    until the next call.
+    """
+    global _release_rngs
+    if not _release_streams:
+        return
+    rngs = []
+    for i, relsite in enumerate(h.List('MultiSiteSynapse')):
+        if relsite.multisite != 1:
+            continue
+        seed = int(relsite.rseed)
+        rng = h.Random()
+        rng.Random123(i, seed % 2**32, (seed // 2**32) % 2**32)
+        rng.uniform(0, 1)
+        relsite.setUniformRNG(rng)
+        rngs.append(rng)
+    _release_rngs = rngs
@@ -0,0 +1,75 @@
+"""
+Measure how the simulation time of a cochlear nucleus circuit scales with the
+number of MPI ranks, using populations.DistributedNetwork.
+
+The circuit is the one built in examples/test_physiology.py (SGC, bushy,
+D-stellate, T-stellate and tuberculoventral populations), driven by a tone
+pip. Real bushy and T-stellate cells are selected near 16 kHz and their
+inputs resolved to depth 2. Rank 0 prints the largest build and simulation
+times over all ranks, the number of synapses made within and across ranks,
+and the number of spikes recorded.
+
+Usage::
+
+    mpiexec -n 1 python examples/benchmark_distributed.py [n_cells] [split]
+    mpiexec -n 4 python examples/benchmark_distributed.py [n_cells] [split]
+
+*n_cells* is the number of real cells selected in each of the bushy and
+T-stellate populations (default 20); *split* is 'round_robin' (default) or
+'cf'.
+"""
+from __future__ import print_function
+import sys, time
+from neuron import h
+from cnmodel import populations
+from cnmodel.util import sound, random, custom_init
+
+n_cells = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+split = sys.argv[2] if len(sys.argv) > 2 else 'round_robin'
+seed = 34657845
+temp = 34.0
+dt = 0.025
+
+start = time.time()
+random.set_seed(seed)
+sgc = populations.SGC(model='dummy')
+bushy = populations.Bushy()
+dstellate = populations.DStellate()
+tstellate = populations.TStellate()
+tuberculoventral = populations.Tuberculoventral()
+pops = [sgc, dstellate, tuberculoventral, tstellate, bushy]
+net = populations.DistributedNetwork(pops, split=split, mpi=True)
+
+sgc.connect(bushy, dstellate, tuberculoventral, tstellate)
+dstellate.connect(bushy, tstellate)
+tuberculoventral.connect(bushy, tstellate)
+tstellate.connect(bushy)
+
+bushy.select(n_cells, cf=16e3, create=True)
+tstellate.select(n_cells, cf=16e3, create=True)
+bushy.resolve_inputs(depth=2)
+tstellate.resolve_inputs(depth=2)
+build_time = time.time() - start
+
+stim = sound.TonePip(rate=100e3, duration=0.1, f0=16e3, dbspl=50,
+                     ramp_duration=2.5e-3, pip_duration=0.04, pip_start=[0.02])
+sgc.set_seed(seed)
+sgc.set_sound_stim(stim, parallel=False)
+
+h.celsius = temp
+h.dt = dt
+net.record_spikes()
+start = time.time()
+net.run(stim.duration * 1000, init=custom_init)
+run_time = time.time() - start
+
+build_time = net.pc.allreduce(build_time, 2)
+run_time = net.pc.allreduce(run_time, 2)
+local = net.pc.allreduce(net.stats['local_synapses'], 1)
+remote = net.pc.allreduce(net.stats['remote_synapses'], 1)
+spikes = net.gather_spikes()
+if net.rank == 0:
+    print("ranks: %d  split: %s  cells per population: %d" % (net.nhost, split, n_cells))
+    print("synapses: %d within ranks, %d across ranks" % (local, remote))
+    print("build: %0.2f s  simulate: %0.2f s  spikes: %d" % (build_time, run_time, len(spikes[0])))
+net.done()
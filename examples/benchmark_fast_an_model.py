@@ -0,0 +1,49 @@
+"""
+Compare the fast approximate auditory periphery simulator (simulator='fast')
+with the Zilany et al. (2014) model, in speed and in the spike trains produced.
+
+The reference trains are loaded through the AN cache, so they only need to be
+generated by the (slow) Zilany model the first time this is run.
+
+Usage::
+
+    python examples/benchmark_fast_an_model.py [reference_simulator]
+
+where reference_simulator is 'cochlea' or 'matlab' (default is whichever is
+available).
+"""
+from __future__ import print_function
+import sys, time
+import numpy as np
+from cnmodel.an_model import cache, fast
+from cnmodel.util import sound
+
+reference = sys.argv[1] if len(sys.argv) > 1 else cache.detect_simulator()
+
+stim = sound.TonePip(rate=100e3, duration=0.2, f0=4000, dbspl=60,
+                     ramp_duration=2.5e-3, pip_duration=0.1, pip_start=[0.05])
+seeds = list(range(20))
+
+# Throughput: a population of fibers spanning the SGC CF range
+ncf = 100
+cfs = np.logspace(np.log10(2e3), np.log10(40e3), ncf)
+srs = np.arange(ncf) % 3
+start = time.time()
+fast.generate_spiketrains(cfs, srs, seeds[0], stim)
+fast_time = time.time() - start
+# time a few reference fibers only; this is slow
+nref = 3
+start = time.time()
+cache.generate_spiketrains(cfs[:nref], srs[:nref], seeds[0], stim, simulator=reference)
+ref_time = (time.time() - start) * ncf / nref
+print("Time to generate %d fibers: fast %0.2f s, %s %0.2f s (estimated), speedup %0.0fx"
+      % (ncf, fast_time, reference, ref_time, ref_time / fast_time))
+
+# Fidelity: compare PSTHs of fibers near and away from the tone frequency
+print("\nFidelity relative to %s (%d trains per fiber)" % (reference, len(seeds)))
+print("%8s %3s %12s %12s %10s %10s" % ('CF', 'SR', 'rate', 'ref rate', 'PSTH r', 'PSTH rms'))
+test_cfs = [1000, 4000, 4000, 4000, 8000, 16000]
+test_srs = [2, 0, 1, 2, 2, 2]
+for row in fast.fidelity_report(stim, test_cfs, test_srs, seeds, reference=reference):
+    print("%8.0f %3d %12.1f %12.1f %10.2f %10.1f" % (row['cf'], row['sr'], row['rate'],
+          row['ref_rate'], row['psth_corr'], row['psth_rms']))
@@ -0,0 +1,49 @@
+"""
+Compare the speed of transferring arrays to and from MATLAB using the raw
+scratch-file transport and the .mat file transport of MatlabProcess.
+
+Each array is sent to MATLAB and read back several times; the average
+throughput of the round trip is printed for each transport and array size.
+
+Usage::
+
+    python examples/benchmark_matlab_transport.py [--fake]
+
+With --fake, the MATLAB stand-in used by the test suite is benchmarked instead
+of MATLAB (useful for measuring the overhead on the Python side only).
+"""
+from __future__ import print_function
+import os, sys, time
+import numpy as np
+import cnmodel
+from cnmodel.util.matlab_proc import MatlabProcess
+
+executable = None
+if '--fake' in sys.argv:
+    executable = [sys.executable, os.path.join(os.path.dirname(cnmodel.__file__),
+                                               'an_model', 'tests', 'fake_matlab.py')]
+
+sizes = [10**3, 10**5, 10**6, 4 * 10**6]
+repeats = 5
+
+procs = {}
+for transport in ('mat', 'raw'):
+    procs[transport] = MatlabProcess(executable=executable, transport=transport)
+
+print("%10s %12s %12s %12s" % ('samples', 'mat (MB/s)', 'raw (MB/s)', 'speedup'))
+for size in sizes:
+    data = np.random.normal(size=(1, size))
+    rates = {}
+    for transport, proc in procs.items():
+        start = time.time()
+        for i in range(repeats):
+            proc._set(benchmark_data=data)
+            ret = proc._get('benchmark_data')
+        elapsed = time.time() - start
+        assert np.all(ret == data)
+        rates[transport] = 2 * repeats * data.nbytes / elapsed / 1e6
+    print("%10d %12.1f %12.1f %11.1fx" % (size, rates['mat'], rates['raw'],
+                                          rates['raw'] / rates['mat']))
+
+for proc in procs.values():
+    proc.close()
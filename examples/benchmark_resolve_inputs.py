@@ -0,0 +1,51 @@
+"""
+Compare the time taken to resolve the inputs of a population cell by cell
+with ``resolve_inputs(bulk=True)``, for increasing numbers of real cells.
+
+For each number of real bushy cells, this reports:
+
+* select: time to choose the SGC inputs of all cells, without creating any
+  cells or synapses (connection_stats() and select() for each cell, versus
+  connection_stats_many() and select_weighted() for all cells at once).
+* resolve: total time taken by resolve_inputs(), including the creation of
+  SGCs and synapses.
+
+Usage::
+
+    python examples/benchmark_resolve_inputs.py [n_cells ...]
+"""
+from __future__ import print_function
+import sys, time
+import numpy as np
+from cnmodel import populations
+
+sizes = [int(n) for n in sys.argv[1:]] or [10, 30, 100, 300]
+
+print("%8s %12s %12s %12s %12s" % ('cells', 'select', 'bulk select', 'resolve', 'bulk resolve'))
+for n in sizes:
+    times = []
+    for bulk in (False, True):
+        sgc = populations.SGC()
+        bushy = populations.Bushy()
+        sgc.connect(bushy)
+        # real bushy cells spread evenly across the population
+        inds = np.linspace(0, len(bushy.cells) - 1, n).astype(int)
+        bushy.create_cells(inds)
+
+        cell_recs = bushy.cells[inds]
+        np.random.seed(0)
+        start = time.time()
+        if bulk:
+            nconn, weights = bushy.connection_stats_many(sgc, cell_recs)
+            sgc.select_weighted(nconn, weights)
+        else:
+            for rec in cell_recs:
+                size, dist = bushy.connection_stats(sgc, rec)
+                sgc.select(size, **dist)
+        times.append(time.time() - start)
+
+        start = time.time()
+        bushy.resolve_inputs(depth=1, bulk=bulk)
+        times.append(time.time() - start)
+
+    print("%8d %10.3f s %10.3f s %10.3f s %10.3f s" % (n, times[0], times[2], times[1], times[3]))
@@ -0,0 +1,99 @@
+"""
+Measure the wall time of one simulation of a cochlear nucleus circuit for
+increasing numbers of threads (see Protocol.set_threads()).
+
+The circuit is the one built in examples/test_physiology.py: SGC, bushy,
+D-stellate, T-stellate and tuberculoventral populations. Real bushy and
+T-stellate cells are selected near 16 kHz and their inputs resolved to
+depth 2, giving several hundred cells, which are driven by a tone pip.
+
+For each thread count, this prints the simulation time, the speedup over one
+thread, and the total number of spikes in the bushy and T-stellate cells.
+With more than one thread, each release site draws from its own random
+stream and synaptic delays are raised to two time steps (see util.threads),
+so the spike counts should be the same for every thread count above 1 (up
+to the effect of transmitter read one time step late across threads). The
+single-threaded run is the unmodified model, whose counts differ slightly.
+The speedup is limited by the number of CPU cores available.
+
+Usage::
+
+    python examples/benchmark_threads.py [n_cells] [threads ...]
+
+*n_cells* is the number of real cells selected in each of the bushy and
+T-stellate populations (default 100).
+"""
+from __future__ import print_function
+import sys, time
+from neuron import h
+from cnmodel import populations
+from cnmodel.protocols import Protocol
+from cnmodel.util import sound, random
+
+n_cells = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+thread_counts = [int(n) for n in sys.argv[2:]] or [1, 2, 4, 8]
+
+
+class ThreadBenchmark(Protocol):
+    def __init__(self, n_cells, seed=34657845, temp=34.0, dt=0.025):
+        Protocol.__init__(self)
+        self.seed = seed
+        self.temp = temp
+        self.dt = dt
+
+        random.set_seed(seed)
+        self.sgc = populations.SGC(model='dummy')
+        self.bushy = populations.Bushy()
+        self.dstellate = populations.DStellate()
+        self.tstellate = populations.TStellate()
+        self.tuberculoventral = populations.Tuberculoventral()
+        self.pops = [self.sgc, self.dstellate, self.tuberculoventral, self.tstellate, self.bushy]
+
+        self.sgc.connect(self.bushy, self.dstellate, self.tuberculoventral, self.tstellate)
+        self.dstellate.connect(self.bushy, self.tstellate)
+        self.tuberculoventral.connect(self.bushy, self.tstellate)
+        self.tstellate.connect(self.bushy)
+
+        self.bushy.select(n_cells, cf=16e3, create=True)
+        self.tstellate.select(n_cells, cf=16e3, create=True)
+        self.bushy.resolve_inputs(depth=2, bulk=True)
+        self.tstellate.resolve_inputs(depth=2, bulk=True)
+
+        self.stim = sound.TonePip(rate=100e3, duration=0.1, f0=16e3, dbspl=50,
+                                  ramp_duration=2.5e-3, pip_duration=0.04,
+                                  pip_start=[0.02])
+        self.sgc.set_seed(seed)
+        self.sgc.set_sound_stim(self.stim, parallel=False)
+
+    def n_real_cells(self):
+        return sum([len(pop.real_cells()) for pop in self.pops])
+
+    def run(self, threads=None):
+        """ Simulate the circuit and return the number of spikes in the real
+        bushy and T-stellate cells.
+        """
+        Protocol.run(self, seed=self.seed, threads=threads)
+        self.record_spikes([self.bushy, self.tstellate])
+
+        h.tstop = self.stim.duration * 1000
+        h.celsius = self.temp
+        h.dt = self.dt
+        self.custom_init()
+        while h.t < h.tstop:
+            h.fadvance()
+        return len(self.spikes())
+
+
+start = time.time()
+bench = ThreadBenchmark(n_cells)
+print("Built %d cells in %0.1f s" % (bench.n_real_cells(), time.time() - start))
+
+print("%8s %12s %8s %8s" % ('threads', 'simulate', 'speedup', 'spikes'))
+base = None
+for n in thread_counts:
+    start = time.time()
+    spikes = bench.run(threads=n)
+    elapsed = time.time() - start
+    if base is None:
+        base = elapsed
+    print("%8d %10.2f s %8.2f %8d" % (n, elapsed, base / elapsed, spikes))
@@ -27,7 +27,11 @@ import timeit
 
 
 class CNSoundStim(Protocol):
-    def __init__(self, seed, temp=34.0, dt=0.025, synapsetype='simple'):
+    def __init__(self, seed, temp=34.0, dt=0.025, synapsetype='simple', circuit=None):
+        """If *circuit* names an existing file, the network is loaded from it 
+        (see populations.load_circuit()) instead of being generated. Otherwise
+        the generated network is saved there.
+        """
         Protocol.__init__(self)
         
         self.seed = seed
@@ -35,12 +39,19 @@ class CNSoundStim(Protocol):
         self.dt = dt
 #        self.synapsetype = synapsetype  # simple or multisite
         
+        if circuit is not None and os.path.isfile(circuit):
+            self.populations = populations.load_circuit(circuit)
+            for name, pop in self.populations.items():
+                setattr(self, name, pop)
+            return
+        
         # Seed now to ensure network generation is stable
         random.set_seed(seed)
         # Create cell populations.
         # This creates a complete set of _virtual_ cells for each population. No 
         # cells are instantiated at this point.
-        self.sgc = populations.SGC(model='dummy')
+        # SGC spike trains are replayed by a single PatternStim
+        self.sgc = populations.SGC(model='dummy', replay='pattern')
         self.bushy = populations.Bushy()
         self.dstellate = populations.DStellate()
         self.tstellate = populations.TStellate()
@@ -81,27 +92,55 @@ class CNSoundStim(Protocol):
         # (level 1) creates presynaptic cells in the dstellate population, and resolving
         # inputs for the dstellate population (level 2) creates presynaptic cells in the
         # sgc population.
+        
+        if circuit is not None:
+            populations.save_circuit(circuit, self.populations)
+
+    def trial_seeds(self, seed):
+        """Return 2 new seeds derived from the trial *seed*: one for the NEURON 
+        simulation and one for the SGC spike generator.
+        """
+        rs = np.random.RandomState()
+        rs.seed(self.seed ^ seed)
+        seed1, seed2 = rs.randint(0, 2**32, 2)
+        return seed1, seed2
+
+    def prefetch(self, trials, depth=1):
+        """Return a prefetcher that prepares the SGC spike trains for a list of
+        (stim, seed) *trials* in the background, to be passed to run() for
+        each trial in turn.
+        """
+        return self.sgc.prefetch([(stim, self.trial_seeds(seed)[1]) for stim, seed in trials],
+                                 depth=depth)
 
-    def run(self, stim, seed):
+    def run(self, stim, seed, prefetcher=None, threads=None, record_vm=()):
         """Run the network simulation with *stim* as the sound source and a unique
         *seed* used to configure the random number generators.
+        
+        If *prefetcher* is given (see prefetch()), the SGC spike trains are taken
+        from it rather than loaded before the simulation starts. If *threads* is
+        given, the simulation is split across that many threads.
+        
+        Spike times are recorded for all real cells. The somatic membrane 
+        potential is recorded only for the cells listed in *record_vm*, as
+        (population name, cell index) pairs; the results hold None for the 
+        others.
         """
         self.reset()
+        self.set_threads(threads)
         
         # Generate 2 new seeds for the SGC spike generator and for the NEURON simulation
-        rs = np.random.RandomState()
-        rs.seed(self.seed ^ seed)
-        seed1, seed2 = rs.randint(0, 2**32, 2)
+        seed1, seed2 = self.trial_seeds(seed)
         random.set_seed(seed1)
         self.sgc.set_seed(seed2)
         
-        self.sgc.set_sound_stim(stim, parallel=False)
+        self.sgc.set_sound_stim(stim, parallel=False, prefetcher=prefetcher)
         
-        # set up recording vectors
-        for pop in self.bushy, self.dstellate, self.tstellate, self.tuberculoventral:
-            for ind in pop.real_cells():
-                cell = pop.get_cell(ind)
-                self[cell] = cell.soma(0.5)._ref_v
+        # set up recording
+        pops = [self.bushy, self.dstellate, self.tstellate, self.tuberculoventral]
+        recorder = self.record_spikes(pops)
+        for name, ind in record_vm:
+            self[(name, ind)] = getattr(self, name).get_cell(ind).soma(0.5)._ref_v
         self['t'] = h._ref_t
             
         h.tstop = stim.duration * 1000
@@ -119,18 +158,14 @@ class CNSoundStim(Protocol):
                 print "%0.2f / %0.2f" % (h.t, h.tstop)
                 last_update = now
         
-        # record vsoma and spike times for all cells
-        vec = {}
-        for k in self._vectors:
-            v = self[k].copy()
-            if k == 't':
-                vec[k] = v
-                continue
-            spike_inds = np.argwhere((v[1:]>-20) & (v[:-1]<=-20))[:,0]
-            spikes = self['t'][spike_inds]
-            pop = k.type
-            cell_ind = getattr(self, pop).get_cell_index(k)
-            vec[(pop, cell_ind)] = [v, spikes]
+        # record spike times for all cells, and vsoma for selected cells
+        vec = {'t': self['t']}
+        spikes = recorder.spikes()
+        for pop in pops:
+            for ind in pop.real_cells():
+                key = (pop.type, ind)
+                v = self[key] if key in self._vectors else None
+                vec[key] = [v, recorder.spike_times(pop, ind, spikes)]
         
         # record SGC spike trains
         for ind in self.sgc.real_cells():
@@ -233,12 +268,12 @@ class NetworkSimDisplay(pg.QtGui.QSplitter):
             return
         pop, ind = self.selected_cell
         
-        rec = pop._cells[ind]
+        conns = pop.cell_connections(ind)
         i = 0
         plots = []
         # plot spike times for all presynaptic cells
         labels = []
-        if rec['connections'] == 0:
+        if not conns:
             return
         
         pop_colors = {'dstellate': 'y', 'tuberculoventral': 'r', 'sgc': 'g', 'tstellate': 'b'}
@@ -246,7 +281,7 @@ class NetworkSimDisplay(pg.QtGui.QSplitter):
         pop_order = [self.prot.sgc, self.prot.dstellate, self.prot.tuberculoventral]
         trials = self.selected_trials()
         for pop in pop_order:
-            pre_inds = rec['connections'].get(pop, [])
+            pre_inds = conns.get(pop, [])
             for preind in pre_inds:
                 # iterate over all trials
                 for j in trials:
@@ -419,7 +454,7 @@ class NetworkTree(QtGui.QTreeWidget):
         item = QtGui.QTreeWidgetItem([str(cell)])
         grp_item.addChild(item)
         all_conns = pop.cell_connections(cell)
-        if all_conns == 0:
+        if not all_conns:
             return
         for cpop, conns in all_conns.items():
             pop_grp = QtGui.QTreeWidgetItem([cpop.type, str(conns)])
@@ -451,7 +486,6 @@ class NetworkVisualizer(pg.PlotWidget):
         cells = []
         for y,pop in enumerate(self.pops.values()):
             pop.cell_spots = []
-            pop.fwd_connections = {}
             for i,cell in enumerate(pop._cells):
                 pos = (np.log10(cell['cf']), y)
                 real = cell['cell'] != 0
@@ -467,28 +501,19 @@ class NetworkVisualizer(pg.PlotWidget):
         
         self.getAxis('left').setTicks([list(enumerate(self.pops.keys()))])
         
-        # now assign connection lines and record forward connectivity
+        # now assign connection lines
         con_x = []
         con_y = []
         for pop in self.pops.values():
-            for i,cell in enumerate(pop._cells):
-                conns = cell['connections']
-                if conns == 0:
-                    continue
-                for prepop, precells in conns.items():
+            for prepop in pop.pre_connections:
+                synapses = pop.connection_table(prepop).synapses
+                for i, j in zip(synapses['post'], synapses['pre']):
                     spot = pop.cell_spots[i]
-                    if spot is None:
+                    spot2 = prepop.cell_spots[j]
+                    if spot is None or spot2 is None:
                         continue
-                    p1 = spot['x'], spot['y']
-                    for j in precells:
-                        prepop.fwd_connections.setdefault(j, [])
-                        prepop.fwd_connections[j].append((pop, i))
-                        spot2 = prepop.cell_spots[j]
-                        if spot2 is None:
-                            return
-                        p2 = spot2['x'], spot2['y']
-                        con_x.extend([p1[0], p2[0]])
-                        con_y.extend([p1[1], p2[1]])
+                    con_x.extend([spot['x'], spot2['x']])
+                    con_y.extend([spot['y'], spot2['y']])
         self.connections.setData(x=con_x, y=con_y, connect='pairs', pen=(255, 255, 255, 60))
         
     def cells_clicked(self, *args):
@@ -503,25 +528,24 @@ class NetworkVisualizer(pg.PlotWidget):
             self.selected.hide()
             return
         
-        rec = pop._cells[i]
         pos = selected.pos()
         spots = [{'x': pos.x(), 'y': pos.y(), 'size': 15, 'symbol': 'o', 'pen': 'y', 'brush': 'b'}]
 
         # display presynaptic cells
-        if rec['connections'] != 0:
-            for prepop, preinds in rec['connections'].items():
-                for preind in preinds:
-                    spot = prepop.cell_spots[preind].copy()
-                    spot['size'] = 15
-                    spot['brush'] = 'r'
-                    spots.append(spot)
+        for prepop, preinds in pop.cell_connections(i).items():
+            for preind in preinds:
+                spot = prepop.cell_spots[preind].copy()
+                spot['size'] = 15
+                spot['brush'] = 'r'
+                spots.append(spot)
                 
         # display postsynaptic cells
-        for postpop, postind in pop.fwd_connections.get(i, []):
-            spot = postpop.cell_spots[postind].copy()
-            spot['size'] = 15
-            spot['brush'] = 'g'
-            spots.append(spot)
+        for postpop in pop.post_connections:
+            for postind in postpop.connection_table(pop).post_indexes(i):
+                spot = postpop.cell_spots[postind].copy()
+                spot['size'] = 15
+                spot['brush'] = 'g'
+                spots.append(spot)
         
         self.selected.setData(spots)
         self.selected.show()
@@ -561,7 +585,11 @@ if __name__ == '__main__':
         os.mkdir(cachepath)
 
     seed = 34657845
-    prot = CNSoundStim(seed=seed, synapsetype=syntype)
+    circuit = os.path.join(cachepath, 'circuit_seed=%d_syntype=%s.npz' % (seed, syntype))
+    prot = CNSoundStim(seed=seed, synapsetype=syntype, circuit=circuit)
+    # record membrane potential only for the bushy cells; spike times are
+    # recorded for all cells
+    record_vm = [('bushy', ind) for ind in prot.bushy.real_cells()]
     i = 0
     
     start_time = timeit.default_timer()
@@ -577,23 +605,49 @@ if __name__ == '__main__':
     results = {}
     workers = 1 if not parallel else None
     tot_runs = len(fvals) * len(levels) * nreps
-    with mp.Parallelize(enumerate(tasks), results=results, progressDialog='Running parallel simulation..', workers=workers) as tasker:
-        for i, task in tasker:
-            f, db, iteration = task
-            stim = sound.TonePip(rate=100e3, duration=stimpar['dur'], f0=f, dbspl=db,  # dura 0.2, pip_start 0.1 pipdur 0.04
-                                    ramp_duration=2.5e-3, pip_duration=stimpar['pip'], 
-                                    pip_start=stimpar['start'])
+    def make_stim(f, db):
+        return sound.TonePip(rate=100e3, duration=stimpar['dur'], f0=f, dbspl=db,  # dura 0.2, pip_start 0.1 pipdur 0.04
+                             ramp_duration=2.5e-3, pip_duration=stimpar['pip'], 
+                             pip_start=stimpar['start'])
+    def cache_file(f, db, iteration):
+        return os.path.join(cachepath, 'seed=%d_f0=%f_dbspl=%f_syntype=%s_iter=%d.pk' % (seed, f, db, syntype, iteration))
     
-            print("=== Start run %d/%d ===" % (i+1, tot_runs))
-            cachefile = os.path.join(cachepath, 'seed=%d_f0=%f_dbspl=%f_syntype=%s_iter=%d.pk' % (seed, f, db, syntype, iteration))
-            if '--ignore-cache' in sys.argv or not os.path.isfile(cachefile):
-                result = prot.run(stim, seed=i)
-                pickle.dump(result, open(cachefile, 'wb'))
-            else:
-                print("  (Loading cached results)")
-                result = pickle.load(open(cachefile, 'rb'))
-            tasker.results[(f, db, iteration)] = (stim, result)
-            print('--- finished run %d/%d ---' % (i+1, tot_runs))
+    if parallel:
+        with mp.Parallelize(enumerate(tasks), results=results, progressDialog='Running parallel simulation..', workers=workers) as tasker:
+            for i, task in tasker:
+                f, db, iteration = task
+                stim = make_stim(f, db)
+        
+                print("=== Start run %d/%d ===" % (i+1, tot_runs))
+                cachefile = cache_file(f, db, iteration)
+                if '--ignore-cache' in sys.argv or not os.path.isfile(cachefile):
+                    result = prot.run(stim, seed=i, record_vm=record_vm)
+                    pickle.dump(result, open(cachefile, 'wb'))
+                else:
+                    print("  (Loading cached results)")
+                    result = pickle.load(open(cachefile, 'rb'))
+                tasker.results[(f, db, iteration)] = (stim, result)
+                print('--- finished run %d/%d ---' % (i+1, tot_runs))
+    else:
+        # Run trials in this process; SGC spike trains for the next trial are
+        # prepared in the background while each trial is simulated.
+        todo = [i for i, task in enumerate(tasks) if 
+                '--ignore-cache' in sys.argv or not os.path.isfile(cache_file(*task))]
+        todo_set = set(todo)
+        stims = dict([(task, make_stim(*task[:2])) for task in tasks])
+        with prot.prefetch([(stims[tasks[i]], i) for i in todo]) as prefetcher:
+            for i, task in enumerate(tasks):
+                f, db, iteration = task
+                print("=== Start run %d/%d ===" % (i+1, tot_runs))
+                cachefile = cache_file(f, db, iteration)
+                if i in todo_set:
+                    result = prot.run(stims[task], seed=i, prefetcher=prefetcher, record_vm=record_vm)
+                    pickle.dump(result, open(cachefile, 'wb'))
+                else:
+                    print("  (Loading cached results)")
+                    result = pickle.load(open(cachefile, 'rb'))
+                results[(f, db, iteration)] = (stims[task], result)
+                print('--- finished run %d/%d ---' % (i+1, tot_runs))
         
     # get time of run before display
     elapsed = timeit.default_timer() - start_time
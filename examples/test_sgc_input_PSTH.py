@@ -4,6 +4,7 @@ import pyqtgraph as pg
 from neuron import h
 from cnmodel.protocols import Protocol
 from cnmodel import cells
+from cnmodel import an_model
 from cnmodel.util import sound
 from cnmodel.util import custom_init
 import cnmodel.util.pynrnutilities as PU
@@ -12,9 +13,9 @@ from cnmodel import data
 synapseType = 'simple'
 species = 'mouse'  # tables for other species do not yet exist
 
-def runTrial(cell, info):
+def runTrial(cell, info, trial):
     """
-    info is a dict
+    info is a dict; info['trains'] holds the AN trials for each SGC input
     """
     if cell == 'bushy':
         post_cell = cells.Bushy.create(species=species)
@@ -46,7 +47,7 @@ def runTrial(cell, info):
                 xmtr['xmtr%04d'%j].record(synapses[-1].terminal.relsite._ref_XMTR[i])
                 j = j + 1
             synapses[-1].terminal.relsite.Dep_Flag = False  # no depression in these simulations
-        pre_cells[-1].set_sound_stim(info['stim'], seed = info['seed'] + nsgc, simulator=info['simulator'])
+        pre_cells[-1].set_spiketrain(info['trains'][nsgc][trial] * 1000)
     Vm = h.Vector()
     Vm.record(post_cell.soma(0.5)._ref_v)
     rtime = h.Vector()
@@ -114,10 +115,14 @@ class SGCInputTestPSTH(Protocol):
                 'simulator': self.simulator, 'cf': self.cf, 'sr': self.sr,
                 'seed': seed, 'run_duration': self.run_duration,
                 'temp': temp, 'dt': dt, 'init': custom_init}
+        # all trials of each SGC input are generated (or loaded from the 
+        # cache) in a single call
+        info['trains'] = an_model.get_spiketrains(self.cf, self.sr, seed + np.arange(self.n_sgc),
+                                                  self.stim, ntrials=self.nrep, 
+                                                  simulator=self.simulator)
         if not parallelize:
             for nr in range(self.nrep):
-                info['seed'] = seed + 3*self.n_sgc*nr
-                res = runTrial(self.cell, info)
+                res = runTrial(self.cell, info, nr)
                 # res contains: {'time': time, 'vm': Vm, 'xmtr': xmtr, 'pre_cells': pre_cells, 'post_cell': post_cell}
                 self.pre_cells[nr] = res['pre_cells']
                 self.time[nr] = res['time']